@@ -18,3 +18,4 @@ from repcrec.lock_manager import LockManager
 from repcrec.site import Site
 from repcrec.transaction_manager import TransactionManager
 from repcrec.commands import CommandStreamReader, TestFile
+from repcrec.topology import Topology
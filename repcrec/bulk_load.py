@@ -0,0 +1,100 @@
+'''
+Bulk load of initial site data.
+
+Site data are given as columns: an array of variables in increasing order and
+an array of their initial values. A single streaming pass over the columns
+writes the data files of all sites in the format read by the DatabaseManager,
+so no per-site dict of values is ever built. Sites created afterward with
+bulk_loaded data take their variables from these files.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec.database_manager import DatabaseManager
+from repcrec.site import Site
+from repcrec.data_file import BinaryDataFileWriter
+
+import array
+import itertools as it
+import os
+
+class _TextDataFileWriter(object):
+	''' Write a text data file one variable at a time. '''
+
+	def __init__(self, data_file):
+		''' Start a new data file. '''
+		self._data_file = data_file
+		self._data_file.write('{')
+		self._separator = ''
+
+	def append(self, variable, value):
+		''' Write the value of the next variable. '''
+		self._data_file.write('{}{}: {}'.format(self._separator, variable, value))
+		self._separator = ', '
+
+	def close(self):
+		''' End the data file. The file is left open. '''
+		self._data_file.write('}')
+
+def bulk_load(data_path, sites, variables, values, replicas,
+		data_format=DatabaseManager.TEXT_FORMAT):
+	'''
+	Write the data files of all sites in one pass over columnar data.
+
+	Parameters
+	----------
+	data_path : string
+		Path where site data files reside. Existing data files are replaced.
+	sites : list of integer
+		Indices of all sites. Sites holding no variables get empty files.
+	variables : sequence of integer
+		Variables in strictly increasing order.
+	values : sequence of integer
+		Initial value of each variable.
+	replicas : function
+		Function of a variable returning the indices of the sites that hold it.
+	data_format : DatabaseManager.TEXT_FORMAT or BINARY_FORMAT
+		Format of the data files.
+
+	Returns
+	-------
+	site_variables : dict
+		Dict of site indices to an array of the variables written to each
+		site, which is suitable as a bulk loaded TransactionManager data file
+		map.
+	'''
+
+	if len(variables) != len(values):
+		raise ValueError('Bulk load has {} variables but {} values'
+				.format(len(variables), len(values)))
+
+	binary = data_format is DatabaseManager.BINARY_FORMAT
+	writer_type = BinaryDataFileWriter if binary else _TextDataFileWriter
+	files, writers, site_variables = dict(), dict(), dict()
+	try:
+		for index in sites:
+			files[index] = open(os.path.join(data_path, '{}.dat'.format(
+				Site.data_file_prefix(index))), 'wb' if binary else 'w')
+			writers[index] = writer_type(files[index])
+			site_variables[index] = array.array('l')
+
+		last = None
+		for variable, value in it.izip(variables, values):
+			if last is not None and variable <= last:
+				raise ValueError('Variable {} is not in increasing order'
+						.format(variable))
+			last = variable
+			for index in replicas(variable):
+				if index not in writers:
+					raise ValueError('Variable {} placed at unknown site {}'
+							.format(variable, index))
+				writers[index].append(variable, value)
+				site_variables[index].append(variable)
+
+		for writer in writers.itervalues():
+			writer.close()
+
+	finally:
+		for data_file in files.itervalues():
+			data_file.close()
+
+	return site_variables
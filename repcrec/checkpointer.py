@@ -0,0 +1,126 @@
+'''
+The checkpointer decides when a DatabaseManager using a write-ahead log should
+write a new snapshot of its data and writes that snapshot in the background.
+
+A checkpoint starts from a consistent in-memory copy of the data taken together
+with the size of the log at that moment. The copy is written to a separate
+checkpoint file by a background thread. Once the thread completes, the owner
+renames the checkpoint file over its data file and truncates the log prefix
+covered by the snapshot, which keeps the time to recover bounded.
+
+(c) 2013 Brandon Reiss
+'''
+
+from repcrec.durability import fsync_file
+
+import threading
+
+class Checkpointer(object):
+	''' Checkpoint policy and background snapshot writer. '''
+
+	def __init__(self, checkpoint_bytes=None, checkpoint_commits=None):
+		'''
+		Initialize the checkpointer.
+
+		Parameters
+		----------
+		checkpoint_bytes : integer or None
+			Checkpoint once the log grows to at least this many bytes.
+		checkpoint_commits : integer or None
+			Checkpoint once at least this many commits are logged since the
+			last checkpoint.
+		'''
+
+		self._checkpoint_bytes = checkpoint_bytes
+		self._checkpoint_commits = checkpoint_commits
+		self._commits = 0
+		self._thread = None
+		self._error = None
+		self._cut = None
+		self._num_checkpoints = 0
+
+	@property
+	def num_checkpoints(self):
+		''' Number of checkpoints completed. '''
+		return self._num_checkpoints
+
+	def record_commit(self):
+		''' Count a commit appended to the log. '''
+		self._commits += 1
+
+	def due(self, log_size):
+		''' Check whether a checkpoint should start for the given log size. '''
+
+		if self.running():
+			return False
+		if self._checkpoint_bytes is not None and \
+				log_size >= self._checkpoint_bytes:
+			return True
+		if self._checkpoint_commits is not None and \
+				self._commits >= self._checkpoint_commits:
+			return True
+		return False
+
+	def running(self):
+		''' Check whether a checkpoint is started and not yet finished. '''
+		return self._thread is not None
+
+	def done(self):
+		''' Check whether a started checkpoint is ready to finish. '''
+		return self._thread is not None and not self._thread.is_alive()
+
+	def start(self, write_snapshot, checkpoint_file_path, cut, sync=False):
+		'''
+		Start writing a snapshot in the background.
+
+		Parameters
+		----------
+		write_snapshot : function
+			Function taking an open file and writing a consistent copy of the
+			data to it. It must not read state that changes after start().
+		checkpoint_file_path : string
+			Path of the file to write.
+		cut : integer
+			Log offset covered by the snapshot.
+		sync : boolean
+			Whether to sync the file to stable storage once written.
+		'''
+
+		if self.running():
+			raise RuntimeError('Checkpoint is already running')
+
+		def run():
+			''' Write the snapshot file. '''
+			try:
+				with open(checkpoint_file_path, 'wb') as checkpoint_file:
+					write_snapshot(checkpoint_file)
+					if sync is True:
+						fsync_file(checkpoint_file)
+			except (IOError, OSError) as error:
+				self._error = error
+
+		self._commits = 0
+		self._error = None
+		self._cut = cut
+		self._thread = threading.Thread(target=run)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def finish(self):
+		'''
+		Wait for the running checkpoint and return the log offset that its
+		snapshot covers.
+		'''
+
+		if not self.running():
+			raise RuntimeError('Checkpoint is not running')
+
+		self._thread.join()
+		self._thread = None
+
+		if self._error is not None:
+			error, self._error = self._error, None
+			raise IOError('Checkpoint failed: {}'.format(error))
+
+		self._num_checkpoints += 1
+		return self._cut
@@ -0,0 +1,371 @@
+'''
+Client library for the RepCRec CommandServer.
+
+A Client keeps a pool of persistent connections to the server and pipelines
+commands on them. Sending a command does not wait for its result, so many
+commands share each round trip. Every command returns a Future that resolves
+once the server reports on it, and reads and transaction outcomes have futures
+of their own that resolve to the value read and to COMMITTED or ABORTED even
+when the command blocks and completes in a later tick. For instance,
+
+	client = Client('localhost:9000', connections=4)
+	client.begin(1)
+	client.write(1, 2, 20)
+	value = client.read(1, 4)
+	outcome = client.end(1)
+	print value.result(), outcome.result()
+	client.close()
+
+Commands of a transaction always go to the same connection since the server
+reports later output about a transaction to the connection that began it. Note
+that the server runs at most one line from each connection per tick, and while
+a command blocks, it holds the later lines of that connection until the command
+runs, so commands pipelined behind a blocked command resolve in order once it
+does.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec.commands import parse_commands
+from repcrec.server import parse_address
+from repcrec.transaction_manager import TransactionManager
+from repcrec.util import format_command, parse_txid
+
+import collections
+import itertools as it
+import re
+import socket
+import threading
+
+# Log lines from TransactionManager and the messages that end reads and
+# transactions.
+_LOG_PATTERN = re.compile(r't[0-9]+,\s+T([0-9]+) : (.*)$')
+_READ_PATTERN = re.compile(r'read x([0-9]+) -> (-?[0-9]+)')
+_IGNORE_READ_PATTERN = re.compile(r'ignoring read x([0-9]+)$')
+
+class Future(object):
+	''' Result of a command that the server has not reported on yet. '''
+
+	def __init__(self):
+		self._done = threading.Event()
+		self._lock = threading.Lock()
+		self._callbacks = []
+		self._result = None
+		self._error = None
+
+	def done(self):
+		''' Check whether the future has a result or an error. '''
+		return self._done.is_set()
+
+	def result(self, timeout=None):
+		'''
+		Wait for the result and return it or raise the error. Raises IOError
+		when the timeout in seconds passes first.
+		'''
+
+		if not self._done.wait(timeout):
+			raise IOError('Timed out waiting for a result')
+		if self._error is not None:
+			raise self._error
+		return self._result
+
+	def add_done_callback(self, callback):
+		''' Call callback(future) once the future is done. '''
+
+		with self._lock:
+			if not self._done.is_set():
+				self._callbacks.append(callback)
+				return
+		callback(self)
+
+	def _finish(self, result, error):
+		''' Set the result or error once and run the callbacks. '''
+
+		with self._lock:
+			if self._done.is_set():
+				return
+			self._result, self._error = result, error
+			self._done.set()
+			callbacks, self._callbacks = self._callbacks, []
+		for callback in callbacks:
+			callback(self)
+
+	def set_result(self, result):
+		''' Resolve with a result. '''
+		self._finish(result, None)
+
+	def set_exception(self, error):
+		''' Resolve with an error. '''
+		self._finish(None, error)
+
+class _Connection(object):
+	''' Persistent connection pipelining commands to the server. '''
+
+	def __init__(self, family, address):
+		self._socket = socket.socket(family, socket.SOCK_STREAM)
+		self._socket.connect(address)
+		if family == socket.AF_INET:
+			# Replies are small lines that must not wait on acknowledgments.
+			self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self._send_lock = threading.Lock()
+		self._state_lock = threading.Lock()
+		self._next_seq = 1
+		self._error = None
+
+		# Tuples of (future, log lines, dependent future) of commands by
+		# sequence number, pending reads by txid and variable in the order
+		# sent, and outcomes by txid.
+		self._commands = dict()
+		self._reads = collections.defaultdict(collections.deque)
+		self._outcomes = dict()
+
+		self._reader = threading.Thread(target=self._read_replies)
+		self._reader.daemon = True
+		self._reader.start()
+
+	def outcome(self, txid):
+		''' Future of the outcome of a transaction. '''
+		with self._state_lock:
+			return self._outcome(txid)
+
+	def _outcome(self, txid):
+		''' Get or create an outcome future. Call with the state lock held. '''
+
+		if txid not in self._outcomes:
+			self._outcomes[txid] = Future()
+			if self._error is not None:
+				self._outcomes[txid].set_exception(self._error)
+		return self._outcomes[txid]
+
+	def send(self, commands, read=None, outcome=None):
+		'''
+		Send commands as a single line and return a future for each.
+
+		Parameters
+		----------
+		commands : list of commands
+			List of tuples of the form (command, (args, ...)).
+		read : tuple or None
+			Tuple (txid, variable) when the line is a single read whose value
+			is tracked by a read future.
+		outcome : integer or None
+			Txid when the line is a single end() whose rejection also fails
+			the outcome of the transaction.
+
+		Returns
+		-------
+		futures : list of Future
+			Futures resolving to the log lines of each command.
+		read_future : Future or None
+			Future resolving to the value read when read is given.
+		'''
+
+		line = '; '.join(it.starmap(format_command, commands))
+		futures = [Future() for _ in commands]
+		read_future = Future() if read is not None else None
+
+		with self._send_lock:
+			with self._state_lock:
+				if self._error is not None:
+					raise self._error
+				dependent = read_future if read is not None else \
+						self._outcome(outcome) if outcome is not None else None
+				for future in futures:
+					self._commands[self._next_seq] = (future, [], dependent)
+					self._next_seq += 1
+				if read is not None:
+					self._reads[read].append(read_future)
+			self._socket.sendall(line + '\n')
+
+		return futures, read_future
+
+	def close(self):
+		''' Stop sending and wait for the results of commands already sent. '''
+		self._socket.shutdown(socket.SHUT_WR)
+		self._reader.join()
+		self._socket.close()
+
+	def _read_replies(self):
+		''' Resolve futures from server replies until the connection closes. '''
+
+		try:
+			for reply in self._socket.makefile('r'):
+				self._handle_reply(reply.rstrip('\n'))
+			error = IOError('Connection to the server closed')
+		except socket.error as socket_error:
+			error = socket_error
+
+		# Fail everything still waiting.
+		with self._state_lock:
+			self._error = error
+			waiting = [future for future, _, _ in self._commands.itervalues()] \
+					+ self._outcomes.values() \
+					+ [read for reads in self._reads.itervalues()
+						for read in reads]
+			self._commands, self._reads = dict(), collections.defaultdict(
+					collections.deque)
+		for future in waiting:
+			future.set_exception(error)
+
+	def _handle_reply(self, reply):
+		''' Handle a single reply line. '''
+
+		seq, _, msg = reply.partition(' ')
+		kind, _, text = msg.partition(' ')
+
+		if kind == '|':
+			self._handle_log(text, None if seq == '*' else int(seq))
+			return
+
+		with self._state_lock:
+			future, lines, dependent = self._commands.pop(int(seq))
+		if kind == 'ok':
+			future.set_result(lines)
+		else:
+			future.set_exception(ValueError(text))
+
+			# A rejected read never reads and a rejected end() has no outcome
+			# unless the transaction already ended.
+			if dependent is not None:
+				dependent.set_exception(ValueError(text))
+
+	def _pop_read(self, txid, variable):
+		'''
+		Take the oldest read of a variable by a transaction that the server
+		has not rejected. Call with the state lock held.
+		'''
+
+		reads = self._reads.get((txid, variable))
+		while reads:
+			read = reads.popleft()
+			if not read.done():
+				return read
+		return None
+
+	def _handle_log(self, line, seq):
+		''' Keep a log line for its command and resolve reads and outcomes. '''
+
+		with self._state_lock:
+			if seq is not None:
+				self._commands[seq][1].append(line)
+
+			match = _LOG_PATTERN.match(line)
+			if match is None:
+				return
+			txid, msg = int(match.group(1)), match.group(2)
+
+			resolved = []
+			read_match = _READ_PATTERN.match(msg)
+			ignore_match = _IGNORE_READ_PATTERN.match(msg)
+			if read_match is not None:
+				read = self._pop_read(txid, int(read_match.group(1)))
+				if read is not None:
+					resolved.append((read, int(read_match.group(2)), None))
+			elif ignore_match is not None:
+				read = self._pop_read(txid, int(ignore_match.group(1)))
+				if read is not None:
+					resolved.append((read, None,
+						RuntimeError('T{} was killed'.format(txid))))
+			elif msg in ('committed', 'aborted'):
+				status = TransactionManager.COMMITTED if msg == 'committed' \
+						else TransactionManager.ABORTED
+				resolved.append((self._outcome(txid), status, None))
+
+				# Reads of an ended transaction never complete.
+				for variable_txid, variable in [key for key in self._reads
+						if key[0] == txid]:
+					for read in self._reads.pop((variable_txid, variable)):
+						resolved.append((read, None,
+							RuntimeError('T{} {} before reading x{}'.format(
+								txid, msg, variable))))
+
+		for future, result, error in resolved:
+			if error is None:
+				future.set_result(result)
+			else:
+				future.set_exception(error)
+
+class Client(object):
+	''' Pool of pipelining connections to a CommandServer. '''
+
+	def __init__(self, address, connections=1):
+		'''
+		Connect to a server.
+
+		Parameters
+		----------
+		address : string
+			HOST:PORT of a TCP server or the path of a Unix socket.
+		connections : integer
+			Number of persistent connections in the pool. Each transaction
+			uses the connection of its txid modulo the pool size.
+		'''
+
+		family, address = parse_address(address)
+		self._connections = [_Connection(family, address)
+				for _ in range(connections)]
+		self._next_connection = it.cycle(self._connections)
+
+	def _connection_for(self, commands):
+		''' Choose the connection for a line of commands. '''
+
+		for cmd, args in commands:
+			try:
+				txid = parse_txid(cmd, args, 0)
+			except ValueError:
+				continue
+			return self._connections[txid % len(self._connections)]
+		return next(self._next_connection)
+
+	def send(self, line):
+		'''
+		Send a line in the command grammar and return a future for each of
+		its commands. Commands in a line run in the same tick. A future
+		resolves to the log lines of its command or raises ValueError when
+		the server rejects the command.
+		'''
+
+		commands = parse_commands(line) if isinstance(line, str) else line
+		if not commands:
+			return []
+		futures, _ = self._connection_for(commands).send(commands)
+		return futures
+
+	def begin(self, txid, read_only=False):
+		''' Begin a transaction. '''
+		cmd = 'beginRO' if read_only is True else 'begin'
+		return self.send([(cmd, ('T{}'.format(txid),))])[0]
+
+	def read(self, txid, variable):
+		'''
+		Read a variable and return a future of the value read. The future
+		raises RuntimeError when the transaction ends without reading.
+		'''
+
+		commands = [('R', ('T{}'.format(txid), 'x{}'.format(variable)))]
+		_, read_future = self._connection_for(commands).send(
+				commands, read=(txid, variable))
+		return read_future
+
+	def write(self, txid, variable, value):
+		''' Write a variable. '''
+		return self.send([('W', ('T{}'.format(txid), 'x{}'.format(variable),
+			str(value)))])[0]
+
+	def end(self, txid):
+		'''
+		End a transaction and return a future of its outcome, either
+		TransactionManager.COMMITTED or TransactionManager.ABORTED.
+		'''
+
+		commands = [('end', ('T{}'.format(txid),))]
+		self._connection_for(commands).send(commands, outcome=txid)
+		return self.outcome(txid)
+
+	def outcome(self, txid):
+		''' Future of the outcome of a transaction. '''
+		return self._connections[txid % len(self._connections)].outcome(txid)
+
+	def close(self):
+		''' Wait for the results of all commands sent and disconnect. '''
+		for connection in self._connections:
+			connection.close()
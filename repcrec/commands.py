@@ -10,6 +10,7 @@ test files.
 (c) 2013 Brandon Reiss
 '''
 from repcrec import TransactionManager
+from repcrec.commit_log import CommitLog
 from repcrec.util import delegator, parse_txid, check_args_len
 
 import os
@@ -167,16 +168,21 @@ class TestFile(object):
 
 		check_txid = args[0]
 
-		for txid, _, status in commit_abort_log:
-			if txid is check_txid:
-				cls._log_debug_assert(
-						status is target_status,
-						'expecting {} for T{}'.format(status_name, txid))
-				return
+		# Look up the outcome in a CommitLog or else scan the log.
+		if isinstance(commit_abort_log, CommitLog):
+			status = commit_abort_log.outcome(check_txid)
+		else:
+			status = next((status for txid, _, status in commit_abort_log
+				if txid == check_txid), None)
 
-		cls._log_debug_assert(
-				False,
-				'T{} not found in the log'.format(check_txid))
+		if status is not None:
+			cls._log_debug_assert(
+					status is target_status,
+					'expecting {} for T{}'.format(status_name, check_txid))
+		else:
+			cls._log_debug_assert(
+					False,
+					'T{} not found in the log'.format(check_txid))
 
 	@classmethod
 	def _assert_committed(cls, args, commit_abort_log):
@@ -196,9 +202,10 @@ class TestFile(object):
 
 		Parameters
 		----------
-		commmit_abort_log : iterable of tuples
+		commmit_abort_log : CommitLog or iterable of tuples
 			Iterable of (txid, tick, status) tuples where status is one of
 			TransactionManager.COMMITTED or TransactionManager.ABORTED.
+			Outcomes in a CommitLog are looked up without a scan.
 		'''
 
 		for cmd, args in self._debug_commands:
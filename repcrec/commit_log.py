@@ -0,0 +1,149 @@
+'''
+Bounded log of transaction commits and aborts.
+
+The newest entries are kept in memory up to a capacity. Once the memory is
+full, the oldest half of the entries is appended to a spill file on disk in a
+single write. Iterating over the log streams the spilled entries from disk
+followed by the entries in memory, so the full history is never materialized.
+Outcomes of entries in memory are indexed by txid. Each spill keeps a sorted
+array of the txids that it wrote, so looking up an older outcome reads only the
+first spill that holds the txid, whatever the order in which txids were logged.
+Memory thus holds the entries and their index up to the capacity and a machine
+integer txid per spilled entry.
+
+Spilled entries are fixed-width records of (txid, tick, status).
+
+(c) 2013 Brandon Reiss
+'''
+
+import array
+import bisect
+import collections
+import os
+import struct
+
+class CommitLog(object):
+	''' Log of (txid, tick, status) entries bounded in memory. '''
+
+	_ENTRY = struct.Struct('<qqb')
+
+	# Entries read from the spill file at a time while iterating.
+	_READ_ENTRIES = 4096
+
+	def __init__(self, spill_file_path, capacity=4096):
+		'''
+		Initialize an empty log.
+
+		Parameters
+		----------
+		spill_file_path : string
+			Path of the file that holds spilled entries. The file is created
+			on the first spill and any existing file is replaced.
+		capacity : integer
+			Number of entries kept in memory.
+		'''
+
+		if capacity < 2:
+			raise ValueError('Commit log capacity must be at least 2')
+
+		self._spill_file_path = spill_file_path
+		self._spill_file = None
+		self._num_spilled = 0
+		self._capacity = capacity
+		self._entries = collections.deque()
+		self._outcomes = dict()
+
+		# Tuples of (sorted array of txids, first entry, number of entries)
+		# of each spill.
+		self._spills = []
+
+	def __len__(self):
+		return self._num_spilled + len(self._entries)
+
+	def __iter__(self):
+		''' Iterate over the entries logged so far from oldest to newest. '''
+
+		# Spilled entries never change, so the entries logged so far are
+		# those spilled and a copy of those in memory.
+		num_spilled, entries = self._num_spilled, list(self._entries)
+
+		if num_spilled > 0:
+			if self._spill_file is not None:
+				self._spill_file.flush()
+			with open(self._spill_file_path, 'rb') as spill_file:
+				remaining = num_spilled
+				while remaining > 0:
+					num_entries = min(remaining, self._READ_ENTRIES)
+					data = spill_file.read(num_entries * self._ENTRY.size)
+					for offset in xrange(0, len(data), self._ENTRY.size):
+						yield self._ENTRY.unpack_from(data, offset)
+					remaining -= num_entries
+
+		for entry in entries:
+			yield entry
+
+	@property
+	def num_spilled(self):
+		''' Number of entries spilled to disk. '''
+		return self._num_spilled
+
+	def append(self, txid, tick, status):
+		''' Log an outcome. '''
+
+		self._outcomes.setdefault(txid, status)
+		self._entries.append((txid, tick, status))
+		if len(self._entries) >= self._capacity:
+			self._spill(self._capacity // 2)
+
+	def outcome(self, txid):
+		'''
+		Get the status of the first logged outcome of a transaction or None
+		when the transaction has none.
+		'''
+
+		# Spilled entries are older than those in memory.
+		for txids, first, num_entries in self._spills:
+			position = bisect.bisect_left(txids, txid)
+			if position < len(txids) and txids[position] == txid:
+				return self._spilled_outcome(txid, first, num_entries)
+		return self._outcomes.get(txid)
+
+	def _spilled_outcome(self, txid, first, num_entries):
+		''' Find the first outcome of a transaction in a spill. '''
+
+		if self._spill_file is not None:
+			self._spill_file.flush()
+		with open(self._spill_file_path, 'rb') as spill_file:
+			spill_file.seek(first * self._ENTRY.size)
+			data = spill_file.read(num_entries * self._ENTRY.size)
+		for offset in xrange(0, len(data), self._ENTRY.size):
+			entry_txid, _, status = self._ENTRY.unpack_from(data, offset)
+			if entry_txid == txid:
+				return status
+		return None
+
+	def _spill(self, num_entries):
+		''' Append the oldest entries in memory to the spill file. '''
+
+		if self._spill_file is None:
+			self._spill_file = open(self._spill_file_path,
+					'ab' if self._num_spilled > 0 else 'wb')
+
+		entries = [self._entries.popleft() for _ in xrange(num_entries)]
+		self._spill_file.write(''.join(
+			self._ENTRY.pack(*entry) for entry in entries))
+
+		# Outcomes of spilled entries are found on disk from now on.
+		txids = [txid for txid, _, _ in entries]
+		for txid in txids:
+			self._outcomes.pop(txid, None)
+		self._spills.append((array.array('l', sorted(set(txids))),
+			self._num_spilled, num_entries))
+		self._num_spilled += num_entries
+
+	def close(self):
+		''' Close the spill file. The file is left on disk. '''
+
+		if self._spill_file is not None:
+			self._spill_file.close()
+			self._spill_file = None
@@ -0,0 +1,213 @@
+'''
+Fixed-width binary data file format for the DatabaseManager.
+
+A data file is a header followed by a dense array of int64 values with one
+slot for every variable in the range [base, base + slots) and a validity bitmap
+marking the slots that hold a variable managed by the database. Files are
+accessed through mmap, so reading or writing a variable touches only its slot.
+Large files may be written one variable at a time with a BinaryDataFileWriter.
+
+(c) 2013 Brandon Reiss
+'''
+
+import mmap
+import struct
+
+class BinaryDataFile(object):
+	''' A memory-mapped binary data file with a dict-like interface. '''
+
+	MAGIC = 'RCDB'
+	VERSION = 1
+
+	# Header is (MAGIC, VERSION, base, slots).
+	_HEADER = struct.Struct('<4sIqQ')
+	_VALUE = struct.Struct('<q')
+
+	def __init__(self, data_file, copy_on_write=False):
+		'''
+		Map a data file.
+
+		Parameters
+		----------
+		data_file : file
+			Data file opened for reading and writing in binary mode. The file
+			may be closed once the BinaryDataFile is created.
+		copy_on_write : boolean
+			When True, writes change only the mapped memory and never the
+			file on disk.
+		'''
+
+		access = mmap.ACCESS_COPY if copy_on_write else mmap.ACCESS_WRITE
+		self._mmap = mmap.mmap(data_file.fileno(), 0, access=access)
+
+		if len(self._mmap) < self._HEADER.size:
+			raise ValueError('Data file is too short for its header')
+		magic, version, self._base, self._slots = \
+				self._HEADER.unpack_from(self._mmap, 0)
+		if magic != self.MAGIC or version != self.VERSION:
+			raise ValueError('Data file has bad magic {!r} or version {}'
+					.format(magic, version))
+
+		self._bitmap_offset = \
+				self._HEADER.size + (self._VALUE.size * self._slots)
+		if len(self._mmap) != self._bitmap_offset + ((self._slots + 7) >> 3):
+			raise ValueError('Data file size does not match its header')
+
+		self._len = None
+
+	def __repr__(self):
+		return dict(self.iteritems()).__repr__()
+
+	@classmethod
+	def write(cls, data_file, values):
+		'''
+		Write a new data file.
+
+		Parameters
+		----------
+		data_file : file
+			File opened for writing in binary mode.
+		values : dict
+			Dict of variables and their values.
+		'''
+
+		if len(values) > 0:
+			base = min(values.iterkeys())
+			slots = 1 + max(values.iterkeys()) - base
+		else:
+			base, slots = 0, 0
+
+		dense = [0] * slots
+		bitmap = bytearray((slots + 7) >> 3)
+		for variable, value in values.iteritems():
+			slot = variable - base
+			dense[slot] = value
+			bitmap[slot >> 3] |= 1 << (slot & 7)
+
+		data_file.write(cls._HEADER.pack(cls.MAGIC, cls.VERSION, base, slots))
+		data_file.write(struct.pack('<{}q'.format(slots), *dense))
+		data_file.write(bitmap)
+
+	def _slot(self, variable):
+		''' Get the slot for a variable or None if it is not valid. '''
+
+		slot = variable - self._base
+		if slot < 0 or slot >= self._slots:
+			return None
+		if not ord(self._mmap[self._bitmap_offset + (slot >> 3)]) & \
+				(1 << (slot & 7)):
+			return None
+		return slot
+
+	def __contains__(self, variable):
+		return self._slot(variable) is not None
+
+	def __getitem__(self, variable):
+		slot = self._slot(variable)
+		if slot is None:
+			raise KeyError(variable)
+		return self._VALUE.unpack_from(
+				self._mmap, self._HEADER.size + (self._VALUE.size * slot))[0]
+
+	def __setitem__(self, variable, value):
+		slot = self._slot(variable)
+		if slot is None:
+			raise KeyError(variable)
+		self._VALUE.pack_into(self._mmap,
+				self._HEADER.size + (self._VALUE.size * slot), value)
+
+	def __len__(self):
+		if self._len is None:
+			self._len = sum(1 for _ in self.iterkeys())
+		return self._len
+
+	def iterkeys(self):
+		''' Iterate over variables in the data file. '''
+
+		# Scan the bitmap a byte at a time, skipping bytes with no variables.
+		bitmap = bytearray(self._mmap[self._bitmap_offset:])
+		for byte_index, byte in enumerate(bitmap):
+			if byte is 0:
+				continue
+			base = self._base + (byte_index << 3)
+			for bit in xrange(8):
+				if byte & (1 << bit):
+					yield base + bit
+
+	def keys(self):
+		''' Get list of variables in the data file. '''
+		return list(self.iterkeys())
+
+	def iteritems(self):
+		''' Iterate over (variable, value) tuples. '''
+		for variable in self.iterkeys():
+			yield variable, self[variable]
+
+	def image(self):
+		''' Get a copy of the entire data file image as a string. '''
+		return self._mmap[:]
+
+	def flush(self):
+		''' Flush modified slots to the data file. '''
+		self._mmap.flush()
+
+	def close(self):
+		''' Unmap the data file. '''
+		self._mmap.close()
+
+
+class BinaryDataFileWriter(object):
+	'''
+	Write a binary data file in one streaming pass from variables given in
+	increasing order. Only the validity bitmap is kept in memory.
+	'''
+
+	def __init__(self, data_file):
+		'''
+		Start a new data file.
+
+		Parameters
+		----------
+		data_file : file
+			File opened for writing in binary mode. The header is written
+			by close().
+		'''
+
+		self._data_file = data_file
+		self._data_file.write(BinaryDataFile._HEADER.pack(
+			BinaryDataFile.MAGIC, BinaryDataFile.VERSION, 0, 0))
+		self._base = None
+		self._slots = 0
+		self._bitmap = bytearray()
+
+	def append(self, variable, value):
+		''' Write the value of the next variable. '''
+
+		if self._base is None:
+			self._base = variable
+		slot = variable - self._base
+		if slot < self._slots:
+			raise ValueError('Variable {} is not in increasing order'
+					.format(variable))
+
+		# Fill slots of missing variables.
+		if slot > self._slots:
+			self._data_file.write(
+					BinaryDataFile._VALUE.pack(0) * (slot - self._slots))
+		self._data_file.write(BinaryDataFile._VALUE.pack(value))
+		self._slots = slot + 1
+
+		if len(self._bitmap) < (self._slots + 7) >> 3:
+			self._bitmap.extend(
+					bytearray(((self._slots + 7) >> 3) - len(self._bitmap)))
+		self._bitmap[slot >> 3] |= 1 << (slot & 7)
+
+	def close(self):
+		''' Write the bitmap and header. The file is left open. '''
+
+		self._data_file.write(self._bitmap)
+		self._data_file.seek(0)
+		self._data_file.write(BinaryDataFile._HEADER.pack(
+			BinaryDataFile.MAGIC, BinaryDataFile.VERSION,
+			self._base or 0, self._slots))
+		self._data_file.seek(0, 2)
@@ -8,10 +8,43 @@ occur safely at any time and the DatabaseManager is guaranteed to recover a
 consistent copy of the data so long as the persistent storage media are not
 destroyed.
 
+Optionally, the database keeps a write-ahead log instead of rewriting the data
+file on every write. In that mode each write appends only the changed values to
+the log and recovery replays the log over the last data file. Writes made
+between begin_group() and end_group() share a single flush in either mode.
+
+A database using the log may also checkpoint. A checkpoint writes a snapshot
+of the data in the background and then replaces the data file with it and
+truncates the log prefix that the snapshot covers, which bounds recovery time.
+
+Flushes are synced to stable storage according to a DurabilityPolicy, which
+trades durability for commit latency.
+
+Data files are either text or a fixed-width binary format accessed through
+mmap. Binary data files are updated in place one slot at a time, and a redo
+journal of the slots being written protects the file until it is flushed.
+
+Multiversion read consistency does not copy data. Every write creates a new
+committed version, and a multiversion clone pins the version that was current
+when it was created. While versions are pinned, a write keeps the values it
+supersedes in short per-variable chains so that pinned versions read what they
+saw. Superseded values are discarded once no pinned version can read them.
+The memory held by superseded values is tracked in snapshot_bytes, and a clone
+may spill the values it reads to a binary file on disk and unpin its version.
+
 (c) 2013 Brandon Reiss
 '''
-import copy
+from repcrec.log_manager import LogManager
+from repcrec.data_file import BinaryDataFile
+from repcrec.checkpointer import Checkpointer
+from repcrec.durability import DurabilityPolicy, fsync_file, fsync_dir
+from repcrec.metrics import Metrics
+
+import bisect
+import collections
 import os
+import sys
+import time
 
 class DatabaseManager(object):
 	''' The database persistence layer. '''
@@ -19,45 +52,124 @@ class DatabaseManager(object):
 	class MultiversionClone(object):
 		''' A multiversion read consistency clone. '''
 
-		def __init__(self, database_manager, data):
-			''' Initialize from a DatabaseManager. '''
-			self._site = database_manager
-			self._cache = copy.deepcopy(data)
-			self._variables = tuple(self._cache.keys())
+		def __init__(self, database_manager, version):
+			''' Initialize from a DatabaseManager and a pinned version. '''
+			self._database_manager = database_manager
+			self._version = version
+			self._spill_file_path = None
+			self._spill = None
 
 		def read(self, variable):
 			''' Read a variable from the clone. '''
-
-			if variable not in self._cache:
-				raise ValueError(('Variable {} '
-					'is not managed by this database').format(variable))
-
-			return self._cache[variable]
+			if self._spill is not None:
+				return self._spill[variable]
+			return self._database_manager.read_version(variable, self._version)
 
 		def has_variable(self, variable):
 			''' Check that the site manages a given variable. '''
-			return variable in self._cache
+			return self._database_manager.has_variable(variable)
 
 		@property
 		def variables(self):
 			''' Get database variables. '''
-			return self._variables
+			return self._database_manager.variables
+
+		@property
+		def version(self):
+			''' The committed version read by the clone. '''
+			return self._version
 
+		@property
+		def spilled(self):
+			''' Check whether the clone reads from a spill file. '''
+			return self._spill is not None
+
+		@property
+		def spill_file_path(self):
+			''' Path to the spill file or None when the clone is not spilled. '''
+			return self._spill_file_path
+
+		def _open_spill(self, spill_file_path):
+			''' Serve reads from a spill file. '''
+			self._spill_file_path = spill_file_path
+			with open(spill_file_path, 'rb') as spill_file:
+				self._spill = BinaryDataFile(spill_file, copy_on_write=True)
+
+		def spill(self):
+			'''
+			Write the values read by the clone to a binary spill file and
+			release the pinned version. Later reads are served from the file.
+			'''
+
+			if self._spill is not None:
+				return
 
-	def __init__(self, variables, data_path, data_file_prefix):
+			dbm = self._database_manager
+			values = dict((variable, self.read(variable))
+					for variable in dbm.variables)
+			spill_file_path = dbm._next_spill_file_path(self._version)
+			with open(spill_file_path, 'wb') as spill_file:
+				BinaryDataFile.write(spill_file, values)
+			self._open_spill(spill_file_path)
+			dbm.unpin(self._version)
+
+		def release(self):
+			''' Release the pinned version. The clone may not be read after. '''
+			if self._spill is not None:
+				self._spill.close()
+				self._spill = None
+				os.remove(self._spill_file_path)
+			else:
+				self._database_manager.unpin(self._version)
+
+
+	_ALLOWED_FORMATS = range(2)
+	TEXT_FORMAT, BINARY_FORMAT = _ALLOWED_FORMATS
+
+	# File modes for (reading, writing) each data format.
+	_FILE_MODES = {
+			TEXT_FORMAT: ('r', 'w'),
+			BINARY_FORMAT: ('r+b', 'wb'),
+			}
+
+	def __init__(self, variables, data_path, data_file_prefix, use_log=False,
+			data_format=TEXT_FORMAT, checkpoint_bytes=None,
+			checkpoint_commits=None, durability=DurabilityPolicy.NONE,
+			sync_ms=None, sync_commits=None, metrics=None):
 		'''
 		Initialize the database.
 
 		Parameters
 		----------
-		variables : dict
-			Dict of variables replicated at this site and their default values.
+		variables : dict or None
+			Dict of variables replicated at this site and their default values
+			or None to take the variables and their values from an existing
+			data file, such as one written by bulk_load().
 		data_path : string
 			Path where database persistent storage resides.
 		data_file_prefix : string
 			Prefix for data file, which is written as ${data_file_prefix}.dat
 			or ${data_file_prefix}.tmp depending on the step in the persistence
 			algorithm.
+		use_log : boolean
+			When True, writes are appended to a write-ahead log
+			${data_file_prefix}.log rather than rewriting the data file.
+		data_format : DatabaseManager.TEXT_FORMAT or BINARY_FORMAT
+			Format of the data file. Binary data files that are written in
+			place keep a redo journal ${data_file_prefix}.jnl.
+		checkpoint_bytes : integer or None
+			When using the log, checkpoint once the log reaches this size.
+		checkpoint_commits : integer or None
+			When using the log, checkpoint after this many commits.
+		durability : DurabilityPolicy.STRICT, BATCHED, or NONE
+			When to sync flushed data to stable storage.
+		sync_ms : integer or None
+			For BATCHED durability, sync once this many milliseconds pass.
+		sync_commits : integer or None
+			For BATCHED durability, sync once this many commits are made.
+		metrics : Metrics or None
+			Registry counting 'flushes' and 'flush_bytes' written to the data
+			file, log, or journal.
 		'''
 
 		self._data_path = os.path.abspath(data_path)
@@ -66,9 +178,38 @@ class DatabaseManager(object):
 					'Data path {} does not exist'.format(self._data_path))
 		self._data_file_prefix = data_file_prefix
 
-		self._cache = dict(variables)
+		if data_format not in self._ALLOWED_FORMATS:
+			raise ValueError(
+					'Data format {} is not recognized'.format(data_format))
+		self._data_format = data_format
+
+		# A bulk loaded database has no cache until its data file is read.
+		self._cache = dict(variables) if variables is not None else None
 		self._write_counter = 0
-		self._variables = tuple(self._cache.keys())
+		self._variables = None
+		self._in_group = False
+		self._dirty = False
+
+		# Committed version, pinned versions with their use counts, and chains
+		# of (superseded_at_version, value) for superseded values.
+		self._version = 0
+		self._pins = collections.Counter()
+		self._history = dict()
+		self._snapshot_bytes = 0
+		self._num_spills = 0
+
+		self._log_manager = LogManager(self._log_file_path) \
+				if use_log is True else None
+		self._checkpointer = Checkpointer(
+				checkpoint_bytes, checkpoint_commits)
+		self._durability = DurabilityPolicy(durability, sync_ms, sync_commits)
+		self._recovery_stats = None
+		self._metrics = metrics if metrics is not None else Metrics()
+
+		# The write-ahead log covers binary data files that are not written in
+		# place, so only in-place writes need a journal.
+		self._journal = LogManager(self._journal_file_path) \
+				if data_format is self.BINARY_FORMAT and not use_log else None
 
 		# Open site file.
 		try:
@@ -93,6 +234,8 @@ class DatabaseManager(object):
 	@property
 	def variables(self):
 		''' Get database variables. '''
+		if self._variables is None:
+			self._variables = tuple(self._cache.iterkeys())
 		return self._variables
 
 	@property
@@ -101,6 +244,48 @@ class DatabaseManager(object):
 		return os.path.join(
 				self._data_path, '{}.tmp'.format(self._data_file_prefix))
 
+	@property
+	def _log_file_path(self):
+		''' Path to database write-ahead log file. '''
+		return os.path.join(
+				self._data_path, '{}.log'.format(self._data_file_prefix))
+
+	@property
+	def _journal_file_path(self):
+		''' Path to database redo journal file. '''
+		return os.path.join(
+				self._data_path, '{}.jnl'.format(self._data_file_prefix))
+
+	@property
+	def _checkpoint_file_path(self):
+		''' Path to database checkpoint file. '''
+		return os.path.join(
+				self._data_path, '{}.ckp'.format(self._data_file_prefix))
+
+	def _next_spill_file_path(self, version):
+		''' Path to a new spill file for a multiversion clone. '''
+		self._num_spills += 1
+		return os.path.join(self._data_path, '{}_v{}_{}_{}.spl'.format(
+			self._data_file_prefix, version, os.getpid(), self._num_spills))
+
+	@property
+	def recovery_stats(self):
+		'''
+		Statistics for the last call to recover() as a dict with the time
+		taken in 'seconds' and the number of log 'records' replayed.
+		'''
+		return self._recovery_stats
+
+	@property
+	def durability(self):
+		''' The DurabilityPolicy for flushes. '''
+		return self._durability
+
+	@property
+	def uses_log(self):
+		''' Check whether the database keeps a write-ahead log. '''
+		return self._log_manager is not None
+
 	def has_variable(self, variable):
 		''' Check that the database manages a given variable. '''
 		return variable in self._cache
@@ -134,13 +319,53 @@ class DatabaseManager(object):
 				raise ValueError(('Variable {} '
 					'is not managed by this database').format(variable))
 
+		# Keep superseded values that pinned versions can still read.
+		self._version += 1
+		if len(self._pins) > 0:
+			self._keep_superseded(values)
+
+		# Journal slots before they are written in place. The mapped slots
+		# may reach the disk at any time, so the journal must be on stable
+		# storage first unless durability is disabled, even when batched.
+		if self._journal is not None:
+			self._journal.append(values)
+			self._metrics.incr('flush_bytes', self._journal.flush(
+					self._durability.mode is not DurabilityPolicy.NONE))
+
 		# Update all values in the cache.
 		for variable, value in values:
 			self._cache[variable] = value
 
-		# Flush always because we don't have a proper log manager here and the
-		# database is too small to warrant one.
-		self._flush()
+		# Record only the changed values when logging.
+		if self._log_manager is not None:
+			self._log_manager.append(values)
+			self._checkpointer.record_commit()
+		self._durability.record_commit()
+
+		# Flush now unless the write is part of a group.
+		self._dirty = True
+		if self._in_group is False:
+			self._flush()
+
+	def _keep_superseded(self, values):
+		'''
+		Append current values of variables about to be written to their
+		chains. A value is kept only when a pinned version can read it, which
+		is when some version is pinned since the last value was superseded.
+		'''
+
+		newest_pin = max(self._pins)
+		for variable, _ in values:
+			chain = self._history.setdefault(variable, [])
+			if len(chain) is 0 or chain[-1][0] <= newest_pin:
+				entry = (self._version, self._cache[variable])
+				chain.append(entry)
+				self._snapshot_bytes += self._entry_bytes(entry)
+
+	@staticmethod
+	def _entry_bytes(entry):
+		''' Estimate memory used by a superseded value chain entry. '''
+		return sys.getsizeof(entry) + sys.getsizeof(entry[1])
 
 	def write(self, variable, value):
 		'''
@@ -150,49 +375,229 @@ class DatabaseManager(object):
 		database in a consistent state.
 		'''
 
-		if not self.has_variable(variable):
-			raise ValueError(('Variable {} '
-					'is not managed by this database').format(variable))
+		self.batch_write(((variable, value),))
+
+	def begin_group(self):
+		'''
+		Begin a group commit. Writes are applied immediately but they are not
+		flushed until end_group() or sync().
+		'''
+		self._in_group = True
+
+	def end_group(self):
+		''' End a group commit and flush all of its writes together. '''
+		self._in_group = False
+		self.sync()
+
+	def sync(self, durable=False):
+		'''
+		Flush any writes that are pending in the current group. Flushes not
+		yet synced to stable storage are synced when their batch is due or
+		when durable is True.
+		'''
+		if self._dirty is True or self._durability.due() or \
+				(durable is True and self._durability.unsynced):
+			self._flush(durable)
+
+	def _flush(self, force_sync=False):
+		''' Flush cached values to database data file or log. '''
+
+		self._dirty = False
+		sync = self._durability.should_sync(force_sync)
+		self._metrics.incr('flushes')
+
+		# The log holds all changes since the data file was written.
+		if self._log_manager is not None:
+			self._metrics.incr('flush_bytes', self._log_manager.flush(sync))
+			self._poll_checkpoint()
+			return
+
+		# Slots are written in place, so the journal is no longer needed once
+		# they reach stable storage. Without syncing, journaled writes
+		# accumulate until the next sync unless durability is disabled.
+		if self._journal is not None:
+			if sync is True:
+				self._cache.flush()
+			if sync is True or \
+					self._durability.mode is DurabilityPolicy.NONE:
+				self._journal.truncate()
+			return
+
+		self._write_data_file(sync)
+
+	def checkpoint(self):
+		'''
+		Write a snapshot of the data and truncate the write-ahead log. Waits
+		for a checkpoint already running in the background.
+		'''
+
+		if self._log_manager is None:
+			raise ValueError('Checkpoints require a write-ahead log')
 
-		self._cache[variable] = value
+		self.sync()
+		if self._checkpointer.running():
+			self._finish_checkpoint()
+		self._start_checkpoint()
+		self._finish_checkpoint()
 
-		# Flush always because we don't have a proper log manager here and the
-		# database is too small to warrant one.
-		self._flush()
+	def _poll_checkpoint(self):
+		''' Finish a completed checkpoint and start another when it is due. '''
 
-	def _flush(self):
-		''' Flush cached values to database data file. '''
+		if self._checkpointer.done():
+			self._finish_checkpoint()
+		if self._checkpointer.due(self._log_manager.size):
+			self._start_checkpoint()
+
+	def _start_checkpoint(self):
+		''' Start writing a snapshot of the cache in the background. '''
+
+		# Take a copy that does not change while the snapshot is written.
+		if self._data_format is self.BINARY_FORMAT:
+			data = self._cache.image()
+			write_snapshot = lambda data_file: data_file.write(data)
+		else:
+			data = dict(self._cache)
+			write_snapshot = lambda data_file: data_file.write(str(data))
+
+		# The log prefix is discarded after the checkpoint, so the snapshot
+		# must be durable unless durability is disabled.
+		self._checkpointer.start(write_snapshot,
+				self._checkpoint_file_path, self._log_manager.size,
+				self._durability.mode is not DurabilityPolicy.NONE)
+
+	def _finish_checkpoint(self):
+		''' Replace the data file with the snapshot and truncate the log. '''
+
+		sync = self._durability.mode is not DurabilityPolicy.NONE
+		cut = self._checkpointer.finish()
+		os.rename(self._checkpoint_file_path, self.data_file_path)
+		if sync is True:
+			fsync_dir(self._data_path)
+		self._log_manager.truncate_prefix(cut, sync)
+
+	def _write_data_file(self, sync=False):
+		'''
+		Rewrite the entire data file from the cache. The file and its
+		directory are synced to stable storage when sync is True.
+		'''
 
 		# First link to a temporary file.
 		os.rename(self.data_file_path, self._data_file_tmp_path)
 		# Dump to database file.
-		self._dump(open(self.data_file_path, 'w'))
+		with self._open_data_file(self.data_file_path, 'w') as data_file:
+			self._dump(data_file)
+			self._metrics.incr('flush_bytes', data_file.tell())
+			if sync is True:
+				fsync_file(data_file)
 		# Remove temporary file.
 		os.remove(self._data_file_tmp_path)
+		if sync is True:
+			fsync_dir(self._data_path)
+
+		self._reopen_data_file()
+
+	def _open_data_file(self, path, mode):
+		''' Open a data file for reading ('r') or writing ('w'). '''
+		read_mode, write_mode = self._FILE_MODES[self._data_format]
+		return open(path, read_mode if mode == 'r' else write_mode)
+
+	def _reopen_data_file(self):
+		''' Map the standard data file again after it is rewritten. '''
+		if self._data_format is self.BINARY_FORMAT:
+			with self._open_data_file(self.data_file_path, 'r') as data_file:
+				self._read(data_file)
 
 	def _dump(self, data_file):
 		''' Dump database data to file. '''
-		data_file.write(str(self._cache))
+		if self._data_format is self.BINARY_FORMAT:
+			BinaryDataFile.write(data_file, self._cache)
+		else:
+			data_file.write(str(self._cache))
 
 	def _read(self, data_file):
 		''' Read database data from file. '''
 
-		# This is hilariously unsafe.
-		data = eval(data_file.read())
-		for variable, value in data.iteritems():
+		if self._data_format is self.BINARY_FORMAT:
+			# Writes covered by the log must never reach the data file.
+			data = BinaryDataFile(data_file,
+					copy_on_write=self._log_manager is not None)
+		else:
+			# This is hilariously unsafe.
+			data = eval(data_file.read())
+
+		# The data file of a bulk loaded database defines its variables.
+		if self._cache is None:
+			self._cache = data
+			return
+
+		for variable in data.iterkeys():
 			if not self.has_variable(variable):
 				raise ValueError(('Variable '
 					'{} is not managed by this database').format(variable))
-			self._cache[variable] = value
+
+		if self._data_format is self.BINARY_FORMAT:
+			if len(data) != len(self.variables):
+				raise ValueError('Data file {} is missing variables'
+						.format(data_file.name))
+			if isinstance(self._cache, BinaryDataFile):
+				self._cache.close()
+			self._cache = data
+		else:
+			for variable, value in data.iteritems():
+				self._cache[variable] = value
+
+	def _replay(self, log_manager):
+		''' Apply records from a log to the cache and return their count. '''
+
+		records = log_manager.replay()
+		for values in records:
+			for variable, value in values:
+				if not self.has_variable(variable):
+					raise ValueError(('Variable {} is not managed by '
+						'this database').format(variable))
+				self._cache[variable] = value
+		return len(records)
 
 	def recover(self):
 		''' Recover database from disk. '''
 
+		start = time.time()
+		logs = [log_manager for log_manager in
+				(self._journal, self._log_manager) if log_manager is not None]
+
+		# A checkpoint left behind by a failure may be incomplete.
+		if os.path.isfile(self._checkpoint_file_path):
+			os.remove(self._checkpoint_file_path)
+
+		records = 0
+		if self._recover_data_file() is True:
+			# Replay changes logged since the data file was written.
+			for log_manager in logs:
+				records += self._replay(log_manager)
+
+			# Journaled slots are now written in place.
+			if self._journal is not None:
+				self._flush()
+
+		else:
+			# A log without a data file belongs to some other database.
+			for log_manager in logs:
+				log_manager.truncate()
+
+		self._recovery_stats = dict(
+				seconds=time.time() - start, records=records)
+
+	def _recover_data_file(self):
+		'''
+		Recover the data file from disk. Returns True when an existing data
+		file was recovered and False when a new one was initialized.
+		'''
+
 		# Recover from standard file.
 		try:
-			with open(self.data_file_path, 'r') as data_file:
+			with self._open_data_file(self.data_file_path, 'r') as data_file:
 				self._read(data_file)
-				return
+				return True
 
 		except IOError:
 			if os.path.isfile(self.data_file_path):
@@ -201,15 +606,19 @@ class DatabaseManager(object):
 
 		# Recover from tmp file.
 		try:
-			with open(self._data_file_tmp_path, 'r') as site_tmp_data:
+			with self._open_data_file(
+					self._data_file_tmp_path, 'r') as site_tmp_data:
 				self._read(site_tmp_data)
 
 				# Try to save the standard database file.
-				with open(self.data_file_path, 'w') as data_file:
+				with self._open_data_file(
+						self.data_file_path, 'w') as data_file:
 					self._dump(data_file)
 				# Unlink the temporary file.
 				os.remove(self._data_file_tmp_path)
-				return
+
+			self._reopen_data_file()
+			return True
 
 		except IOError:
 			if os.path.isfile(self._data_file_tmp_path):
@@ -218,18 +627,109 @@ class DatabaseManager(object):
 							self._data_file_tmp_path))
 
 		# There is no database file. Initialize it.
+		if self._cache is None:
+			raise ValueError('Bulk loaded data file {} does not exist'
+					.format(self.data_file_path))
 		try:
-			with open(self.data_file_path, 'w') as data_file:
+			with self._open_data_file(self.data_file_path, 'w') as data_file:
 				self._dump(data_file)
+			self._reopen_data_file()
 		except IOError:
 			raise IOError('Failed to initialize database data file {}'
 					.format(self.data_file_path))
 
+		return False
+
+	@property
+	def version(self):
+		''' The current committed version. '''
+		return self._version
+
+	@property
+	def snapshot_bytes(self):
+		''' Estimated memory in bytes used by values kept for pinned versions. '''
+		return self._snapshot_bytes
+
+	def pin(self):
+		'''
+		Pin the current committed version so that it remains readable with
+		read_version() until unpin() is called for it.
+		'''
+		self._pins[self._version] += 1
+		return self._version
+
+	def unpin(self, version):
+		''' Release a pinned version and discard values no longer readable. '''
+
+		if self._pins[version] <= 0:
+			del self._pins[version]
+			raise ValueError('Version {} is not pinned'.format(version))
+
+		self._pins[version] -= 1
+		if self._pins[version] is 0:
+			del self._pins[version]
+			self._collect_superseded()
+
+	def _collect_superseded(self):
+		'''
+		Discard superseded values that no pinned version can read. A value in
+		a chain is read by pinned versions from when the value before it was
+		superseded up to but not including when it was superseded.
+		'''
+
+		pins = sorted(self._pins)
+		self._snapshot_bytes = 0
+		for variable, chain in self._history.items():
+			kept, since = [], -1
+			for entry in chain:
+				if bisect.bisect_left(pins, since) < \
+						bisect.bisect_left(pins, entry[0]):
+					kept.append(entry)
+					self._snapshot_bytes += self._entry_bytes(entry)
+				since = entry[0]
+			if len(kept) > 0:
+				self._history[variable] = kept
+			else:
+				del self._history[variable]
+
+	def read_version(self, variable, version):
+		''' Get the value of a variable as of a pinned version. '''
+
+		if not self.has_variable(variable):
+			raise ValueError(('Variable {} '
+					'is not managed by this database').format(variable))
+
+		# The first value superseded after the version is the one it saw.
+		for superseded_at, value in self._history.get(variable, ()):
+			if superseded_at > version:
+				return value
+		return self._cache[variable]
+
 	def multiversion_clone(self):
 		'''
 		Return a multiversion clone of the database with a read-only interface.
+		The clone pins the current version and must be released.
+		'''
+		return DatabaseManager.MultiversionClone(self, self.pin())
+
+	def open_spilled_clone(self, version, spill_file_path):
+		'''
+		Open a multiversion clone of a version that was spilled to disk,
+		possibly by another instance of the database. The clone must be
+		released.
+		'''
+		clone = DatabaseManager.MultiversionClone(self, version)
+		clone._open_spill(spill_file_path)
+		return clone
+
+	def continue_version(self, version):
+		'''
+		Continue committed version numbers from a version of another instance
+		of the database, such as one that ran before a restart.
 		'''
-		return DatabaseManager.MultiversionClone(self, self._cache)
+		if len(self._pins) > 0:
+			raise ValueError('Cannot change the version while pinned')
+		self._version = max(self._version, version)
 
 	def dump(self, variable=None):
 		'''
@@ -250,6 +750,6 @@ class DatabaseManager(object):
 		if variable is not None:
 			return self.read(variable)
 		else:
-			return copy.deepcopy(self._cache)
+			return dict(self._cache.iteritems())
 
 
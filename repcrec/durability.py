@@ -0,0 +1,140 @@
+'''
+Durability policy for database persistence. The policy decides when flushed
+data must also be synced to stable storage with fsync().
+
+There are three modes:
+	STRICT  : sync files and their directory on every flush
+	BATCHED : sync once some number of milliseconds or commits have passed
+	          since the last sync
+	NONE    : never sync; only useful for benchmarks
+
+A batch that stops growing is not synced by a later flush, so the owner of the
+policy syncs when the batch is due() while idle and forces a sync on close.
+
+(c) 2013 Brandon Reiss
+'''
+
+import os
+import time
+
+class DurabilityPolicy(object):
+	''' When to fsync() flushed data. '''
+
+	_ALLOWED_MODES = range(3)
+	STRICT, BATCHED, NONE = _ALLOWED_MODES
+
+	_MODE_NAMES = {
+			STRICT: 'strict',
+			BATCHED: 'batched',
+			NONE: 'none',
+			}
+
+	def __init__(self, mode=NONE, sync_ms=None, sync_commits=None):
+		'''
+		Initialize the policy.
+
+		Parameters
+		----------
+		mode : DurabilityPolicy.STRICT, BATCHED, or NONE
+			The durability mode.
+		sync_ms : integer or None
+			For BATCHED, sync once this many milliseconds pass.
+		sync_commits : integer or None
+			For BATCHED, sync once this many commits are made.
+		'''
+
+		if mode not in self._ALLOWED_MODES:
+			raise ValueError('Durability mode {} is not recognized'.format(mode))
+		if mode is self.BATCHED and sync_ms is None and sync_commits is None:
+			raise ValueError('Batched durability requires sync_ms '
+					'or sync_commits')
+
+		self._mode = mode
+		self._sync_ms = sync_ms
+		self._sync_commits = sync_commits
+		self._commits = 0
+		self._last_sync = time.time()
+		self._num_syncs = 0
+		self._unsynced = False
+
+	def __repr__(self):
+		return self._MODE_NAMES[self._mode]
+
+	@classmethod
+	def parse_mode(cls, name):
+		''' Get the mode for a mode name. '''
+
+		for mode, mode_name in cls._MODE_NAMES.iteritems():
+			if mode_name == name:
+				return mode
+		raise ValueError('Durability mode {} is not recognized'.format(name))
+
+	@property
+	def mode(self):
+		''' The durability mode. '''
+		return self._mode
+
+	@property
+	def num_syncs(self):
+		''' Number of times should_sync() returned True. '''
+		return self._num_syncs
+
+	@property
+	def unsynced(self):
+		''' Check whether flushes since the last sync were not synced. '''
+		return self._unsynced
+
+	def record_commit(self):
+		''' Count a commit. '''
+		self._commits += 1
+
+	def due(self):
+		'''
+		Check whether unsynced flushes have waited sync_ms or longer since
+		the last sync.
+		'''
+		return self._unsynced is True and self._sync_ms is not None and \
+				1000. * (time.time() - self._last_sync) >= self._sync_ms
+
+	def should_sync(self, force=False):
+		'''
+		Check whether the current flush must sync. Resets the batch when
+		returning True.
+
+		Parameters
+		----------
+		force : boolean
+			When True, a BATCHED flush syncs whether or not the batch is due.
+		'''
+
+		if self._mode is self.NONE:
+			return False
+
+		if self._mode is self.BATCHED and force is False:
+			elapsed_ms = 1000. * (time.time() - self._last_sync)
+			if not ((self._sync_commits is not None
+					and self._commits >= self._sync_commits)
+					or (self._sync_ms is not None
+						and elapsed_ms >= self._sync_ms)):
+				self._unsynced = True
+				return False
+
+		self._commits = 0
+		self._last_sync = time.time()
+		self._num_syncs += 1
+		self._unsynced = False
+		return True
+
+
+def fsync_file(open_file):
+	''' Flush and fsync() an open file. '''
+	open_file.flush()
+	os.fsync(open_file.fileno())
+
+def fsync_dir(path):
+	''' Sync a directory so that renames and unlinks within it are durable. '''
+	dir_fd = os.open(path, os.O_RDONLY)
+	try:
+		os.fsync(dir_fd)
+	finally:
+		os.close(dir_fd)
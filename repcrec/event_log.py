@@ -0,0 +1,217 @@
+'''
+Leveled and buffered log of transaction manager events.
+
+Every event has a level, and events below the level of the log are dropped
+before their messages are formatted, so callers pass a format string and its
+arguments rather than a message. Setting the level to OFF turns logging off.
+
+There are four levels:
+	DEBUG   : per-tick events such as the commands sent in each tick
+	INFO    : transaction operations, site recovery, and dumps
+	WARNING : aborts, kills, and site failures
+	OFF     : nothing is logged
+
+Events are buffered and written to the stream together when the log is
+flushed or when the buffer fills. Events are written either in the text format
+of the transaction manager
+
+	t3,    T1 : write x2 <- 5 to sites {1, 2}
+
+or as JSON lines with fields tick, level, event, txid, and msg. A TeeLog writes
+every event to several logs, each with its own stream, level, and format.
+
+(c) 2013 Brandon Reiss
+'''
+
+import itertools as it
+import json
+import sys
+
+class LazyJoin(object):
+	'''
+	Log message argument formatting items as a comma-separated list only when
+	the message is formatted.
+	'''
+
+	def __init__(self, items):
+		self._items = items
+
+	def __format__(self, format_spec):
+		return ', '.join(it.imap(str, self._items))
+
+class EventLog(object):
+	''' Leveled and buffered event log. '''
+
+	_ALLOWED_LEVELS = range(4)
+	DEBUG, INFO, WARNING, OFF = _ALLOWED_LEVELS
+
+	_LEVEL_NAMES = {
+			DEBUG: 'debug',
+			INFO: 'info',
+			WARNING: 'warning',
+			OFF: 'off',
+			}
+
+	_ALLOWED_FORMATS = range(2)
+	TEXT_FORMAT, JSON_FORMAT = _ALLOWED_FORMATS
+
+	_FORMAT_NAMES = {
+			TEXT_FORMAT: 'text',
+			JSON_FORMAT: 'json',
+			}
+
+	def __init__(self, stream=None, level=DEBUG, log_format=TEXT_FORMAT,
+			buffer_events=1024):
+		'''
+		Initialize the log.
+
+		Parameters
+		----------
+		stream : file or None
+			Stream to write events to or None to write to the sys.stdout of
+			the time of each flush.
+		level : EventLog.DEBUG, INFO, WARNING, or OFF
+			Lowest level of events that are logged.
+		log_format : EventLog.TEXT_FORMAT or JSON_FORMAT
+			Format of written events.
+		buffer_events : integer
+			Number of events buffered before they are written.
+		'''
+
+		if level not in self._ALLOWED_LEVELS:
+			raise ValueError('Log level {} is not recognized'.format(level))
+		if log_format not in self._ALLOWED_FORMATS:
+			raise ValueError(
+					'Log format {} is not recognized'.format(log_format))
+
+		self._stream = stream
+		self._level = level
+		self._log_format = log_format
+		self._buffer_events = buffer_events
+		self._buffer = []
+
+	@classmethod
+	def parse_level(cls, name):
+		''' Get the level for a level name. '''
+
+		for level, level_name in cls._LEVEL_NAMES.iteritems():
+			if level_name == name:
+				return level
+		raise ValueError('Log level {} is not recognized'.format(name))
+
+	@classmethod
+	def parse_format(cls, name):
+		''' Get the format for a format name. '''
+
+		for log_format, format_name in cls._FORMAT_NAMES.iteritems():
+			if format_name == name:
+				return log_format
+		raise ValueError('Log format {} is not recognized'.format(name))
+
+	@property
+	def level(self):
+		''' Lowest level of events that are logged. '''
+		return self._level
+
+	def enabled(self, level):
+		''' Check whether events of a level are logged. '''
+		return level >= self._level and self._level is not self.OFF
+
+	def log(self, level, tick, txid, event, msg_format, *args):
+		'''
+		Log an event. The message is formatted only when the event is logged.
+
+		Parameters
+		----------
+		level : EventLog.DEBUG, INFO, or WARNING
+			Level of the event.
+		tick : integer
+			Time of the event.
+		txid : integer or None
+			Transaction of the event or None.
+		event : string
+			Name of the kind of event such as 'write' or 'commit'.
+		msg_format : string
+			Message format string, formatted with args.
+		'''
+
+		if not self.enabled(level):
+			return
+
+		msg = msg_format.format(*args) if len(args) > 0 else msg_format
+		if self._log_format is self.TEXT_FORMAT:
+			self._buffer.append('{:<4s} {:>4s} : {}\n'.format(
+					't{},'.format(tick),
+					'T{}'.format(txid) if txid is not None else '--', msg))
+		else:
+			self._buffer.append(json.dumps(dict(tick=tick,
+				level=self._LEVEL_NAMES[level], event=event, txid=txid,
+				msg=msg), sort_keys=True) + '\n')
+
+		if len(self._buffer) >= self._buffer_events:
+			self.flush()
+
+	def log_text(self, level, tick, event, text):
+		'''
+		Log multi-line text such as a dump. The text is written as is in the
+		text format.
+		'''
+
+		if not self.enabled(level):
+			return
+
+		if self._log_format is self.TEXT_FORMAT:
+			self._buffer.append(text + '\n')
+		else:
+			self._buffer.append(json.dumps(dict(tick=tick,
+				level=self._LEVEL_NAMES[level], event=event, txid=None,
+				msg=text), sort_keys=True) + '\n')
+
+		if len(self._buffer) >= self._buffer_events:
+			self.flush()
+
+	def flush(self):
+		''' Write buffered events. '''
+
+		if len(self._buffer) > 0:
+			stream = self._stream if self._stream is not None else sys.stdout
+			stream.write(''.join(self._buffer))
+			self._buffer = []
+
+class TeeLog(object):
+	''' Log writing every event to several event logs. '''
+
+	def __init__(self, event_logs):
+		'''
+		Initialize the log.
+
+		Parameters
+		----------
+		event_logs : list of EventLog
+			Logs that each filter and write every event.
+		'''
+		self._event_logs = list(event_logs)
+
+	@property
+	def level(self):
+		''' Lowest level of events that any of the logs logs. '''
+		return min(event_log.level for event_log in self._event_logs)
+
+	def enabled(self, level):
+		''' Check whether events of a level are logged by any of the logs. '''
+		return any(event_log.enabled(level) for event_log in self._event_logs)
+
+	def log(self, level, tick, txid, event, msg_format, *args):
+		''' Log an event to every log. See EventLog.log(). '''
+		for event_log in self._event_logs:
+			event_log.log(level, tick, txid, event, msg_format, *args)
+
+	def log_text(self, level, tick, event, text):
+		''' Log multi-line text to every log. See EventLog.log_text(). '''
+		for event_log in self._event_logs:
+			event_log.log_text(level, tick, event, text)
+
+	def flush(self):
+		''' Write buffered events of every log. '''
+		for event_log in self._event_logs:
+			event_log.flush()
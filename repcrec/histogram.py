@@ -0,0 +1,153 @@
+'''
+Histograms of latencies in the style of HdrHistogram.
+
+Values are non-negative integers such as microseconds. Buckets are linear below
+2 * 10^significant_digits and then double in width with every power of two, so
+every value is counted in a bucket whose width is within the requested number
+of significant decimal digits of the value. Only buckets with counts are kept,
+so recording costs a dict update whatever the range of values.
+
+Percentiles report the highest value of the bucket holding the percentile,
+clamped to the largest value recorded, as HdrHistogram does.
+
+(c) 2013 Brandon Reiss
+'''
+
+import collections
+import math
+
+class Histogram(object):
+	''' Log-linear histogram of non-negative integer values. '''
+
+	def __init__(self, significant_digits=2):
+		'''
+		Initialize an empty histogram.
+
+		Parameters
+		----------
+		significant_digits : integer
+			Number of significant decimal digits kept for each value, from 1
+			to 5.
+		'''
+
+		if significant_digits not in range(1, 6):
+			raise ValueError('Significant digits must be from 1 to 5')
+
+		self._significant_digits = significant_digits
+		self._sub_bucket_bits = int(math.ceil(
+			math.log(2 * 10 ** significant_digits, 2)))
+		self._half_sub_buckets = 1 << (self._sub_bucket_bits - 1)
+		self._counts = collections.Counter()
+		self._count = 0
+		self._total = 0
+		self._min = None
+		self._max = None
+
+	def __len__(self):
+		return self._count
+
+	def _index(self, value):
+		''' Get the bucket index of a value. '''
+		shift = max(value.bit_length() - self._sub_bucket_bits, 0)
+		return shift * self._half_sub_buckets + (value >> shift)
+
+	def _highest_equivalent(self, index):
+		''' Get the highest value counted in a bucket. '''
+
+		if index < 2 * self._half_sub_buckets:
+			return index
+		shift = index // self._half_sub_buckets - 1
+		sub_bucket = index - shift * self._half_sub_buckets
+		return ((sub_bucket + 1) << shift) - 1
+
+	@property
+	def significant_digits(self):
+		''' Number of significant decimal digits kept for each value. '''
+		return self._significant_digits
+
+	@property
+	def min(self):
+		''' Smallest value recorded or None when empty. '''
+		return self._min
+
+	@property
+	def max(self):
+		''' Largest value recorded or None when empty. '''
+		return self._max
+
+	@property
+	def mean(self):
+		''' Mean of the values recorded or None when empty. '''
+		return float(self._total) / self._count if self._count > 0 else None
+
+	def record(self, value, count=1):
+		''' Record a value count times. '''
+
+		value = int(value)
+		if value < 0:
+			raise ValueError('Histogram values must not be negative')
+
+		self._counts[self._index(value)] += count
+		self._count += count
+		self._total += value * count
+		if self._min is None or value < self._min:
+			self._min = value
+		if self._max is None or value > self._max:
+			self._max = value
+
+	def add(self, histogram):
+		''' Add the counts of another histogram of the same precision. '''
+
+		if histogram.significant_digits != self._significant_digits:
+			raise ValueError('Histograms must have the same precision')
+
+		self._counts.update(histogram._counts)
+		self._count += histogram._count
+		self._total += histogram._total
+		for value in (histogram.min, histogram.max):
+			if value is not None:
+				self._min = value if self._min is None \
+						else min(self._min, value)
+				self._max = value if self._max is None \
+						else max(self._max, value)
+
+	def value_at_percentile(self, percentile):
+		'''
+		Get the value at a percentile from 0 to 100 or None when empty.
+		'''
+
+		if self._count is 0:
+			return None
+
+		rank = max(int(math.ceil(percentile / 100. * self._count)), 1)
+		seen = 0
+		for index in sorted(self._counts):
+			seen += self._counts[index]
+			if seen >= rank:
+				return min(self._highest_equivalent(index), self._max)
+		return self._max
+
+	def percentiles(self, percentiles=(50, 90, 99, 99.9, 100)):
+		''' Get a list of (percentile, value) tuples. '''
+		return [(percentile, self.value_at_percentile(percentile))
+				for percentile in percentiles]
+
+	def to_dict(self):
+		'''
+		Summarize the histogram as a dict of 'count', 'min', 'mean', 'max',
+		and 'percentiles', a list of (percentile, value) tuples.
+		'''
+		return dict(count=self._count, min=self._min, mean=self.mean,
+				max=self._max, percentiles=self.percentiles())
+
+	def format(self, unit=''):
+		'''
+		Format the histogram as a single line of its count and percentiles
+		with values suffixed by unit.
+		'''
+
+		if self._count is 0:
+			return 'count 0'
+		return 'count {} mean {:.0f}{} {}'.format(self._count, self.mean,
+				unit, ' '.join('p{:g} {}{}'.format(percentile, value, unit)
+					for percentile, value in self.percentiles()))
@@ -0,0 +1,80 @@
+'''
+Formatting of lock graphs reported by TransactionManager.get_lock_graph().
+
+A lock graph is a dict of builtin types with
+	'tick' : time of the graph
+	'waits_for' : list of edges of the waits-for graph, each a dict with the
+		waiting 'txid', the 'variable' it waits on, and the sorted txids
+		'blocked_by' that hold conflicting locks at any site
+	'variables' : list of contention counts of variables, hottest first, each
+		a dict of 'variable', 'lock_grants' and 'lock_conflicts' summed over
+		sites, 'blocks' and 'wait_die_kills' of transactions on the variable,
+		and the number of transactions 'waiting' on it now
+
+Graphs format as text, as a DOT digraph whose variable nodes are shaded by
+their share of lock conflicts, or as JSON.
+
+(c) 2013 Brandon Reiss
+'''
+
+import json
+
+def format_text(graph):
+	''' Format a lock graph as lines of edges and of contention counts. '''
+
+	lines = ['waits-for at t{}:'.format(graph['tick'])]
+	for edge in graph['waits_for']:
+		lines.append('  T{} waits on x{} for {}'.format(
+			edge['txid'], edge['variable'],
+			', '.join('T{}'.format(txid) for txid in edge['blocked_by'])
+			if len(edge['blocked_by']) > 0 else 'an available site'))
+
+	lines.append('contention:')
+	for counts in graph['variables']:
+		lines.append(('  x{variable}: {lock_conflicts} conflicts, '
+			'{lock_grants} grants, {blocks} blocks, {wait_die_kills} kills, '
+			'{waiting} waiting').format(**counts))
+	return '\n'.join(lines)
+
+# Number of colors in the DOT color scheme that shades variables.
+_DOT_SHADES = 9
+
+def format_dot(graph):
+	'''
+	Format a lock graph as a DOT digraph. Edges point from waiting
+	transactions to their blockers and are labeled by variable, and variable
+	nodes are shaded by their share of the most conflicts of any variable.
+	'''
+
+	lines = ['digraph locks {', '  label="t{}";'.format(graph['tick'])]
+	for edge in graph['waits_for']:
+		for txid in edge['blocked_by']:
+			lines.append('  "T{}" -> "T{}" [label="x{}"];'.format(
+				edge['txid'], txid, edge['variable']))
+		if len(edge['blocked_by']) is 0:
+			lines.append('  "T{}" -> "x{}" [style=dashed];'.format(
+				edge['txid'], edge['variable']))
+
+	most_conflicts = max([counts['lock_conflicts']
+		for counts in graph['variables']] + [1])
+	lines.append('  node [shape=box, style=filled, colorscheme=reds{}];'
+			.format(_DOT_SHADES))
+	for counts in graph['variables']:
+		shade = 1 + (_DOT_SHADES - 1) * counts['lock_conflicts'] \
+				// most_conflicts
+		lines.append(('  "x{variable}" [label="x{variable}\\n'
+			'{lock_conflicts} conflicts\\n{wait_die_kills} kills", '
+			'fillcolor={shade}];').format(shade=shade, **counts))
+	lines.append('}')
+	return '\n'.join(lines)
+
+def format_json(graph):
+	''' Format a lock graph as JSON. '''
+	return json.dumps(graph, sort_keys=True)
+
+# Map of format names to lock graph formatters.
+LOCK_GRAPH_FORMATS = {
+		'text': format_text,
+		'dot': format_dot,
+		'json': format_json,
+		}
@@ -3,9 +3,17 @@ The database lock manager manages read and read-write locks for an arbitrary
 database. It supports multiple readers and single writers, and it will promote
 automatically a single reader to a single writer when requested.
 
+Lock holders are kept in sets, and each transaction keeps an index of the
+variables that it has locked, so releasing all locks of a transaction costs
+time proportional to the number of locks that it holds.
+
+Lock grants and conflicts are counted for each variable in a Metrics registry.
+
 (c) 2013 Brandon Reiss
 '''
 
+from repcrec.metrics import Metrics
+
 import StringIO
 
 class LockManager(object):
@@ -20,18 +28,28 @@ class LockManager(object):
 			RW_LOCK: 'W',
 			}
 
-	def __init__(self):
+	def __init__(self, metrics=None):
 		'''
 		Initialize the lock manager. All variables are unlocked initially.
+
+		Parameters
+		----------
+		metrics : Metrics or None
+			Registry counting 'lock_grants' and 'lock_conflicts' by variable.
+			The registry may outlive the lock manager.
 		'''
 		self._lock_table = dict()
+		self._held = dict()
+		metrics = metrics if metrics is not None else Metrics()
+		self._grants = metrics.keyed_counter('lock_grants')
+		self._conflicts = metrics.keyed_counter('lock_conflicts')
 
 	def __repr__(self):
 		def fmt_lock_state(txids, state):
 			''' Format lock state string. '''
 			if len(txids) > 0:
 				return '{} <- {}'.format(
-						txids, self._LOCK_TABLE_STATES[state])
+						sorted(txids), self._LOCK_TABLE_STATES[state])
 			else:
 				return self._LOCK_TABLE_STATES[self._UNLOCKED]
 
@@ -42,6 +60,11 @@ class LockManager(object):
 		out.seek(0)
 		return out.read()
 
+	@property
+	def num_locked(self):
+		''' Number of variables locked by any transaction. '''
+		return len(self._lock_table)
+
 	def get_locks(self, variable):
 		'''
 		Get the locks for a variable.
@@ -54,8 +77,8 @@ class LockManager(object):
 		Returns
 		-------
 		lock_state : tuple of (txids, node) or None
-			Ids of transactions holding a lock for the variable and the mode of
-			the lock or None if no locks are held.
+			Set of ids of transactions holding a lock for the variable and the
+			mode of the lock or None if no locks are held.
 		'''
 
 		if variable not in self._lock_table:
@@ -86,40 +109,44 @@ class LockManager(object):
 			raise ValueError(
 					'Lock mode {} is not recognized'.format(mode))
 
-		# Add a lock table entry for a new variable.
 		if variable not in self._lock_table:
-			self._lock_table[variable] = ([], self._UNLOCKED)
+			# The lock is not claimed. Claim it.
+			self._lock_table[variable] = (set([txid]), mode)
+			self._held.setdefault(txid, set()).add(variable)
+			self._grants[variable] += 1
+			return True
 
 		# Lookup lock state.
 		txids, state = self._lock_table[variable]
 
-		if len(txids) is 0:
-			# The lock is not claimed. Claim it.
-			self._lock_table[variable] = ([txid], mode)
-			return True
-
-		elif txid in txids:
+		if txid in txids:
 			# Either the txid has the desired lock type already, or it is
 			# trying to promote.
 			if mode is self.RW_LOCK:
 				if len(txids) is 1:
 					# Become the unique writer.
 					self._lock_table[variable] = (txids, mode)
+					self._grants[variable] += 1
 					return True
 				else:
 					# There are multiple read clients already.
+					self._conflicts[variable] += 1
 					return False
 			else:
 				# No need to change the lock mode if we want to read.
+				self._grants[variable] += 1
 				return True
 
 		elif state is self.R_LOCK and mode is self.R_LOCK:
 			# Add a new read lock client.
-			txids.append(txid)
+			txids.add(txid)
+			self._held.setdefault(txid, set()).add(variable)
+			self._grants[variable] += 1
 			return True
 
 		else:
 			# The write lock is held already.
+			self._conflicts[variable] += 1
 			return False
 
 	def get_lock_state(self, variable, txid):
@@ -165,13 +192,24 @@ class LockManager(object):
 
 		txids.remove(txid)
 		if len(txids) is 0:
-			self._lock_table[variable] = ([], self._UNLOCKED)
+			del self._lock_table[variable]
+
+		held = self._held[txid]
+		held.remove(variable)
+		if len(held) is 0:
+			del self._held[txid]
+
+	def get_held(self, txid):
+		''' Get the set of variables locked by a transaction. '''
+		return frozenset(self._held.get(txid, ()))
 
 	def unlock_all(self, txid):
 		''' Unlock all locks held by the given transaction. '''
 
-		for variable, (txids, _) in self._lock_table.iteritems():
-			if txid in txids:
-				self.unlock(variable, txid)
+		for variable in self._held.pop(txid, ()):
+			txids, _ = self._lock_table[variable]
+			txids.remove(txid)
+			if len(txids) is 0:
+				del self._lock_table[variable]
 
 
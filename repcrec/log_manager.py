@@ -0,0 +1,167 @@
+'''
+The log manager keeps an append-only write-ahead log of committed writes for a
+DatabaseManager.
+
+Each commit appends a single record holding only the (variable, value) pairs
+that it changed. Records are buffered in memory and written to the log file
+together on flush(), which allows all commits in a group to share one write.
+Every record carries a checksum, so a record torn by a failure during flush()
+is detected and discarded by replay() along with anything after it.
+
+(c) 2013 Brandon Reiss
+'''
+
+from repcrec.durability import fsync_file, fsync_dir
+
+import os
+import zlib
+
+class LogManager(object):
+	''' Append-only write-ahead log. '''
+
+	def __init__(self, log_file_path):
+		'''
+		Initialize the log.
+
+		Parameters
+		----------
+		log_file_path : string
+			Path to the log file. The file is created when it does not exist.
+		'''
+
+		self._log_file_path = log_file_path
+		self._log_file = open(self._log_file_path, 'a')
+		self._buffer = []
+
+	@property
+	def log_file_path(self):
+		''' Path to the log file. '''
+		return self._log_file_path
+
+	@property
+	def size(self):
+		''' Size of the log in bytes including buffered records. '''
+		return os.fstat(self._log_file.fileno()).st_size + \
+				sum(len(record) for record in self._buffer)
+
+	@staticmethod
+	def _format_record(values):
+		''' Format a record as a checksummed line. '''
+
+		payload = ' '.join('{} {}'.format(variable, value)
+				for variable, value in values)
+		return '{:08x} {}\n'.format(zlib.crc32(payload) & 0xffffffff, payload)
+
+	@staticmethod
+	def _parse_record(line):
+		'''
+		Parse a record line into a tuple of (variable, value) or return None
+		when the record is torn or corrupt.
+		'''
+
+		if not line.endswith('\n'):
+			return None
+
+		checksum, _, payload = line[:-1].partition(' ')
+		try:
+			if int(checksum, 16) != zlib.crc32(payload) & 0xffffffff:
+				return None
+			fields = [int(field) for field in payload.split()]
+		except ValueError:
+			return None
+
+		if len(fields) & 1:
+			return None
+		return tuple(zip(fields[0::2], fields[1::2]))
+
+	def append(self, values):
+		'''
+		Buffer a record of (variable, value) tuples. The record is not durable
+		until flush() is called.
+		'''
+
+		values = tuple(values)
+		if len(values) > 0:
+			self._buffer.append(self._format_record(values))
+
+	def pending(self):
+		''' Check if there are buffered records that are not flushed. '''
+		return len(self._buffer) > 0
+
+	def flush(self, sync=False):
+		'''
+		Write all buffered records to the log file with a single write. The
+		log file is synced to stable storage when sync is True. Returns the
+		number of bytes written.
+		'''
+
+		num_bytes = 0
+		if len(self._buffer) > 0:
+			data = ''.join(self._buffer)
+			self._log_file.write(data)
+			self._log_file.flush()
+			self._buffer = []
+			num_bytes = len(data)
+
+		if sync is True:
+			fsync_file(self._log_file)
+		return num_bytes
+
+	def replay(self):
+		'''
+		Read all complete records from the log file. Each record is a tuple of
+		(variable, value) tuples. A torn record and anything following it are
+		truncated from the log so that new records are appended after the last
+		complete one.
+		'''
+
+		records, offset, torn = [], 0, False
+		with open(self._log_file_path, 'r') as log_file:
+			for line in log_file:
+				record = self._parse_record(line)
+				if record is None:
+					torn = True
+					break
+				records.append(record)
+				offset += len(line)
+
+		if torn is True:
+			self._log_file.truncate(offset)
+
+		return records
+
+	def truncate(self):
+		''' Discard the log file contents and any buffered records. '''
+
+		self._buffer = []
+		self._log_file.close()
+		self._log_file = open(self._log_file_path, 'w')
+
+	def truncate_prefix(self, offset, sync=False):
+		'''
+		Discard the records written before a log file offset. Records after
+		the offset and buffered records are kept. The log is rewritten to a
+		temporary file that then replaces it atomically, and the replacement
+		is synced to stable storage when sync is True.
+		'''
+
+		self._log_file.flush()
+		tmp_path = '{}.tmp'.format(self._log_file_path)
+		with open(self._log_file_path, 'r') as log_file:
+			log_file.seek(offset)
+			with open(tmp_path, 'w') as tmp_file:
+				tmp_file.write(log_file.read())
+				if sync is True:
+					fsync_file(tmp_file)
+
+		self._log_file.close()
+		os.rename(tmp_path, self._log_file_path)
+		if sync is True:
+			fsync_dir(os.path.dirname(self._log_file_path))
+		self._log_file = open(self._log_file_path, 'a')
+
+	def close(self):
+		''' Close the log file. Buffered records are discarded. '''
+
+		self._buffer = []
+		self._log_file.close()
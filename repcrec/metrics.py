@@ -0,0 +1,79 @@
+'''
+Registry of runtime counters.
+
+Counters are plain integers in a dict and keyed counters count by a key such as
+a variable, so incrementing a counter costs a dict update and counters may be
+left on. A snapshot of a registry is a dict of counter names to integers and of
+keyed counter names to dicts of keys to integers. Snapshots hold only builtin
+types, so they may be sent between processes and merged.
+
+(c) 2013 Brandon Reiss
+'''
+
+import collections
+
+class Metrics(object):
+	''' Registry of counters and keyed counters. '''
+
+	def __init__(self):
+		self._counters = collections.Counter()
+		self._keyed = collections.defaultdict(collections.Counter)
+
+	def incr(self, name, amount=1):
+		''' Increment a counter. '''
+		self._counters[name] += amount
+
+	def incr_key(self, name, key, amount=1):
+		''' Increment a keyed counter for a key. '''
+		self._keyed[name][key] += amount
+
+	def keyed_counter(self, name):
+		'''
+		Get the Counter of a keyed counter. Hot paths increment it directly
+		to skip a method call.
+		'''
+		return self._keyed[name]
+
+	def get(self, name):
+		''' Get the value of a counter. '''
+		return self._counters[name]
+
+	def snapshot(self):
+		''' Copy all counters into a snapshot. '''
+
+		snapshot = dict(self._counters)
+		for name, counter in self._keyed.iteritems():
+			snapshot[name] = dict(counter)
+		return snapshot
+
+	@staticmethod
+	def merge(snapshots):
+		'''
+		Merge snapshots by adding counters and the counts of each key of
+		keyed counters.
+		'''
+
+		merged = dict()
+		for snapshot in snapshots:
+			for name, value in snapshot.iteritems():
+				if isinstance(value, dict):
+					counts = merged.setdefault(name, dict())
+					for key, count in value.iteritems():
+						counts[key] = counts.get(key, 0) + count
+				else:
+					merged[name] = merged.get(name, 0) + value
+		return merged
+
+def format_snapshot(snapshot):
+	'''
+	Format a snapshot as lines of "name: value" sorted by name. Keyed counters
+	are formatted as "name: key=count, ..." sorted by key.
+	'''
+
+	lines = []
+	for name, value in sorted(snapshot.iteritems()):
+		if isinstance(value, dict):
+			value = ', '.join('{}={}'.format(key, count)
+					for key, count in sorted(value.iteritems()))
+		lines.append('{}: {}'.format(name, value))
+	return '\n'.join(lines)
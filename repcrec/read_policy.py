@@ -0,0 +1,118 @@
+'''
+Read replica selection policies for the TransactionManager.
+
+A read tries the replica sites of a variable in the order given by a policy
+and is served by the first site that can read it. Every policy counts the reads
+served by each site so that the spread of read load can be compared.
+
+There are four policies:
+	first-available       : sites in placement order
+	round-robin           : rotate the first site for each variable
+	least-locked          : sites holding the fewest locks first
+	least-recently-failed : sites that recovered the longest ago first
+
+(c) 2013 Brandon Reiss
+'''
+
+import collections
+
+class ReadPolicy(object):
+	''' Base read replica selection policy. Tries sites in placement order. '''
+
+	NAME = 'first-available'
+
+	def __init__(self):
+		''' Initialize the policy with no reads counted. '''
+		self._reads = collections.Counter()
+
+	def __repr__(self):
+		return self.NAME
+
+	def order(self, variable, replicas):
+		'''
+		Order replica sites for a read.
+
+		Parameters
+		----------
+		variable : integer
+			Variable to read.
+		replicas : list of Site
+			Replica sites of the variable in placement order.
+
+		Returns
+		-------
+		replicas : list of Site
+			Replica sites in the order to try.
+		'''
+		return replicas
+
+	def record_read(self, site):
+		''' Count a read served by a site. '''
+		self._reads[site.index] += 1
+
+	@property
+	def distribution(self):
+		''' Dict of site index to the number of reads that it served. '''
+		return dict(self._reads)
+
+
+class RoundRobinPolicy(ReadPolicy):
+	''' Rotate the first replica tried for each variable. '''
+
+	NAME = 'round-robin'
+
+	def __init__(self):
+		''' Initialize the policy with a rotation for each variable. '''
+		super(RoundRobinPolicy, self).__init__()
+		self._next = collections.Counter()
+
+	def order(self, variable, replicas):
+		''' Order replicas starting after the one tried first last time. '''
+
+		if len(replicas) is 0:
+			return replicas
+
+		start = self._next[variable] % len(replicas)
+		self._next[variable] = start + 1
+		return replicas[start:] + replicas[:start]
+
+
+class LeastLockedPolicy(ReadPolicy):
+	''' Try replicas holding the fewest locks first. '''
+
+	NAME = 'least-locked'
+
+	def order(self, variable, replicas):
+		''' Order replicas by lock table occupancy. Ties keep site order. '''
+		return sorted(replicas, key=lambda site: site.num_locked)
+
+
+class LeastRecentlyFailedPolicy(ReadPolicy):
+	'''
+	Try replicas that are up the longest first. Down sites are last.
+
+	Sites do not record when they fail, so the tick of the last recovery of a
+	site, which is when it came up, stands in for the time of its last
+	failure. A site that was down for long and recovered recently ranks after
+	one that failed more recently but recovered sooner.
+	'''
+
+	NAME = 'least-recently-failed'
+
+	def order(self, variable, replicas):
+		''' Order replicas by time since recovery. Ties keep site order. '''
+		return sorted(replicas, key=lambda site:
+				(site.up_since is None, site.up_since))
+
+
+# Map of policy names to policy classes.
+READ_POLICIES = dict((policy.NAME, policy) for policy in (
+	ReadPolicy, RoundRobinPolicy, LeastLockedPolicy,
+	LeastRecentlyFailedPolicy))
+
+def make_read_policy(name):
+	''' Create a read policy from its name. '''
+
+	if name not in READ_POLICIES:
+		raise ValueError('Read policy {} is not recognized'.format(name))
+	return READ_POLICIES[name]()
@@ -0,0 +1,345 @@
+'''
+Network front-end accepting RepCRec commands from many clients at once.
+
+Clients connect over TCP or a Unix socket and send lines in the command grammar
+of parse_commands(). The server batches lines into ticks for
+TransactionManager.send_commands(), taking at most one line from each client
+per tick so that the lines of a client run in separate ticks in the order that
+they were sent. Commands from different clients in the same tick run in the
+order that their lines arrived.
+
+While a transaction is blocked, the lines of its client that name the
+transaction are held along with every later line of that client until the
+blocked command runs. Ticks that only retry woken transactions run without any
+lines.
+
+The server streams results back to each client for every command it sent. The
+commands of a client are numbered from 1 across all of its lines, and for each
+command the client receives the lines that the command logged at the INFO level
+and above in the text format, whatever the settings of the event log of the
+transaction manager, and then a status line
+
+	3 | t7,   T2 : write x4 <- 5 to sites {1, 2}
+	3 ok
+
+or a status line of the form "3 error MESSAGE" when the command is rejected.
+Lines logged outside of any command about a transaction that the client began,
+such as a blocked command that finally runs, are sent as "* | LINE".
+
+Transactions that a client leaves open when it disconnects stay open.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec.commands import parse_commands
+from repcrec.event_log import EventLog
+from repcrec.util import parse_txid
+
+import asynchat
+import asyncore
+import collections
+import os
+import re
+import socket
+import StringIO
+import time
+
+# Log lines from TransactionManager name their transaction after the tick.
+_TXID_PATTERN = re.compile(r't[0-9]+,\s+T([0-9]+) :')
+
+def parse_address(address):
+	'''
+	Parse a listening address into a tuple (family, address). Addresses
+	containing a '/' are Unix socket paths and others are HOST:PORT.
+	'''
+
+	if '/' in address:
+		return socket.AF_UNIX, address
+
+	host, _, port = address.rpartition(':')
+	try:
+		return socket.AF_INET, (host or 'localhost', int(port))
+	except ValueError:
+		raise ValueError(
+				'Address {} must be HOST:PORT or a socket path'.format(address))
+
+class _CommandChannel(asynchat.async_chat):
+	''' Connection to a single client. '''
+
+	def __init__(self, server, sock, socket_map):
+		asynchat.async_chat.__init__(self, sock, map=socket_map)
+		self.set_terminator('\n')
+		self._server = server
+		self._buffer = []
+		self._next_seq = 1
+		self._reading = True
+
+		# Lines waiting to run as tuples of (commands, seqs).
+		self.pending = collections.deque()
+
+	def collect_incoming_data(self, data):
+		''' Buffer part of a line. '''
+		self._buffer.append(data)
+
+	def found_terminator(self):
+		''' Parse a line and queue its commands for the next free tick. '''
+
+		line = ''.join(self._buffer)
+		self._buffer = []
+
+		try:
+			commands = parse_commands(line)
+		except ValueError as error:
+			self.reply(self.take_seqs(1)[0], 'error {}'.format(error))
+			return
+
+		if commands is not None:
+			self._server.enqueue(self, commands, self.take_seqs(len(commands)))
+
+	@property
+	def finished(self):
+		''' Check whether the client stopped sending and all its lines ran. '''
+		return self._reading is False and len(self.pending) is 0
+
+	def take_seqs(self, count):
+		''' Number the next count commands of the client. '''
+		seqs = range(self._next_seq, self._next_seq + count)
+		self._next_seq += count
+		return seqs
+
+	def reply(self, seq, msg):
+		''' Send a line about a command. '''
+		self.push('{} {}\n'.format(seq, msg))
+
+	def readable(self):
+		''' Read until the client stops sending. '''
+		return self._reading and asynchat.async_chat.readable(self)
+
+	def handle_close(self):
+		'''
+		Run the lines that the client sent before it stopped sending and then
+		close. Drop the client when it closes again.
+		'''
+
+		if self._reading is True:
+			self._reading = False
+			if self.finished:
+				self.close_when_done()
+		else:
+			self._server.disconnect(self)
+			self.close()
+
+class CommandServer(asyncore.dispatcher):
+	''' Serve a TransactionManager to network clients. '''
+
+	# Seconds without ticks between syncs of batches of flushed data.
+	_IDLE_SYNC_SECONDS = 1.
+
+	def __init__(self, transaction_manager, address, tick_interval=0.):
+		'''
+		Listen for clients.
+
+		Parameters
+		----------
+		transaction_manager : TransactionManager
+			Database that runs the commands.
+		address : string
+			HOST:PORT to listen on TCP or a path to listen on a Unix socket.
+			Port 0 picks a free port.
+		tick_interval : float
+			Minimum seconds between ticks. Lines arriving within the interval
+			share a tick.
+		'''
+
+		self._socket_map = dict()
+		asyncore.dispatcher.__init__(self, map=self._socket_map)
+
+		self._transaction_manager = transaction_manager
+		self._tick_interval = tick_interval
+		self._last_tick = None
+		self._last_sync = time.time()
+		self._running = False
+
+		# Clients with lines waiting to run in the order that their oldest
+		# waiting line arrived and the client that began each transaction.
+		# Note that dispatchers are old-style classes that forward hashing to
+		# their sockets, so they are kept in lists and dict values only.
+		self._ready = collections.deque()
+		self._tx_channels = dict()
+
+		# Results of commands are logged apart from the event log of the
+		# transaction manager so that clients see them whatever its settings.
+		self._results = StringIO.StringIO()
+		transaction_manager.add_event_log(
+				EventLog(self._results, EventLog.INFO))
+
+		family, self._address = parse_address(address)
+		self.create_socket(family, socket.SOCK_STREAM)
+		if family == socket.AF_INET:
+			self.set_reuse_addr()
+		elif os.path.exists(self._address):
+			os.remove(self._address)
+		self.bind(self._address)
+		self.listen(socket.SOMAXCONN)
+
+	@property
+	def address(self):
+		''' Bound address. Either a (host, port) tuple or a socket path. '''
+		return self.socket.getsockname()
+
+	def handle_accept(self):
+		''' Accept a client. '''
+		pair = self.accept()
+		if pair is not None:
+			if self.socket.family == socket.AF_INET:
+				# Results are small lines that must not wait on acknowledgments.
+				pair[0].setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			_CommandChannel(self, pair[0], self._socket_map)
+
+	def enqueue(self, channel, commands, seqs):
+		''' Queue a line of commands from a client. '''
+
+		if len(channel.pending) is 0:
+			self._ready.append(channel)
+		channel.pending.append((commands, seqs))
+
+		# Route log lines about transactions to the client that began them.
+		for cmd, args in commands:
+			if cmd.lower() in ('begin', 'beginro'):
+				try:
+					self._tx_channels[parse_txid(cmd, args, 0)] = channel
+				except ValueError:
+					pass
+
+	def disconnect(self, channel):
+		''' Forget a client and the lines that it has not run yet. '''
+
+		if len(channel.pending) > 0:
+			channel.pending.clear()
+			self._ready = collections.deque(ready for ready in self._ready
+					if ready is not channel)
+		for txid in [txid for txid, owner in self._tx_channels.iteritems()
+				if owner is channel]:
+			del self._tx_channels[txid]
+
+	def _runnable(self, channel):
+		''' Check that the oldest waiting line of a client is not held. '''
+
+		commands, _ = channel.pending[0]
+		for cmd, args in commands:
+			try:
+				txid = parse_txid(cmd, args, 0)
+			except ValueError:
+				continue
+			if self._transaction_manager.is_blocked(txid):
+				return False
+		return True
+
+	@property
+	def _has_work(self):
+		''' Check whether a tick has lines to run or transactions to retry. '''
+		return self._transaction_manager.has_retries or \
+				any(self._runnable(channel) for channel in self._ready)
+
+	def _next_batch(self):
+		''' Take the oldest waiting line of each client that is not held. '''
+
+		channels, self._ready = self._ready, collections.deque()
+		batch = []
+		for channel in channels:
+			if self._runnable(channel):
+				commands, seqs = channel.pending.popleft()
+				batch.append((channel, commands, seqs))
+			if len(channel.pending) > 0:
+				self._ready.append(channel)
+		return batch
+
+	def _route_unattributed(self, output):
+		''' Send lines logged outside of commands to their clients. '''
+
+		for line in output.splitlines():
+			match = _TXID_PATTERN.match(line)
+			if match is not None:
+				channel = self._tx_channels.get(int(match.group(1)))
+				if channel is not None:
+					channel.reply('*', '| ' + line)
+
+	def run_tick(self):
+		''' Run the next batch of pending lines as a single tick. '''
+
+		batch = self._next_batch()
+		commands = [command for _, line, _ in batch for command in line]
+		owners = [(channel, seq) for channel, _, seqs in batch
+				for seq in seqs]
+
+		# Split the results of the tick among the commands.
+		output = self._results
+		output.seek(0)
+		output.truncate()
+		marks = [0]
+
+		def on_command(index, error):
+			''' Send the output and status of a command to its client. '''
+
+			lines = output.getvalue()[marks[0]:]
+			marks[0] = output.tell()
+
+			# Lines logged before the first command are retries.
+			if index is None:
+				self._route_unattributed(lines)
+				return
+
+			channel, seq = owners[index]
+			for line in lines.splitlines():
+				channel.reply(seq, '| ' + line)
+			if error is None:
+				channel.reply(seq, 'ok')
+			else:
+				channel.reply(seq, 'error {}'.format(error))
+
+		try:
+			self._transaction_manager.send_commands(commands, on_command)
+		finally:
+			self._last_tick = self._last_sync = time.time()
+
+		self._route_unattributed(output.getvalue()[marks[0]:])
+
+		# Close clients that stopped sending once their last line has run.
+		for channel, _, _ in batch:
+			if channel.finished:
+				channel.close_when_done()
+
+	def _poll_timeout(self):
+		''' Seconds to wait for clients before the next tick may run. '''
+
+		if not self._has_work:
+			return 1.
+		if self._last_tick is None:
+			return 0.
+		return max(0., self._last_tick + self._tick_interval - time.time())
+
+	def serve_forever(self):
+		''' Serve clients until stop() is called. '''
+
+		self._running = True
+		while self._running is True:
+			asyncore.loop(self._poll_timeout(), map=self._socket_map, count=1)
+			if self._has_work and self._poll_timeout() == 0.:
+				self.run_tick()
+			elif not self._has_work and time.time() >= \
+					self._last_sync + self._IDLE_SYNC_SECONDS:
+				self._transaction_manager.sync()
+				self._last_sync = time.time()
+
+	def stop(self):
+		''' Stop serve_forever() after the current tick. '''
+		self._running = False
+
+	def close(self):
+		''' Disconnect all clients and stop listening. '''
+
+		for dispatcher in self._socket_map.values():
+			if dispatcher is not self:
+				dispatcher.close()
+		asyncore.dispatcher.close(self)
+		if isinstance(self._address, str) and os.path.exists(self._address):
+			os.remove(self._address)
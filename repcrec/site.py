@@ -10,11 +10,20 @@ down. A site must be running only when the read clone is first requested. Since
 read clones are reference counted, they must be released by calling either
 commit() or abort() for each transaction that requested them.
 
+Read clones are shared by the committed version of the site data rather than
+by the time at which they are requested. Transactions that request clones at
+different times read the same clone so long as the site commits nothing in
+between. A clone may be spilled to disk to release the memory it holds.
+
+The lock manager and the database manager count lock grants, lock conflicts,
+and flushes in a Metrics registry of the site that survives site failures.
+
 (c) 2013 Brandon Reiss
 '''
 
 from repcrec.lock_manager import LockManager
 from repcrec.database_manager import DatabaseManager
+from repcrec.metrics import Metrics
 from repcrec.util import OperationStatus
 
 import collections
@@ -22,7 +31,8 @@ import collections
 class Site(object):
 	''' Represents a database site. '''
 
-	def __init__(self, index, variable_defaults, owned_variables, tick, data_path):
+	def __init__(self, index, variable_defaults, owned_variables, tick, data_path,
+			database_options=None):
 		'''
 		Initialize the site.
 
@@ -30,28 +40,37 @@ class Site(object):
 		----------
 		index : integer
 			The integer index of the site.
-		variable_defaults : dict
-			Dict of variables replicated at this site and their default values.
+		variable_defaults : dict or None
+			Dict of variables replicated at this site and their default values
+			or None when the site data file was written by bulk_load() and
+			defines the variables.
 		owned_variables : set of variables
 			Set of variables that are owned exclusively by this site.
 		tick : integer
 			Time that site is first starting.
 		data_path : string
 			Path where site data file resides.
+		database_options : dict or None
+			Keyword options passed through to the site DatabaseManager.
 		'''
 
 		self._index = index
-		self._variables = set(variable_defaults.iterkeys())
+		self._metrics = Metrics()
+		self._database_manager = DatabaseManager(
+				variable_defaults, data_path, self.data_file_prefix(index),
+				metrics=self._metrics, **(database_options or {}))
+
+		self._variables = set(self._database_manager.variables)
 		self._up_since = tick
 		self._available_variables = self._variables
 		self._owned_variables = set(owned_variables)
-
-		self._database_manager = DatabaseManager(
-				variable_defaults, data_path, 'site_{}'.format(index))
-		self._lock_manager = LockManager()
+		self._lock_manager = LockManager(self._metrics)
 
 		self._pending_writes = collections.defaultdict(list)
+		# Map of commit version to (use_count, clone) and of each reader
+		# (txid, tick) to the version of its clone.
 		self._multiversion_clones = dict()
+		self._multiversion_readers = dict()
 
 	def __repr__(self):
 		return '{{ \'index\': {}, \'data\': {}, \'locks\': {} }}'.format(
@@ -82,6 +101,11 @@ class Site(object):
 				dict((variable, available(variable))
 						for variable in self._variables)
 
+	@staticmethod
+	def data_file_prefix(index):
+		''' Prefix of the data files of the site with the given index. '''
+		return 'site_{}'.format(index)
+
 	@property
 	def index(self):
 		''' The site index. '''
@@ -92,17 +116,68 @@ class Site(object):
 		''' Time when site started or recovered. None if site is down. '''
 		return self._up_since
 
+	@property
+	def recovery_stats(self):
+		''' Statistics for the last recovery of the site database. '''
+		return self._database_manager.recovery_stats
+
+	@property
+	def commit_version(self):
+		''' Version of the committed site data. Increases on each commit. '''
+		return self._database_manager.version
+
+	@property
+	def snapshot_bytes(self):
+		''' Estimated memory in bytes held for multiversion clones. '''
+		return self._database_manager.snapshot_bytes
+
+	@property
+	def num_locked(self):
+		''' Number of variables locked at the site. '''
+		return self._lock_manager.num_locked
+
+	def metrics_snapshot(self):
+		''' Snapshot of the site counters. See Metrics.snapshot(). '''
+		return self._metrics.snapshot()
+
+	@property
+	def variables(self):
+		''' Set of variables replicated at the site. '''
+		return frozenset(self._variables)
+
+	def has_variable(self, variable):
+		''' Check whether the site hosts a variable. '''
+		return variable in self._variables
+
+	def has_pending_writes(self, txid):
+		''' Check whether a transaction has writes pending at the site. '''
+		return txid in self._pending_writes
+
 	def is_up(self):
 		''' Query whether wite is up. '''
 		return self._up_since is not None
 
+	def begin_group_commit(self):
+		''' Begin a group of commits that share a single flush. '''
+		self._database_manager.begin_group()
+
+	def end_group_commit(self):
+		''' End a group of commits and flush them together. '''
+		self._database_manager.end_group()
+
 	def fail(self):
 		''' Fail the site. '''
+		# Commits already made in the current group remain durable.
+		self._database_manager.sync()
 		self._up_since = None
 		self._available_variables = set()
-		self._lock_manager = LockManager()
+		self._lock_manager = LockManager(self._metrics)
 		self._pending_writes = collections.defaultdict(list)
 
+	def close(self):
+		''' Sync flushed data that batched durability has not synced yet. '''
+		self._database_manager.sync(durable=True)
+
 	def recover(self, tick):
 		''' Recover downed site. '''
 
@@ -118,24 +193,29 @@ class Site(object):
 
 		self._up_since = tick
 
+	def release_multiversion_clone(self, txid, tick):
+		'''
+		Release a reader on a multiversion clone ahead of commit() or abort().
+		The site may be down.
+		'''
+		self._release_multiversion_clone(txid, tick)
+
 	def _release_multiversion_clone(self, txid, tick):
 		''' Release a reader on a multiversion clone. '''
 
-		if tick not in self._multiversion_clones:
+		if (txid, tick) not in self._multiversion_readers:
 			raise ValueError(('Multiversion clone '
 				'for T{} at time t{} is invalid').format(txid, tick))
 
-		use_count, clone = self._multiversion_clones[tick]
+		version = self._multiversion_readers.pop((txid, tick))
+		use_count, clone = self._multiversion_clones[version]
 		use_count -= 1
 
-		if tick not in self._multiversion_clones:
-			raise ValueError(('Multiversion clone {} '
-				'does not exist').format(tick))
-
 		if use_count is 0:
-			del self._multiversion_clones[tick]
+			del self._multiversion_clones[version]
+			clone.release()
 		else:
-			self._multiversion_clones[tick] = (use_count, clone)
+			self._multiversion_clones[version] = (use_count, clone)
 
 		return use_count
 
@@ -204,12 +284,13 @@ class Site(object):
 
 		# Is this a multiversion clone read? If so, it's "local".
 		if tick is not None:
-			if tick in self._multiversion_clones:
-				value = self._multiversion_clones[tick][1].read(variable)
+			if (txid, tick) in self._multiversion_readers:
+				version = self._multiversion_readers[(txid, tick)]
+				value = self._multiversion_clones[version][1].read(variable)
 				return OperationStatus(True, variable, value, None)
 			else:
-				raise ValueError(('Multiversion clone {} '
-						'does not exist').format(tick))
+				raise ValueError(('Multiversion clone for T{} at time t{} '
+						'does not exist').format(txid, tick))
 
 		# Is this variable available for reading?
 		if variable not in self._owned_variables and \
@@ -287,17 +368,17 @@ class Site(object):
 					False, variable, value,
 					self._lock_manager.get_locks(variable)[0])
 
-	def multiversion_clone(self, tick):
+	def multiversion_clone(self, txid, tick):
 		'''
-		Create site clone at the given tick. The tick will be used as a
-		token to access this clone from try_read().
+		Create site clone for a transaction at the given tick. The txid and
+		tick will be used as a token to access this clone from try_read().
+		Clones of the same commit version are shared.
 
 		All multiversion clones behave as though they are local to the caller.
 		In other words, after their creation the downed status of the site is
-		ignored and all operations will succeed unconditionally. In a real
-		distributed system, such functionality could be implemented
-		transparently by the site connection client, but this is inefficient
-		since all site data must be cloned over the network.
+		ignored and all operations will succeed unconditionally. Clones do not
+		copy site data. Instead, each pins the committed version of the site
+		database so that later commits keep the values it reads.
 
 		Note that commit() or abort() must be called once for each call to
 		multiversion_clone() in order to release the clone.
@@ -308,12 +389,73 @@ class Site(object):
 
 		self._raise_ioerror_if_down()
 
+		if (txid, tick) in self._multiversion_readers:
+			raise ValueError(('Multiversion clone for T{} at time t{} '
+				'already exists').format(txid, tick))
+
 		# Initialize clone or increase use count.
-		if tick not in self._multiversion_clones:
-			self._multiversion_clones[tick] = \
+		version = self.commit_version
+		if version not in self._multiversion_clones:
+			self._multiversion_clones[version] = \
 					(1, self._database_manager.multiversion_clone())
 		else:
-			clone = self._multiversion_clones[tick]
-			self._multiversion_clones[tick] = (clone[0] + 1, clone[1])
+			clone = self._multiversion_clones[version]
+			self._multiversion_clones[version] = (clone[0] + 1, clone[1])
+		self._multiversion_readers[(txid, tick)] = version
 
+	def spill_multiversion_clone(self, txid, tick):
+		'''
+		Spill the multiversion clone read by a transaction to disk. The clone
+		is shared with all of its readers. The site may be down.
+
+		Returns
+		-------
+		spilled : boolean
+			True when the clone was in memory and is now spilled.
+		'''
+
+		if (txid, tick) not in self._multiversion_readers:
+			raise ValueError(('Multiversion clone for T{} at time t{} '
+				'does not exist').format(txid, tick))
+
+		clone = self._multiversion_clones[
+				self._multiversion_readers[(txid, tick)]][1]
+		if clone.spilled is True:
+			return False
+		clone.spill()
+		return True
+
+	def export_multiversion_clones(self):
+		'''
+		Spill all multiversion clones to disk and get the state needed to
+		restore them in a new site with restore_multiversion_clones(), such as
+		after the site process restarts.
+		'''
+
+		for _, clone in self._multiversion_clones.itervalues():
+			clone.spill()
+
+		return dict(
+				version=self.commit_version,
+				clones=dict((version, (use_count, clone.spill_file_path))
+					for version, (use_count, clone)
+					in self._multiversion_clones.iteritems()),
+				readers=dict(self._multiversion_readers))
+
+	def restore_multiversion_clones(self, state):
+		'''
+		Restore multiversion clones exported by export_multiversion_clones().
+		The site must have no clones.
+		'''
 
+		if len(self._multiversion_clones) > 0:
+			raise ValueError('Site {} has multiversion clones'.format(
+				self._index))
+
+		self._database_manager.continue_version(state['version'])
+		self._multiversion_clones = dict(
+				(version, (use_count, self._database_manager.open_spilled_clone(
+					version, spill_file_path)))
+				for version, (use_count, spill_file_path)
+				in state['clones'].iteritems())
+		self._multiversion_readers = dict(state['readers'])
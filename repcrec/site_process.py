@@ -0,0 +1,307 @@
+'''
+A site that runs in its own worker process. The SiteProcess is a proxy with the
+same interface as a Site, and every call is sent to the worker over a pipe, so
+site-local work such as lock table operations and flushes runs on another core.
+
+Failing a SiteProcess kills its worker. The worker first syncs the site data
+and spills the multiversion clones that read-only transactions hold to disk.
+Recovering starts a new worker that recovers the site data from disk and
+reopens the spilled clones, so read-only transactions read exactly what they
+would have read from a site in this process.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec.metrics import Metrics
+from repcrec.site import Site
+
+import multiprocessing
+import os
+
+def _serve(connection, site_args, restore_state, recover_tick):
+	'''
+	Run a site in the worker process and serve calls until the pipe closes.
+
+	Each request is a tuple (name, args) that either calls the site method of
+	that name with args or, when args is None, gets the site attribute of that
+	name. Each reply is a tuple (error, result).
+	'''
+
+	try:
+		site = Site(*site_args)
+		if restore_state is not None:
+			site.restore_multiversion_clones(restore_state)
+		if recover_tick is not None:
+			# A restarted site has lost its locks and must recover.
+			site.fail()
+			site.recover(recover_tick)
+		connection.send((None, None))
+	except Exception as error:
+		connection.send((error, None))
+		return
+
+	while True:
+		try:
+			name, args = connection.recv()
+		except EOFError:
+			return
+
+		try:
+			if args is None:
+				result = getattr(site, name)
+			else:
+				result = getattr(site, name)(*args)
+			connection.send((None, result))
+		except Exception as error:
+			connection.send((error, None))
+
+class SiteProcess(object):
+	''' Proxy for a Site running in a worker process. '''
+
+	def __init__(self, index, variable_defaults, owned_variables, tick, data_path,
+			database_options=None):
+		'''
+		Start the site worker. Parameters are those of Site.
+		'''
+
+		self._index = index
+		self._site_args = (index, variable_defaults, owned_variables, tick,
+				data_path, database_options)
+		self._process = None
+		self._connection = None
+
+		# Site state kept while the worker is down.
+		self._down_dump = None
+		self._down_clones = None
+		self._commit_version = None
+
+		# Counters of workers that have died.
+		self._down_metrics = dict()
+
+		self._start(None, None)
+		self._up_since = tick
+		self._variables = self._get('variables')
+
+	def __repr__(self):
+		return '{{ \'index\': {}, \'pid\': {} }}'.format(
+				self._index, self._process.pid if self._process else None)
+
+	def _start(self, restore_state, recover_tick):
+		''' Start a worker and wait for its site to be ready. '''
+
+		self._connection, worker_connection = multiprocessing.Pipe()
+		self._process = multiprocessing.Process(target=_serve,
+				args=(worker_connection, self._site_args,
+					restore_state, recover_tick))
+		self._process.daemon = True
+		self._process.start()
+		worker_connection.close()
+
+		error, _ = self._connection.recv()
+		if error is not None:
+			self._stop()
+			raise error
+		self._recovery_stats = self._get('recovery_stats')
+
+	def _stop(self):
+		''' Kill the worker. '''
+
+		self._connection.close()
+		self._process.terminate()
+		self._process.join()
+		self._connection, self._process = None, None
+
+	def _call(self, name, *args):
+		''' Call a site method in the worker. '''
+
+		self._connection.send((name, args))
+		error, result = self._connection.recv()
+		if error is not None:
+			raise error
+		return result
+
+	def _get(self, name):
+		''' Get a site attribute from the worker. '''
+
+		self._connection.send((name, None))
+		error, result = self._connection.recv()
+		if error is not None:
+			raise error
+		return result
+
+	def _raise_ioerror_if_down(self):
+		''' Raise IOError() when site is down. '''
+		if self._up_since is None:
+			raise IOError('Site {} is down'.format(self._index))
+
+	@property
+	def index(self):
+		''' The site index. '''
+		return self._index
+
+	@property
+	def pid(self):
+		''' Process id of the worker or None if site is down. '''
+		return self._process.pid if self._process is not None else None
+
+	@property
+	def up_since(self):
+		''' Time when site started or recovered. None if site is down. '''
+		return self._up_since
+
+	@property
+	def recovery_stats(self):
+		''' Statistics for the last recovery of the site database. '''
+		return self._recovery_stats
+
+	@property
+	def commit_version(self):
+		''' Version of the committed site data. Increases on each commit. '''
+		if self._up_since is None:
+			return self._commit_version
+		return self._get('commit_version')
+
+	@property
+	def snapshot_bytes(self):
+		''' Estimated memory in bytes held for multiversion clones. '''
+		return self._get('snapshot_bytes') if self._up_since is not None else 0
+
+	@property
+	def num_locked(self):
+		''' Number of variables locked at the site. '''
+		return self._get('num_locked') if self._up_since is not None else 0
+
+	@property
+	def variables(self):
+		''' Set of variables replicated at the site. '''
+		return self._variables
+
+	def metrics_snapshot(self):
+		'''
+		Snapshot of the site counters including those of workers that have
+		died. See Site.metrics_snapshot().
+		'''
+		if self._up_since is None:
+			return self._down_metrics
+		return Metrics.merge(
+				(self._down_metrics, self._call('metrics_snapshot')))
+
+	def has_variable(self, variable):
+		''' Check whether the site hosts a variable. '''
+		return variable in self._variables
+
+	def has_pending_writes(self, txid):
+		''' Check whether a transaction has writes pending at the site. '''
+		if self._up_since is None:
+			return False
+		return self._call('has_pending_writes', txid)
+
+	def is_up(self):
+		''' Query whether site is up. '''
+		return self._up_since is not None
+
+	def dump(self):
+		''' Dump committed site data. See Site.dump(). '''
+		if self._up_since is None:
+			return self._down_dump
+		return self._call('dump')
+
+	def begin_group_commit(self):
+		''' Begin a group of commits that share a single flush. '''
+		if self._up_since is not None:
+			self._call('begin_group_commit')
+
+	def end_group_commit(self):
+		''' End a group of commits and flush them together. '''
+		if self._up_since is not None:
+			self._call('end_group_commit')
+
+	def fail(self):
+		'''
+		Fail the site and kill its worker. Committed data and multiversion
+		clones are on disk when the worker dies.
+		'''
+
+		self._raise_ioerror_if_down()
+
+		self._call('fail')
+		self._down_metrics = self.metrics_snapshot()
+		self._down_dump = self._call('dump')
+		self._down_clones = self._call('export_multiversion_clones')
+		self._commit_version = self._down_clones['version']
+		self._stop()
+		self._up_since = None
+
+	def recover(self, tick):
+		''' Recover downed site in a new worker. '''
+
+		if self._up_since is not None:
+			raise ValueError('Site is not down to recover()')
+
+		self._start(self._down_clones, tick)
+		self._down_dump, self._down_clones = None, None
+		self._up_since = tick
+
+	def close(self):
+		'''
+		Kill the worker without failing the site once it syncs flushed data.
+		'''
+		if self._process is not None:
+			self._call('close')
+			self._stop()
+
+	def abort(self, txid, tick):
+		''' Abort an open transaction. See Site.abort(). '''
+		self._raise_ioerror_if_down()
+		self._call('abort', txid, tick)
+
+	def commit(self, txid, tick):
+		''' Commit an open transaction. See Site.commit(). '''
+		self._raise_ioerror_if_down()
+		self._call('commit', txid, tick)
+
+	def try_read(self, txid, variable, tick):
+		''' Try to read from this site. See Site.try_read(). '''
+		self._raise_ioerror_if_down()
+		return self._call('try_read', txid, variable, tick)
+
+	def try_write(self, txid, variable, value):
+		''' Try to write to this site. See Site.try_write(). '''
+		self._raise_ioerror_if_down()
+		return self._call('try_write', txid, variable, value)
+
+	def multiversion_clone(self, txid, tick):
+		''' Create site clone. See Site.multiversion_clone(). '''
+		self._raise_ioerror_if_down()
+		self._call('multiversion_clone', txid, tick)
+
+	def release_multiversion_clone(self, txid, tick):
+		''' Release a reader on a multiversion clone. The site may be down. '''
+
+		if self._up_since is not None:
+			self._call('release_multiversion_clone', txid, tick)
+			return
+
+		# Release the spilled clone held for the next worker.
+		readers = self._down_clones['readers']
+		clones = self._down_clones['clones']
+		if (txid, tick) not in readers:
+			raise ValueError(('Multiversion clone '
+				'for T{} at time t{} is invalid').format(txid, tick))
+		version = readers.pop((txid, tick))
+		use_count, spill_file_path = clones[version]
+		if use_count is 1:
+			del clones[version]
+			os.remove(spill_file_path)
+		else:
+			clones[version] = (use_count - 1, spill_file_path)
+
+	def spill_multiversion_clone(self, txid, tick):
+		''' Spill a multiversion clone to disk. The site may be down. '''
+
+		if self._up_since is not None:
+			return self._call('spill_multiversion_clone', txid, tick)
+
+		if (txid, tick) not in self._down_clones['readers']:
+			raise ValueError(('Multiversion clone for T{} at time t{} '
+				'does not exist').format(txid, tick))
+		return False
@@ -0,0 +1,223 @@
+'''
+Database topology: the sites, the variables, where each variable is replicated,
+and the initial value of each variable. A Topology produces the data file map
+accepted by the TransactionManager.
+
+Sites are numbered 1, ..., num_sites and variables are numbered 1, ...,
+num_variables. Every variable is initialized to the value 10i unless given an
+initial value. There are four placement strategies:
+	standard : odd variables at site 1 + (i mod num_sites), even variables at
+	           all sites; this is the RepCRec project topology
+	hash     : replicas at consecutive sites starting from a hash of i
+	range    : replicas at consecutive sites starting from the site that owns
+	           the contiguous range of variables holding i
+	explicit : replicas at the sites listed for each variable
+
+Topologies may be read from a JSON config file such as
+
+	{
+		"sites": 4,
+		"variables": 8,
+		"replication": 2,
+		"placement": "explicit",
+		"replicas": { "1": [1, 2], "2": [3, 4], ... },
+		"values": { "1": 5 }
+	}
+
+where "replicas" is used only for explicit placement.
+
+(c) 2013 Brandon Reiss
+'''
+
+import array
+import json
+
+class Topology(object):
+	''' Placement of variables at sites. '''
+
+	_ALLOWED_PLACEMENTS = range(4)
+	STANDARD, HASH, RANGE, EXPLICIT = _ALLOWED_PLACEMENTS
+
+	_PLACEMENT_NAMES = {
+			STANDARD: 'standard',
+			HASH: 'hash',
+			RANGE: 'range',
+			EXPLICIT: 'explicit',
+			}
+
+	# Multiplier for Knuth's multiplicative hash.
+	_HASH_MULTIPLIER = 2654435761
+
+	def __init__(self, num_sites=10, num_variables=20, replication=1,
+			placement=STANDARD, replicas=None, initial_values=None):
+		'''
+		Initialize the topology.
+
+		Parameters
+		----------
+		num_sites : integer
+			Number of sites.
+		num_variables : integer
+			Number of variables.
+		replication : integer
+			Number of sites holding each variable for hash and range
+			placement.
+		placement : Topology.STANDARD, HASH, RANGE, or EXPLICIT
+			The placement strategy.
+		replicas : dict or None
+			For EXPLICIT placement, dict of each variable to a list of the
+			sites that hold it.
+		initial_values : dict or None
+			Dict of variables to initial values that override the default 10i.
+		'''
+
+		if placement not in self._ALLOWED_PLACEMENTS:
+			raise ValueError(
+					'Placement {} is not recognized'.format(placement))
+		if num_sites < 1 or num_variables < 1:
+			raise ValueError('Topology requires at least one site and variable')
+		if replication < 1 or replication > num_sites:
+			raise ValueError(('Replication {} must be between 1 and the '
+				'number of sites {}').format(replication, num_sites))
+
+		self._num_sites = num_sites
+		self._num_variables = num_variables
+		self._replication = replication
+		self._placement = placement
+		self._initial_values = dict(initial_values or {})
+
+		if placement is self.EXPLICIT:
+			if replicas is None:
+				raise ValueError('Explicit placement requires replicas')
+			self._replicas = dict((variable, sorted(set(sites)))
+					for variable, sites in replicas.iteritems())
+			for variable in self.variables():
+				if len(self._replicas.get(variable, ())) is 0:
+					raise ValueError(
+							'Variable {} has no replicas'.format(variable))
+			for variable, sites in self._replicas.iteritems():
+				if not 1 <= variable <= num_variables:
+					raise ValueError(
+							'Variable {} is not in the topology'.format(variable))
+				if sites[0] < 1 or sites[-1] > num_sites:
+					raise ValueError(('Variable {} has replicas {} not in '
+						'the topology').format(variable, sites))
+		else:
+			self._replicas = None
+
+		for variable in self._initial_values:
+			if not 1 <= variable <= num_variables:
+				raise ValueError(
+						'Variable {} is not in the topology'.format(variable))
+
+	def __repr__(self):
+		return '{} sites, {} variables, {} placement'.format(
+				self._num_sites, self._num_variables,
+				self._PLACEMENT_NAMES[self._placement])
+
+	@classmethod
+	def parse_placement(cls, name):
+		''' Get the placement for a placement name. '''
+
+		for placement, placement_name in cls._PLACEMENT_NAMES.iteritems():
+			if placement_name == name:
+				return placement
+		raise ValueError('Placement {} is not recognized'.format(name))
+
+	@classmethod
+	def from_config(cls, config):
+		'''
+		Create a topology from a config dict with the keys described in the
+		module documentation. Missing keys take their default values.
+		'''
+
+		int_keys = lambda mapping: dict((int(key), value)
+				for key, value in (mapping or {}).iteritems())
+
+		return cls(
+				num_sites=config.get('sites', 10),
+				num_variables=config.get('variables', 20),
+				replication=config.get('replication', 1),
+				placement=cls.parse_placement(
+					config.get('placement', 'standard')),
+				replicas=int_keys(config.get('replicas'))
+					if 'replicas' in config else None,
+				initial_values=int_keys(config.get('values')))
+
+	@classmethod
+	def from_config_file(cls, config_file_path):
+		''' Create a topology from a JSON config file. '''
+
+		with open(config_file_path, 'r') as config_file:
+			return cls.from_config(json.load(config_file))
+
+	@property
+	def num_sites(self):
+		''' Number of sites. '''
+		return self._num_sites
+
+	@property
+	def num_variables(self):
+		''' Number of variables. '''
+		return self._num_variables
+
+	def sites(self):
+		''' Get list of site indices. '''
+		return range(1, self._num_sites + 1)
+
+	def variables(self):
+		''' Get list of variables. '''
+		return range(1, self._num_variables + 1)
+
+	def initial_value(self, variable):
+		''' Get the initial value of a variable. '''
+		return self._initial_values.get(variable, 10 * variable)
+
+	def _ring(self, first):
+		''' Get replication consecutive sites starting from a 0-based site. '''
+		return sorted(1 + ((first + offset) % self._num_sites)
+				for offset in range(self._replication))
+
+	def replicas(self, variable):
+		''' Get sorted list of the sites that hold a variable. '''
+
+		if self._placement is self.STANDARD:
+			if 0 == (variable & 1):
+				return self.sites()
+			else:
+				return [1 + (variable % self._num_sites)]
+
+		elif self._placement is self.HASH:
+			return self._ring(((variable * self._HASH_MULTIPLIER) & 0xffffffff)
+					% self._num_sites)
+
+		elif self._placement is self.RANGE:
+			return self._ring(
+					((variable - 1) * self._num_sites) // self._num_variables)
+
+		else:
+			return self._replicas[variable]
+
+	def columns(self):
+		'''
+		Get the variables and their initial values as a tuple of arrays in
+		increasing order of variable, which is the input to bulk_load().
+		'''
+
+		variables = array.array('l', self.variables())
+		values = array.array('l', (self.initial_value(variable)
+			for variable in variables))
+		return variables, values
+
+	def data_file_map(self):
+		'''
+		Get the data file map for the TransactionManager as a dict of every
+		site index to a dict of its variables and their initial values.
+		'''
+
+		data_file_map = dict((index, dict()) for index in self.sites())
+		for variable in self.variables():
+			value = self.initial_value(variable)
+			for index in self.replicas(variable):
+				data_file_map[index][variable] = value
+		return data_file_map
@@ -0,0 +1,124 @@
+'''
+Trace of transaction and site timelines in the Chrome trace event format, which
+chrome://tracing and Perfetto open.
+
+The trace has a process of transaction tracks, one for each txid, and a process
+of site tracks, one for each site index. Spans are complete events with wall
+clock times in microseconds since the trace started. A span on a transaction
+track that waits on another transaction is joined to the blocking transaction
+track by a flow arrow so that chains of blocked transactions can be followed.
+
+Events are written to the stream as they are traced, one per line, inside a
+JSON array that is closed by close().
+
+(c) 2013 Brandon Reiss
+'''
+
+import json
+import threading
+import time
+
+class Tracer(object):
+	''' Writer of trace events. '''
+
+	_ALLOWED_PROCESSES = range(1, 3)
+	TRANSACTIONS, SITES = _ALLOWED_PROCESSES
+
+	_PROCESS_NAMES = {
+			TRANSACTIONS: 'transactions',
+			SITES: 'sites',
+			}
+
+	_TRACK_FORMATS = {
+			TRANSACTIONS: 'T{}',
+			SITES: 'site {}',
+			}
+
+	def __init__(self, stream):
+		'''
+		Start a trace.
+
+		Parameters
+		----------
+		stream : file
+			Stream to write the trace to. The stream is not closed by close().
+		'''
+
+		self._stream = stream
+		self._origin = time.time()
+		self._lock = threading.Lock()
+		self._tracks = set()
+		self._next_flow = 1
+		self._separator = '[\n'
+		for pid, name in sorted(self._PROCESS_NAMES.iteritems()):
+			self._write(dict(ph='M', pid=pid, tid=0, name='process_name',
+				args=dict(name=name)))
+
+	def _timestamp(self, wall_time):
+		''' Microseconds since the trace started. '''
+		return int(1e6 * (wall_time - self._origin))
+
+	def _write(self, event):
+		''' Write an event. Call with the lock held or from __init__(). '''
+		self._stream.write(self._separator + json.dumps(event, sort_keys=True))
+		self._separator = ',\n'
+
+	def _track(self, pid, tid):
+		''' Name a track the first time it is used. Call with the lock held. '''
+
+		if (pid, tid) not in self._tracks:
+			self._tracks.add((pid, tid))
+			self._write(dict(ph='M', pid=pid, tid=tid, name='thread_name',
+				args=dict(name=self._TRACK_FORMATS[pid].format(tid))))
+			self._write(dict(ph='M', pid=pid, tid=tid,
+				name='thread_sort_index', args=dict(sort_index=tid)))
+
+	def span(self, pid, tid, name, start, end, args=None):
+		'''
+		Trace a span.
+
+		Parameters
+		----------
+		pid : Tracer.TRANSACTIONS or SITES
+			Process of the track.
+		tid : integer
+			Txid or site index of the track.
+		name : string
+			Name of the span such as 'read x2' or 'flush'.
+		start, end : float
+			Wall clock times of the span as returned by time.time().
+		args : dict or None
+			Details shown with the span.
+		'''
+
+		event = dict(ph='X', pid=pid, tid=tid, name=name,
+				ts=self._timestamp(start),
+				dur=max(self._timestamp(end) - self._timestamp(start), 0))
+		if args is not None:
+			event['args'] = args
+		with self._lock:
+			self._track(pid, tid)
+			self._write(event)
+
+	def flow(self, from_txid, to_txid, name, wall_time):
+		'''
+		Trace an arrow from the track of one transaction to that of another
+		at a time, such as from a blocking transaction to one that it blocks.
+		'''
+
+		ts = self._timestamp(wall_time)
+		with self._lock:
+			flow_id, self._next_flow = self._next_flow, self._next_flow + 1
+			self._track(self.TRANSACTIONS, from_txid)
+			self._track(self.TRANSACTIONS, to_txid)
+			self._write(dict(ph='s', pid=self.TRANSACTIONS, tid=from_txid,
+				name=name, cat='flow', id=flow_id, ts=ts))
+			self._write(dict(ph='f', pid=self.TRANSACTIONS, tid=to_txid,
+				name=name, cat='flow', id=flow_id, ts=ts, bp='e'))
+
+	def close(self):
+		''' End the trace. '''
+
+		with self._lock:
+			self._stream.write('\n]\n')
+			self._stream.flush()
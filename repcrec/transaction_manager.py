@@ -7,23 +7,121 @@ keep the database in a consistent state.
 This transaction manager uses wait-die for conflict resolution and the
 available copies algorithm for replication.
 
+Blocked transactions are not polled. Each waits on the variable of its blocked
+command and is retried at the start of the next tick only after some other
+transaction acquires or releases a lock on that variable or after any site
+fails or recovers. Retries run in the order in which transactions blocked.
+
+Reads try the replicas of a variable in the order chosen by a ReadPolicy, which
+also counts the reads served by each site.
+
+Read-only transactions read multiversion clones of the sites that are up when
+they begin. Clones are taken either eagerly when the transaction begins or
+lazily when the transaction first reads a site. A lazy clone is also taken
+just before the site fails or commits new writes, so the transaction reads
+exactly what an eager clone would have read.
+
+Memory held for clones may be limited by a snapshot budget. Once the sites
+together hold more than the budget at the end of a tick, the snapshot policy
+either kills the oldest read-only transactions or spills their clones to disk
+until the sites are back under the budget.
+
+Events are logged to an EventLog that drops events below its level before
+formatting them and writes the events of each tick together.
+
+Runtime counters of the transaction manager and of every site are kept in
+Metrics registries. They are reported by the stats() command and by
+get_stats(). Each transaction records when it began, blocked, and ended, and
+the latencies of ended transactions and their time blocked by each variable
+are kept in Histograms reported by get_latency_stats(). The transactions
+blocking each blocked transaction are kept as well, and the locks() command
+and get_lock_graph() report them as a waits-for graph together with the
+contention of each variable.
+
+When given a Tracer, the transaction manager traces reads, writes, waits,
+commits, and aborts on a track for each transaction and commits, flushes,
+failures, down windows, and snapshots on a track for each site.
+
 (c) 2013 Brandon Reiss
 '''
 from repcrec.site import Site
+from repcrec.site_process import SiteProcess
+from repcrec.lock_manager import LockManager
+from repcrec.read_policy import ReadPolicy
+from repcrec.event_log import EventLog, LazyJoin, TeeLog
+from repcrec.commit_log import CommitLog
+from repcrec.metrics import Metrics, format_snapshot
+from repcrec.histogram import Histogram
+from repcrec.trace import Tracer
+from repcrec.lock_graph import LOCK_GRAPH_FORMATS
 from repcrec.util import delegator
 from repcrec.util import \
 		WaitDie, TxRecord, parse_variable, parse_txid, check_args_len, \
 		cmd_error, format_command
 
+from multiprocessing.pool import ThreadPool
+
+import functools
 import itertools as it
 import StringIO
 import collections
+import os
+import sys
+import time
+
+def _traced_operation(kind):
+	'''
+	Decorate the read or write operation of a TransactionManager to trace a
+	span of each call on the track of the transaction when tracing. Retries
+	of a waiting transaction are covered by the span of the wait instead.
+	'''
+
+	def decorate(operation):
+		''' Decorate the operation. '''
+
+		@functools.wraps(operation)
+		def traced(self, transaction, variable, *args):
+			''' Run and trace the operation. '''
+
+			if self._tracer is None or transaction.waiting is not None:
+				return operation(self, transaction, variable, *args)
+
+			start = time.time()
+			status = operation(self, transaction, variable, *args)
+
+			# Spans end where a wait starts or the transaction ends so that
+			# spans on the track nest.
+			end = time.time()
+			if transaction.waiting is not None:
+				end = transaction.waiting[1]
+			elif transaction.ended_at is not None:
+				end = transaction.ended_at[1]
+			self._tracer.span(Tracer.TRANSACTIONS, transaction.txid,
+					'{} x{}'.format(kind, variable), start, end,
+					dict(blocked=status is False, alive=transaction.alive))
+			return status
+
+		return traced
+
+	return decorate
 
 class TransactionManager(object):
 	''' Database transaction manager. '''
 
 	COMMITTED, ABORTED = range(2)
-	def __init__(self, data_file_map, data_path):
+
+	# Counters that are also reported for the last tick and the peak tick.
+	_TICK_COUNTERS = ('commits', 'aborts', 'wait_die_kills')
+
+	_ALLOWED_SNAPSHOT_POLICIES = range(2)
+	SNAPSHOT_ABORT, SNAPSHOT_SPILL = _ALLOWED_SNAPSHOT_POLICIES
+
+	def __init__(self, data_file_map, data_path, database_options=None,
+			site_database_options=None, lazy_snapshots=False,
+			snapshot_budget=None, snapshot_policy=SNAPSHOT_ABORT,
+			read_policy=None, bulk_loaded=False, startup_workers=None,
+			site_processes=False, fanout_workers=None, event_log=None,
+			commit_log_capacity=4096, tracer=None):
 		'''
 		Initialize the database with sites.
 
@@ -36,22 +134,111 @@ class TransactionManager(object):
 			For instance,
 			    data_file_map={ 1: { 5: 50 } }
 			means that site 1 has variable 5 with default value 50.
+
+			When bulk_loaded is True, data are instead a dict of site indices
+			to an iterable of site variables as returned by bulk_load().
 		data_path : string
 			Path to site data.
+		database_options : dict or None
+			Keyword options passed through to each site DatabaseManager.
+		site_database_options : dict or None
+			Dict of site indices to DatabaseManager keyword options that
+			override database_options for that site.
+		lazy_snapshots : boolean
+			When True, read-only transactions take multiversion clones of
+			sites lazily.
+		snapshot_budget : integer or None
+			Memory in bytes that all sites may hold for multiversion clones.
+		snapshot_policy : TransactionManager.SNAPSHOT_ABORT or SNAPSHOT_SPILL
+			Whether to kill the oldest read-only transactions or spill their
+			clones to disk when the snapshot budget is exceeded.
+		read_policy : ReadPolicy or None
+			Policy choosing the order in which reads try replicas. The
+			default tries replicas in placement order.
+		bulk_loaded : boolean
+			When True, site data files were written by bulk_load() and hold
+			the default values of site variables.
+		startup_workers : integer or None
+			Number of threads that initialize and recover sites concurrently
+			or None to start sites one at a time.
+		site_processes : boolean
+			When True, each site runs in its own worker process behind a
+			SiteProcess proxy, and failing a site kills its worker.
+		fanout_workers : integer or None
+			Number of threads that send replica writes, commits, aborts, and
+			group commit flushes to sites concurrently or None to call sites
+			one at a time.
+		event_log : EventLog or None
+			Log of transaction events. The default logs every event as text
+			to stdout.
+		commit_log_capacity : integer
+			Number of commit and abort log entries kept in memory. Older
+			entries spill to a file under data_path.
+		tracer : Tracer or None
+			Trace of transaction and site timelines or None to not trace.
 		'''
 
+		if snapshot_policy not in self._ALLOWED_SNAPSHOT_POLICIES:
+			raise ValueError('Snapshot policy {} is not recognized'
+					.format(snapshot_policy))
+
 		# Track open transactions, timing, and log commits and aborts.
 		self._open_tx = dict()
 		self._blocked_queue = []
-		self._commit_abort_log = []
+		self._commit_abort_log = CommitLog(
+				os.path.join(data_path, 'commit_abort_log'), commit_log_capacity)
 		self._tick = 0
 
+		# Blocked transactions by the variable that each waits on and the
+		# transactions to retry in the next tick.
+		self._waiting = collections.defaultdict(set)
+		self._waits_on = dict()
+
+		# Ids of the transactions blocking each blocked transaction.
+		self._blockers = dict()
+		self._wakeups = set()
+
+		# Read-only transactions that may still take lazy clones.
+		self._lazy_snapshots = lazy_snapshots
+		self._lazy_ro = dict()
+
+		# Snapshot memory budget and the number of times each policy fired.
+		self._snapshot_budget = snapshot_budget
+		self._snapshot_policy = snapshot_policy
+		self._snapshot_policy_counts = collections.Counter()
+
+		self._read_policy = read_policy \
+				if read_policy is not None else ReadPolicy()
+
+		self._event_log = event_log if event_log is not None else EventLog()
+
+		# Runtime counters, their values when the current tick started and
+		# during the last and peak ticks, and the peak blocked queue length.
+		self._metrics = Metrics()
+		self._tick_start_counts = dict.fromkeys(self._TICK_COUNTERS, 0)
+		self._last_tick_counts = dict.fromkeys(self._TICK_COUNTERS, 0)
+		self._peak_tick_counts = dict.fromkeys(self._TICK_COUNTERS, 0)
+		self._peak_blocked = 0
+
+		# Histograms of microseconds from begin to commit and to abort, of
+		# microseconds that each transaction that blocked spent blocked, and
+		# of those microseconds by the variable waited on.
+		self._latency = dict(commit=Histogram(), abort=Histogram(),
+				blocked=Histogram())
+		self._variable_blocked = collections.defaultdict(Histogram)
+
+		# Trace, the sites that committed in the current tick, and the wall
+		# time at which each downed site failed.
+		self._tracer = tracer
+		self._trace_flush_sites = set()
+		self._trace_down_since = dict()
+
 		# Discover owned variables by first getting map of { var : [sites] }
 		# and then getting map of { site : [owned vars] }.
 		var_to_site = reduce(lambda var_to_site, (index, var_dict):
 				reduce(lambda var_to_site, var:
 					var_to_site[var].append(index) or var_to_site,
-					var_dict.iterkeys(), var_to_site),
+					iter(var_dict), var_to_site),
 				data_file_map.iteritems(), collections.defaultdict(list))
 		site_owned_vars = reduce(lambda site_owned_vars, (var, sites):
 				site_owned_vars if len(sites) > 1 else
@@ -59,55 +246,158 @@ class TransactionManager(object):
 				var_to_site.iteritems(), collections.defaultdict(list))
 
 		# Initialize database sites.
-		make_site = lambda index, data: \
-				Site(index, data,
-						site_owned_vars[index], self._tick, data_path)
-		self._sites = [make_site(index, data)
-			for index, data in data_file_map.iteritems()]
+		site_options = lambda index: dict(database_options or {},
+				**(site_database_options or {}).get(index, {}))
+		def make_site((index, data)):
+			''' Start a site and report any error with its index. '''
+			try:
+				return site_type(index, data if bulk_loaded is False else None,
+						site_owned_vars[index], self._tick,
+						data_path, site_options(index))
+			except (IOError, OSError, ValueError) as error:
+				# Keep the traceback of the original error.
+				raise RuntimeError('Site {} failed to start: {}: {}'.format(
+					index, type(error).__name__, error)), \
+							None, sys.exc_info()[2]
+
+		site_type = SiteProcess if site_processes is True else Site
+
+		# Sites keep the order of data_file_map in either case.
+		if startup_workers is None:
+			self._sites = map(make_site, data_file_map.iteritems())
+		else:
+			pool = ThreadPool(startup_workers)
+			try:
+				self._sites = pool.map(make_site, data_file_map.items())
+			finally:
+				pool.close()
+				pool.join()
+
+		# Placement index of site index to site and variable to replica sites.
+		# Replicas are in site order since both follow data_file_map.
+		self._site_map = dict((site.index, site) for site in self._sites)
+		self._replicas = dict((variable, [self._site_map[index]
+				for index in indices])
+			for variable, indices in var_to_site.iteritems())
+
+		# Pool fanning out calls that go to many sites at once.
+		self._fanout_pool = ThreadPool(fanout_workers) \
+				if fanout_workers is not None else None
 
 		# Get sorted union of variables across all sites.
 		self._variables = sorted(list(set(variable
-				for variable in it.chain(*[data.iterkeys()
+				for variable in it.chain(*[iter(data)
 					for data in data_file_map.itervalues()]))))
 
-	def _log_at_time(self, txid, msg):
-		''' Log a message with timestamp for the given txid. '''
+	def _fan_out(self, func, sites):
+		'''
+		Apply func to each site and return the results in site order. With a
+		fan-out pool the calls run concurrently with at most one call per
+		site. Every call finishes before the first error in site order is
+		raised, so the outcome does not depend on thread scheduling.
+		'''
+
+		def call(site):
+			''' Call func and capture its result or error. '''
+			try:
+				return None, func(site)
+			except Exception as error:
+				return error, None
 
-		if txid is not None:
-			print '{:<4s} {:>4s} : {}'.format(
-					't{},'.format(self._tick),
-					'T{}'.format(txid), msg)
+		sites = list(sites)
+		if self._fanout_pool is None or len(sites) < 2:
+			outcomes = map(call, sites)
 		else:
-			print '{:<4s} {:>4s} : {}'.format(
-					't{},'.format(self._tick),
-					'--', msg)
+			outcomes = self._fanout_pool.map(call, sites)
+
+		for error, _ in outcomes:
+			if error is not None:
+				raise error
+		return [result for _, result in outcomes]
+
+	def _log(self, level, event, txid, msg_format, *args):
+		''' Log an event at the current time. See EventLog.log(). '''
+		self._event_log.log(level, self._tick, txid, event, msg_format, *args)
 
 	def _fail_if_blocked(self, cmd, args, transaction):
-		''' Check that transaction is not blocked. '''
+		''' Reject a command for a transaction that is blocked. '''
 
 		if transaction in self._blocked_queue:
 			(blk_cmd, blk_args), _ = transaction.blocked()
-			raise RuntimeError(('Transaction {} '
-				'is blocked by {} but received command {}').format(
-					transaction.txid,
-					format_command(blk_cmd, blk_args),
-					format_command(cmd, args)))
+			raise ValueError(cmd_error(cmd, args,
+				'T{} is blocked by {}'.format(transaction.txid,
+					format_command(blk_cmd, blk_args))))
 
-	def _block(self, cmd, args, transaction, runner):
-		''' Block the given transaction and add it to the queue. '''
+	def _block(self, cmd, args, transaction, runner, variable):
+		'''
+		Block the given transaction waiting on a variable and add it to the
+		queue.
+		'''
 
 		transaction.block(cmd, args, runner)
 		if transaction not in self._blocked_queue:
 			self._blocked_queue.append(transaction)
+			self._waiting[variable].add(transaction)
+			self._waits_on[transaction] = variable
+			self._metrics.incr('blocks')
+			self._metrics.incr_key('blocks_by_variable', variable)
+			self._peak_blocked = max(
+					self._peak_blocked, len(self._blocked_queue))
+
+	def _unwait(self, transaction):
+		''' Remove a transaction that is no longer blocked from the wait index. '''
+
+		if transaction not in self._waits_on:
+			return
+
+		variable = self._waits_on.pop(transaction)
+		del self._blockers[transaction]
+		waiters = self._waiting[variable]
+		waiters.discard(transaction)
+		if len(waiters) is 0:
+			del self._waiting[variable]
+		self._wakeups.discard(transaction)
+
+	def _wake(self, variable, transaction):
+		'''
+		Retry transactions other than the given one that wait on a variable
+		in the next tick.
+		'''
+
+		if variable in self._waiting:
+			self._wakeups.update(waiter for waiter in self._waiting[variable]
+					if waiter is not transaction)
+
+	def _wake_all(self):
+		''' Retry all blocked transactions in the next tick. '''
+		self._wakeups.update(self._blocked_queue)
 
 	@staticmethod
 	def _wait_die_reason(variable, wait_die, transaction):
-		''' Assemble wait-die reason string. '''
-		return ('killing by wait-die reading x{}; '
-				'(T{}, t{}) < (T{}, t{})').format(
-						variable,
-						wait_die.blocked_by, wait_die.blocked_by_age,
-						transaction.txid, transaction.start_time)
+		''' Assemble wait-die reason as a tuple of (format, args). '''
+		return ('killing by wait-die reading x{}; (T{}, t{}) < (T{}, t{})',
+				(variable, wait_die.blocked_by, wait_die.blocked_by_age,
+					transaction.txid, transaction.start_time))
+
+	def _record_latency(self, transaction, committed):
+		'''
+		Record the latency and blocked time of an ended transaction.
+		Latencies over which the wall clock stepped back count as zero.
+		'''
+
+		(_, began), (_, ended) = transaction.began_at, transaction.ended_at
+		self._latency['commit' if committed is True else 'abort'].record(
+				1e6 * max(0., ended - began))
+
+		variable_seconds = collections.defaultdict(float)
+		for (_, variable), seconds in \
+				transaction.blocked_seconds.iteritems():
+			variable_seconds[variable] += seconds
+		for variable, seconds in variable_seconds.iteritems():
+			self._variable_blocked[variable].record(1e6 * seconds)
+		if transaction.first_blocked_at is not None:
+			self._latency['blocked'].record(
+					1e6 * sum(variable_seconds.values()))
 
 	def _begin(self, cmd, args, is_ro=False):
 		'''
@@ -130,17 +420,137 @@ class TransactionManager(object):
 		if is_ro is False:
 			self._open_tx[txid] = TxRecord(
 					txid, self._tick, self._sites, None)
-			self._log_at_time(txid, 'started')
+			self._log(EventLog.INFO, 'begin', txid, 'started')
 
 		else:
-			# Clone all running sites for read-only transactions.
+			# Read-only transactions may use all running sites.
 			sites = [site for site in self._sites if site.is_up()]
-			for site in sites:
-				site.multiversion_clone(self._tick)
+			transaction = TxRecord(txid, self._tick, sites, self._tick)
+			if self._lazy_snapshots is True:
+				self._lazy_ro[txid] = transaction
+			else:
+				for site in sites:
+					self._take_snapshot(transaction, site)
 			# Add this transaction.
-			self._open_tx[txid] = TxRecord(
-					txid, self._tick, sites, self._tick)
-			self._log_at_time(txid, 'started (read-only)')
+			self._open_tx[txid] = transaction
+			self._log(EventLog.INFO, 'begin', txid, 'started (read-only)')
+
+	def _take_snapshot(self, transaction, site):
+		''' Take a multiversion clone of a site for a transaction. '''
+		self._traced_site_call(lambda site: site.multiversion_clone(
+			transaction.txid, transaction.start_time),
+			'snapshot', transaction.txid)(site)
+		transaction.mark_snapshot(site.index)
+		self._metrics.incr('snapshots_taken')
+
+	def _traced_site_call(self, call, name, txid=None):
+		'''
+		Wrap call(site) to trace a span of each call on the track of the site
+		when tracing.
+		'''
+
+		if self._tracer is None:
+			return call
+
+		def traced(site):
+			''' Run and trace the call. '''
+			start = time.time()
+			result = call(site)
+			self._tracer.span(Tracer.SITES, site.index, name, start,
+					time.time(), dict(txid=txid) if txid is not None else None)
+			return result
+
+		return traced
+
+	def _end_group_commit(self, site):
+		''' End the group commit of a site and trace it when it flushes. '''
+		if site.index in self._trace_flush_sites:
+			self._traced_site_call(
+					lambda site: site.end_group_commit(), 'flush')(site)
+		else:
+			site.end_group_commit()
+
+	def _trace_waits(self, transaction, waits):
+		'''
+		Trace waits of a transaction on its track with an arrow from the
+		track of each blocking transaction.
+		'''
+
+		for blocker, variable, start, end in waits:
+			self._tracer.span(Tracer.TRANSACTIONS, transaction.txid,
+					'blocked on x{}'.format(variable), start, end,
+					dict(blocked_by=blocker))
+			if blocker is not None:
+				self._tracer.flow(blocker, transaction.txid, 'blocks', start)
+
+	def _take_lazy_snapshots(self, site):
+		'''
+		Take clones of a site for read-only transactions that have not taken
+		one yet. Call before the site fails or its data change.
+		'''
+
+		for transaction in self._lazy_ro.itervalues():
+			if transaction.has_site(site.index) and \
+					not transaction.has_snapshot(site.index):
+				self._take_snapshot(transaction, site)
+
+	def _snapshot_bytes(self):
+		''' Memory in bytes held for multiversion clones by all sites. '''
+		return sum(site.snapshot_bytes for site in self._sites)
+
+	def _enforce_snapshot_budget(self):
+		'''
+		Apply the snapshot policy to read-only transactions from oldest to
+		newest until the sites hold no more than the snapshot budget.
+		'''
+
+		if self._snapshot_budget is None or \
+				self._snapshot_bytes() <= self._snapshot_budget:
+			return
+
+		oldest_ro = sorted(
+				(transaction for transaction in self._open_tx.itervalues()
+					if transaction.is_read_only),
+				key=lambda transaction:
+					(transaction.start_time, transaction.txid))
+
+		for transaction in oldest_ro:
+			snapshot_bytes = self._snapshot_bytes()
+			if snapshot_bytes <= self._snapshot_budget:
+				break
+
+			snapshot_sites = [site for site in transaction.sites
+					if transaction.has_snapshot(site.index)]
+			if len(snapshot_sites) is 0:
+				continue
+
+			reason = 'snapshot memory {} bytes exceeds budget {}'.format(
+					snapshot_bytes, self._snapshot_budget)
+
+			# A killed transaction releases its clones now and aborts when it
+			# ends. Its reads until then are ignored.
+			if self._snapshot_policy is self.SNAPSHOT_ABORT:
+				self._snapshot_policy_counts['aborts'] += 1
+				self._log(EventLog.WARNING, 'kill', transaction.txid,
+						'killing; {}', reason)
+				transaction.die()
+				self._lazy_ro.pop(transaction.txid, None)
+				if transaction.blocked():
+					self._wakeups.add(transaction)
+				for site in snapshot_sites:
+					site.release_multiversion_clone(
+							transaction.txid, transaction.start_time)
+					transaction.clear_snapshot(site.index)
+
+			else:
+				spilled = [site.index for site in snapshot_sites
+						if site.spill_multiversion_clone(
+							transaction.txid, transaction.start_time)]
+				if len(spilled) > 0:
+					self._snapshot_policy_counts['spills'] += 1
+					self._log(EventLog.INFO, 'spill', transaction.txid,
+							'spilled clones of sites {{{}}}; {}',
+							LazyJoin(spilled), reason)
 
 	def _beginro(self, cmd, args):
 		'''
@@ -170,12 +580,17 @@ class TransactionManager(object):
 		then the command has abort semantics.
 		'''
 
+		transaction.stop_waiting()
+		started = time.time() if self._tracer is not None else None
 		del self._open_tx[transaction.txid]
+		self._lazy_ro.pop(transaction.txid, None)
 
-		# Actions for commit and abort.
-		ro_token = transaction.start_time if transaction.is_read_only else None
-		abort = lambda site: site.abort(transaction.txid, ro_token)
-		commit = lambda site: site.commit(transaction.txid, ro_token)
+		# Actions for commit and abort. Read-only transactions release only
+		# the clones that they took.
+		ro_token = lambda site: transaction.start_time \
+				if transaction.has_snapshot(site.index) else None
+		abort = lambda site: site.abort(transaction.txid, ro_token(site))
+		commit = lambda site: site.commit(transaction.txid, ro_token(site))
 
 		# Only alive transactions can commit.
 		if transaction.alive is True and not transaction.blocked():
@@ -196,17 +611,17 @@ class TransactionManager(object):
 					# Abort if the site is down since it can only come up and
 					# cause an abort.
 					if site.is_up() is not True:
-						self._log_at_time(transaction.txid,
-								('aborting; accessed site {} '
-									'is down').format(site.index))
+						self._log(EventLog.WARNING, 'abort', transaction.txid,
+								'aborting; accessed site {} is down',
+								site.index)
 						action = abort
 						break
 
 					# Abort if any site went down since the first access.
 					if site.up_since > accessed_at_tick:
-						self._log_at_time(transaction.txid,
-								('aborting; site {} went down '
-									'after first access').format(site.index))
+						self._log(EventLog.WARNING, 'abort', transaction.txid,
+								'aborting; site {} went down after first access',
+								site.index)
 						action = abort
 						break
 
@@ -214,23 +629,62 @@ class TransactionManager(object):
 			# Remove blocked transactions from the queue.
 			if transaction.blocked():
 				self._blocked_queue.remove(transaction)
-				self._log_at_time(transaction.txid,
+				self._unwait(transaction)
+				self._log(EventLog.WARNING, 'abort', transaction.txid,
 						'aborting; sending end() when blocked has '
 						'abort semantics')
 			action = abort
 
-		# Apply action to all running sites.
-		for site in it.ifilter(lambda site: site.is_up(), transaction.sites):
-			action(site)
+		# Apply action to all running sites. Sites about to commit writes
+		# must first give lazy read-only transactions their clones.
+		running = filter(lambda site: site.is_up(), transaction.sites)
+		if action is commit:
+			for site in running:
+				if site.has_pending_writes(transaction.txid):
+					self._take_lazy_snapshots(site)
+			if self._tracer is not None:
+				self._trace_flush_sites.update(site.index for site in running)
+		self._fan_out(self._traced_site_call(action,
+			'commit' if action is commit else 'abort', transaction.txid),
+			running)
+
+		# Downed sites get no commit or abort, but they must still release
+		# the clones so that their versions are no longer pinned.
+		for site in transaction.sites:
+			if not site.is_up() and transaction.has_snapshot(site.index):
+				site.release_multiversion_clone(
+						transaction.txid, transaction.start_time)
+				transaction.clear_snapshot(site.index)
 
-		self._log_at_time(transaction.txid,
-				'committed' if action is commit else 'aborted')
+		if action is commit:
+			self._metrics.incr('commits')
+			self._log(EventLog.INFO, 'commit', transaction.txid, 'committed')
+		else:
+			self._metrics.incr('aborts')
+			self._log(EventLog.WARNING, 'abort', transaction.txid, 'aborted')
 
-		self._commit_abort_log.append((
+		self._commit_abort_log.append(
 			transaction.txid,
 			transaction.start_time,
 			self.COMMITTED if action is commit else self.ABORTED
-			))
+			)
+		transaction.mark_ended(self._tick)
+		self._record_latency(transaction, action is commit)
+
+		if self._tracer is not None:
+			(_, began), (_, ended) = transaction.began_at, transaction.ended_at
+			outcome = 'commit' if action is commit else 'abort'
+			self._trace_waits(transaction, transaction.waits)
+			self._tracer.span(Tracer.TRANSACTIONS, transaction.txid, outcome,
+					started, ended)
+			self._tracer.span(Tracer.TRANSACTIONS, transaction.txid,
+					'T{}'.format(transaction.txid), began, ended,
+					dict(read_only=transaction.is_read_only, outcome=outcome,
+						start_tick=transaction.start_time, end_tick=self._tick))
+
+		# Locks held by the transaction are released.
+		for variable in transaction.locked_variables:
+			self._wake(variable, transaction)
 
 		return True
 
@@ -248,14 +702,20 @@ class TransactionManager(object):
 		self._fail_if_blocked(cmd, args, transaction)
 
 		variable = parse_variable(cmd, args, 1)
-		if variable not in self._variables:
+		if variable not in self._replicas:
 			raise ValueError(cmd_error(cmd, args,
 				'Variable {} is not in the database'.format(variable)))
 
 		if self._read(transaction, variable) is not True:
 			self._block(cmd, args, transaction,
-				self._runner(self._read, (transaction, variable)))
+				self._runner(self._read, (transaction, variable)), variable)
+
+	def _replicas_for(self, transaction, variable):
+		''' Get the replica sites of a variable available to a transaction. '''
+		return [site for site in self._replicas[variable]
+				if transaction.has_site(site.index)]
 
+	@_traced_operation('read')
 	def _read(self, transaction, variable):
 		'''
 		Read a variable for a transaction from any available site. Uses the
@@ -270,30 +730,44 @@ class TransactionManager(object):
 
 		# See if the transaction is not alive.
 		if transaction.alive is False:
-			self._log_at_time(transaction.txid,
-					'ignoring read x{}'.format(variable))
+			self._log(EventLog.INFO, 'read', transaction.txid,
+					'ignoring read x{}', variable)
 			return True
 
 		# Locate an eligible site to read.
 		ro_token = transaction.start_time if transaction.is_read_only else None
 		wait_die = WaitDie(self._open_tx, transaction.start_time)
 		blocked, num_down = False, 0
-		for site in transaction.sites:
+		for site in self._read_policy.order(
+				variable, self._replicas_for(transaction, variable)):
 			try:
+				# Take a lazy clone on the first read from a site.
+				if transaction.is_read_only and \
+						not transaction.has_snapshot(site.index):
+					self._take_snapshot(transaction, site)
+
 				read_status = site.try_read(
 						transaction.txid, variable, ro_token)
 
-				# Ignore sites that don't manage the variable.
+				# Ignore sites where the variable is not available.
 				if read_status is None:
 					continue
 
 				elif read_status.success is True:
 					transaction.mark_site_accessed(site.index, self._tick)
-					msg = 'read x{} -> {} from site {}'.format(
-							variable, read_status.value, site.index)
+					self._read_policy.record_read(site)
+					if not transaction.is_read_only and transaction.mark_locked(
+							site.index, variable, LockManager.R_LOCK):
+						self._wake(variable, transaction)
 					if transaction.is_read_only:
-						msg += ' multiversion clone at t{}'.format(ro_token)
-					self._log_at_time(transaction.txid, msg)
+						self._log(EventLog.INFO, 'read', transaction.txid,
+								'read x{} -> {} from site {} '
+								'multiversion clone at t{}', variable,
+								read_status.value, site.index, ro_token)
+					else:
+						self._log(EventLog.INFO, 'read', transaction.txid,
+								'read x{} -> {} from site {}', variable,
+								read_status.value, site.index)
 					return True
 
 				else:
@@ -312,32 +786,39 @@ class TransactionManager(object):
 			# See if we should block or die.
 			if wait_die.should_die():
 				should_die = True
+				self._metrics.incr('wait_die_kills')
+				self._metrics.incr_key('wait_die_kills_by_variable', variable)
 				reason = self._wait_die_reason(variable, wait_die, transaction)
 			else:
 				status = False
-				reason = 'blocked by T{} reading x{}'.format(
-						wait_die.blocked_by, variable)
+				transaction.mark_waiting(
+						wait_die.blocked_by, variable, self._tick)
+				self._blockers[transaction] = wait_die.blockers
+				reason = ('blocked by T{} reading x{}',
+						(wait_die.blocked_by, variable))
 
 		# See if we have any downed sites. We can't reject an operation unless
 		# we have tried all available sites.
 		elif num_down > 0:
 			status = False
-			reason = 'waiting to read x{}; no available sites'.format(variable)
+			transaction.mark_waiting(None, variable, self._tick)
+			self._blockers[transaction] = frozenset()
+			reason = ('waiting to read x{}; no available sites', (variable,))
 
 		# We read every site and the variable is not here.
 		else:
 			should_die = True
-			site_indices = '{{{}}}'.format(
-					', '.join(str(site.index) for site in transaction.sites))
-			reason = 'killing; variable x{} not available on sites {}'.format(
-					variable, site_indices)
+			reason = ('killing; variable x{} not available on sites {{{}}}',
+					(variable, LazyJoin(site.index
+						for site in transaction.sites)))
 
 		# Either we have (status, reason) or (should_die, reason).
 		assert ((status is None) ^ (should_die is None)) \
 				and reason is not None, 'Invalid status, should_die, reason'
 
 		# Perform final steps for read.
-		self._log_at_time(transaction.txid, reason)
+		self._log(EventLog.WARNING if should_die is True else EventLog.INFO,
+				'read', transaction.txid, reason[0], *reason[1])
 		if should_die is True:
 			transaction.die()
 			self._end(transaction)
@@ -359,7 +840,7 @@ class TransactionManager(object):
 		self._fail_if_blocked(cmd, args, transaction)
 
 		variable = parse_variable(cmd, args, 1)
-		if variable not in self._variables:
+		if variable not in self._replicas:
 			raise ValueError(cmd_error(cmd, args,
 				'Variable {} is not in the database'.format(txid)))
 
@@ -367,8 +848,10 @@ class TransactionManager(object):
 
 		if self._write(transaction, variable, value) is not True:
 			self._block(cmd, args, transaction,
-					self._runner(self._write, (transaction, variable, value)))
+					self._runner(self._write, (transaction, variable, value)),
+					variable)
 
+	@_traced_operation('write')
 	def _write(self, transaction, variable, value):
 		'''
 		Write a variable for a transaction to all available sites. Uses the
@@ -380,35 +863,42 @@ class TransactionManager(object):
 
 		# See if the transaction is not alive.
 		if transaction.alive is False:
-			self._log_at_time(transaction.txid,
-					'ignoring write (x{}, {})'.format(variable, value))
+			self._log(EventLog.INFO, 'write', transaction.txid,
+					'ignoring write (x{}, {})', variable, value)
 			return True
 
-		wait_die = WaitDie(self._open_tx, transaction.start_time)
-		sites_written = set()
-		blocked = False
-		for site in transaction.sites:
+		# Try all replicas and then apply the results in replica order.
+		def try_write(site):
+			''' Try to write a replica or return None if the site is down. '''
 			try:
-				write_status = site.try_write(transaction.txid, variable, value)
+				return site.try_write(transaction.txid, variable, value)
+			except IOError:
+				# We don't need to track downed sites since we care only about
+				# writing at least one copy.
+				return None
 
-				# Ignore sites that don't manage the variable.
-				if write_status is None:
-					continue
+		replicas = self._replicas_for(transaction, variable)
+		write_statuses = self._fan_out(try_write, replicas)
 
-				elif write_status.success is True:
-					transaction.mark_site_accessed(site.index, self._tick)
-					sites_written.add(site.index)
+		wait_die = WaitDie(self._open_tx, transaction.start_time)
+		sites_written = set()
+		blocked = False
+		for site, write_status in it.izip(replicas, write_statuses):
+			if write_status is None:
+				continue
 
-				else:
-					# The writes that succeeded so far will be retried later, but
-					# this transaction holds the lock so it does not matter.
-					blocked = True
-					wait_die.append_blockers(write_status.waits_for)
+			if write_status.success is True:
+				transaction.mark_site_accessed(site.index, self._tick)
+				sites_written.add(site.index)
+				if transaction.mark_locked(
+						site.index, variable, LockManager.RW_LOCK):
+					self._wake(variable, transaction)
 
-			except IOError:
-				# We don't need to track downed sites since we care only about
-				# writing at least one copy.
-				pass
+			else:
+				# The writes that succeeded will be retried later, but this
+				# transaction holds the lock so it does not matter.
+				blocked = True
+				wait_die.append_blockers(write_status.waits_for)
 
 		# Either we wrote no sites, some sites, or all available sites.
 		status, should_die, reason = None, None, None
@@ -417,31 +907,38 @@ class TransactionManager(object):
 		if blocked is True:
 			if wait_die.should_die():
 				should_die = True
+				self._metrics.incr('wait_die_kills')
+				self._metrics.incr_key('wait_die_kills_by_variable', variable)
 				reason = self._wait_die_reason(variable, wait_die, transaction)
 			else:
 				status = False
-				reason = 'blocked by T{} writing x{}'.format(
-						wait_die.blocked_by, variable)
+				transaction.mark_waiting(
+						wait_die.blocked_by, variable, self._tick)
+				self._blockers[transaction] = wait_die.blockers
+				reason = ('blocked by T{} writing x{}',
+						(wait_die.blocked_by, variable))
 
 		# Here we don't need to block so long as we wrote at least 1 site.
 		elif len(sites_written) > 0:
 			status = True
-			reason = 'write x{} <- {} to sites {{{}}}'.format(
-						variable, value,
-						', '.join(it.imap(str, sites_written)))
+			reason = ('write x{} <- {} to sites {{{}}}',
+					(variable, value, LazyJoin(sites_written)))
 
 		# Here we wrote 0 sites, so we need to wait.
 		else:
 			status = False
-			reason = 'waiting to write (x{}, {}); no available sites'.format(
-						variable, value)
+			transaction.mark_waiting(None, variable, self._tick)
+			self._blockers[transaction] = frozenset()
+			reason = ('waiting to write (x{}, {}); no available sites',
+					(variable, value))
 
 		# Either we have (status, reason) or (should_die, reason).
 		assert ((status is None) ^ (should_die is None)) \
 				and reason is not None, 'Invalid status, should_die, reason'
 
 		# Perform final steps.
-		self._log_at_time(transaction.txid, reason)
+		self._log(EventLog.WARNING if should_die is True else EventLog.INFO,
+				'write', transaction.txid, reason[0], *reason[1])
 		if should_die is True:
 			transaction.die()
 			self._end(transaction)
@@ -457,23 +954,30 @@ class TransactionManager(object):
 
 		check_args_len(cmd, args, 1)
 
-		# Find the site. Will return early.
 		index = int(args[0])
-		for site in self._sites:
-			if site.index is index:
-				action(site)
-				return True
+		if index not in self._site_map:
+			raise ValueError(cmd_error(cmd, args,
+				'Site {} does not exist'.format(index)))
 
-		raise ValueError(cmd_error(cmd, args,
-			'Site {} does not exist'.format(index)))
+		action(self._site_map[index])
+		return True
 
 	def _fail(self, cmd, args):
 		''' Fail site. '''
 
 		def action(site):
 			''' Apply site action. '''
-			site.fail()
-			self._log_at_time(None, 'site {} is down'.format(site.index))
+			self._take_lazy_snapshots(site)
+			self._traced_site_call(lambda site: site.fail(), 'fail')(site)
+			if self._tracer is not None:
+				self._trace_down_since[site.index] = time.time()
+
+			# Locks at the site are lost.
+			for transaction in self._open_tx.itervalues():
+				transaction.clear_locks(site.index)
+			self._wake_all()
+			self._log(EventLog.WARNING, 'fail', None,
+					'site {} is down', site.index)
 
 		self._find_site_apply_action(cmd, args, action)
 
@@ -482,8 +986,14 @@ class TransactionManager(object):
 
 		def action(site):
 			''' Apply site action. '''
-			site.recover(self._tick)
-			self._log_at_time(None, 'site {} is up'.format(site.index))
+			self._traced_site_call(
+					lambda site: site.recover(self._tick), 'recover')(site)
+			if site.index in self._trace_down_since:
+				self._tracer.span(Tracer.SITES, site.index, 'down',
+						self._trace_down_since.pop(site.index), time.time())
+			self._wake_all()
+			self._log(EventLog.INFO, 'recover', None,
+					'site {} is up', site.index)
 
 		self._find_site_apply_action(cmd, args, action)
 
@@ -491,8 +1001,8 @@ class TransactionManager(object):
 		''' Dump database state. '''
 
 		if len(args) is 0:
-			self._log_at_time(None, 'dumping all sites')
-			print self.to_string(None)
+			self._log(EventLog.INFO, 'dump', None, 'dumping all sites')
+			self._log_dump(None, False)
 
 		elif len(args) is 1:
 			check_args_len(cmd, args, 1)
@@ -506,18 +1016,52 @@ class TransactionManager(object):
 			try:
 				if args[0][0] == 'x':
 					partition = int(args[0][1:])
-					self._log_at_time(None,
-							'dumping variable x{}'.format(partition))
+					self._log(EventLog.INFO, 'dump', None,
+							'dumping variable x{}', partition)
 				else:
 					is_site = True
 					partition = int(args[0])
-					self._log_at_time(None,
-							'dumping site S{}'.format(partition))
+					self._log(EventLog.INFO, 'dump', None,
+							'dumping site S{}', partition)
 			except ValueError:
 				raise ValueError(cmd_error(cmd, args,
 					'Argument must match either [0-9]+ or x[0-9]+'))
 
-			print self.to_string(partition, is_site)
+			self._log_dump(partition, is_site)
+
+	def _log_dump(self, partition, is_site):
+		''' Log a dump. Dumps are formatted only when logged. '''
+		if self._event_log.enabled(EventLog.INFO):
+			self._event_log.log_text(EventLog.INFO, self._tick, 'dump',
+					self.to_string(partition, is_site))
+
+	def _locks(self, cmd, args):
+		'''
+		Log the waits-for graph and contention of variables as text or, given
+		a format argument, as dot or json.
+		'''
+
+		if len(args) > 1:
+			check_args_len(cmd, args, 1)
+		name = args[0].lower() if len(args) is 1 else 'text'
+		if name not in LOCK_GRAPH_FORMATS:
+			raise ValueError(cmd_error(cmd, args,
+				'Format must be one of {}'.format(
+					', '.join(sorted(LOCK_GRAPH_FORMATS)))))
+
+		self._log(EventLog.INFO, 'locks', None, 'reporting locks')
+		if self._event_log.enabled(EventLog.INFO):
+			self._event_log.log_text(EventLog.INFO, self._tick, 'locks',
+					LOCK_GRAPH_FORMATS[name](self.get_lock_graph()))
+
+	def _stats(self, cmd, args):
+		''' Log runtime counters. '''
+
+		check_args_len(cmd, args, 0)
+		self._log(EventLog.INFO, 'stats', None, 'reporting stats')
+		if self._event_log.enabled(EventLog.INFO):
+			self._event_log.log_text(EventLog.INFO, self._tick, 'stats',
+					format_snapshot(self.get_stats()))
 
 	@staticmethod
 	def _run_pending(transaction):
@@ -555,44 +1099,283 @@ class TransactionManager(object):
 			'fail': delegator('_fail'),
 			'recover': delegator('_recover'),
 			'dump': delegator('_dump'),
+			'stats': delegator('_stats'),
+			'locks': delegator('_locks'),
 			}
 
-	def send_commands(self, commands):
-		''' Advance tick and execute commands. '''
+	def send_commands(self, commands, on_command=None):
+		'''
+		Advance tick and execute commands. All commits made during the tick
+		share a single group commit at each site, and the event log is
+		flushed once the tick ends.
 
-		self._tick += 1
+		Parameters
+		----------
+		commands : list of commands
+			List of tuples of the form (command, (args, ...)).
+		on_command : callable or None
+			Called as on_command(index, error) after each command runs, where
+			error is the ValueError that rejected the command or None. It is
+			first called as on_command(None, None) once blocked transactions
+			have been retried. When given, a rejected command does not stop
+			the rest of the tick.
+		'''
 
-		self._log_at_time(None, 'sending commands {}'.format(commands))
+		self._tick += 1
 
-		# Try to run all blocked transactions.
-		for transaction in self._blocked_queue:
-			if transaction.blocked() is not None:
+		self._log(EventLog.DEBUG, 'tick', None, 'sending commands {}', commands)
+
+		self._fan_out(lambda site: site.begin_group_commit(), self._sites)
+		try:
+			self._send_commands(commands, on_command)
+		finally:
+			self._fan_out(self._end_group_commit, self._sites)
+			self._trace_flush_sites.clear()
+			self._event_log.flush()
+			self._count_tick()
+
+	def _count_tick(self):
+		''' Record the tick counters of the tick that just ended. '''
+
+		for name in self._TICK_COUNTERS:
+			count = self._metrics.get(name)
+			self._last_tick_counts[name] = count - self._tick_start_counts[name]
+			self._peak_tick_counts[name] = max(self._peak_tick_counts[name],
+					self._last_tick_counts[name])
+			self._tick_start_counts[name] = count
+
+	def _send_commands(self, commands, on_command):
+		''' Execute commands for the current tick. '''
+
+		# Retry blocked transactions that were woken. Retries may wake
+		# transactions later in the queue.
+		for transaction in list(self._blocked_queue):
+			if transaction in self._wakeups and \
+					transaction.blocked() is not None:
+				self._wakeups.discard(transaction)
 				_, runner = transaction.blocked()
 				if runner() is True:
-					transaction.unblock()
+					transaction.unblock(self._tick)
+					self._unwait(transaction)
 
 		# Remove transactions no longer blocked.
 		self._blocked_queue = [
 				tx for tx in self._blocked_queue if tx.blocked() is not None]
 
-		for cmd, args in commands:
-			cmd_lower = cmd.lower()
+		if on_command is not None:
+			self._event_log.flush()
+			on_command(None, None)
 
-			# Send commands to their delegates using function callbacks.
-			if cmd_lower in self._COMMAND_DELEGATORS:
-				self._COMMAND_DELEGATORS[cmd_lower](self, cmd, args)
+		for index, (cmd, args) in enumerate(commands):
+			try:
+				self._send_command(cmd, args)
+			except ValueError as error:
+				if on_command is None:
+					raise
+				self._event_log.flush()
+				on_command(index, error)
 			else:
-				raise ValueError('Command {} is not recognized'
-					.format(format_command(cmd, args)))
+				if on_command is not None:
+					self._event_log.flush()
+					on_command(index, None)
+
+		self._enforce_snapshot_budget()
+
+	def _send_command(self, cmd, args):
+		''' Execute a single command. '''
+
+		# Send commands to their delegates using function callbacks.
+		cmd_lower = cmd.lower()
+		if cmd_lower in self._COMMAND_DELEGATORS:
+			self._COMMAND_DELEGATORS[cmd_lower](self, cmd, args)
+		else:
+			raise ValueError('Command {} is not recognized'
+				.format(format_command(cmd, args)))
+
+	def close(self):
+		'''
+		Close all sites. The database may not be used after. Waits of open
+		transactions and sites that are still down are traced up to now.
+		'''
+
+		if self._tracer is not None:
+			now = time.time()
+			for transaction in self._open_tx.itervalues():
+				waits = list(transaction.waits)
+				if transaction.waiting is not None:
+					(blocker, variable), since = transaction.waiting
+					waits.append((blocker, variable, since, now))
+				self._trace_waits(transaction, waits)
+			for index, since in self._trace_down_since.iteritems():
+				self._tracer.span(Tracer.SITES, index, 'down', since, now)
+			self._trace_down_since.clear()
+
+		for site in self._sites:
+			site.close()
+		self._commit_abort_log.close()
+		if self._fanout_pool is not None:
+			self._fanout_pool.close()
+			self._fanout_pool.join()
+
+	def is_blocked(self, txid):
+		''' Check whether an open transaction waits on a blocked command. '''
+		transaction = self._open_tx.get(txid)
+		return transaction is not None and transaction.blocked() is not None
+
+	@property
+	def has_retries(self):
+		'''
+		Check whether blocked transactions were woken and retry their
+		commands at the start of the next tick.
+		'''
+		return any(transaction in self._wakeups and
+				transaction.blocked() is not None
+				for transaction in self._blocked_queue)
+
+	def sync(self):
+		'''
+		Sync data that sites flushed in batches that are now due, as the end
+		of every tick does. Call while idle between ticks so that batches
+		stop waiting on the next commit.
+		'''
+		self._fan_out(lambda site: site.end_group_commit(), self._sites)
+
+	def add_event_log(self, event_log):
+		'''
+		Also log events to another EventLog, such as one that reports the
+		results of commands to network clients whatever the stream, level,
+		and format of the event log given to the constructor.
+		'''
+		self._event_log = TeeLog([self._event_log, event_log])
 
 	def get_commit_abort_log(self):
 		'''
 		Get TransactionManager commit and abort log. Entries are of the form
 			(TXID, TICK_END, STATUS)
 		where status is one of TransactionManager.COMMITTED or
-		TransactionManager.ABORTED.
+		TransactionManager.ABORTED. The log is a CommitLog that streams its
+		entries when iterated and looks up outcomes by txid.
+		'''
+		return self._commit_abort_log
+
+	def get_recovery_stats(self):
+		'''
+		Get database recovery statistics for each site as a dict of site
+		index to the statistics reported by DatabaseManager.recovery_stats.
+		'''
+		return dict((site.index, site.recovery_stats) for site in self._sites)
+
+	def get_snapshot_stats(self):
+		'''
+		Get multiversion clone memory statistics as a dict with the
+		'site_bytes' held by each site index, the total 'bytes', the
+		'budget', and the number of 'aborts' and 'spills' made by the
+		snapshot policy.
+		'''
+		return {
+				'site_bytes': dict((site.index, site.snapshot_bytes)
+					for site in self._sites),
+				'bytes': self._snapshot_bytes(),
+				'budget': self._snapshot_budget,
+				'aborts': self._snapshot_policy_counts['aborts'],
+				'spills': self._snapshot_policy_counts['spills'],
+				}
+
+	def _merged_metrics(self):
+		''' Sum the counters of the transaction manager and all sites. '''
+
+		metrics = dict.fromkeys(('commits', 'aborts', 'wait_die_kills',
+			'blocks', 'snapshots_taken', 'flushes', 'flush_bytes'), 0)
+		metrics.update(dict((name, dict()) for name in ('lock_grants',
+			'lock_conflicts', 'blocks_by_variable',
+			'wait_die_kills_by_variable')))
+		metrics.update(Metrics.merge([self._metrics.snapshot()]
+			+ [site.metrics_snapshot() for site in self._sites]))
+		return metrics
+
+	def get_stats(self):
 		'''
-		return tuple(self._commit_abort_log)
+		Get a snapshot of runtime counters summed over the transaction
+		manager and all sites. Counters are
+			'commits', 'aborts', 'wait_die_kills' : transaction outcomes
+			'blocks' : times that transactions blocked
+			'snapshots_taken' : multiversion clones taken
+			'flushes', 'flush_bytes' : site database flushes and bytes written
+			'lock_grants', 'lock_conflicts' : dicts of variable to lock count
+			'blocks_by_variable', 'wait_die_kills_by_variable' : dicts of
+				variable to blocks and kills of transactions on the variable
+		and gauges are
+			'ticks' : current time
+			'last_tick', 'peak_tick' : dicts of commits, aborts, and
+				wait-die kills in the last completed tick and their peaks
+			'blocked', 'peak_blocked' : blocked queue length
+			'snapshots', 'snapshot_bytes' : clones held and their memory
+		The snapshot holds only builtin types.
+		'''
+
+		stats = self._merged_metrics()
+		stats.update(
+				ticks=self._tick,
+				last_tick=dict(self._last_tick_counts),
+				peak_tick=dict(self._peak_tick_counts),
+				blocked=len(self._blocked_queue),
+				peak_blocked=self._peak_blocked,
+				snapshots=sum(transaction.num_snapshots
+					for transaction in self._open_tx.itervalues()),
+				snapshot_bytes=self._snapshot_bytes(),
+				)
+		return stats
+
+	def get_lock_graph(self):
+		'''
+		Get the current waits-for graph and the cumulative contention of each
+		variable as a lock graph. See repcrec.lock_graph. A transaction that
+		waits to promote its own lock is blocked only by the other holders.
+		'''
+
+		metrics = self._merged_metrics()
+		counters = dict(lock_grants=metrics['lock_grants'],
+				lock_conflicts=metrics['lock_conflicts'],
+				blocks=metrics['blocks_by_variable'],
+				wait_die_kills=metrics['wait_die_kills_by_variable'])
+
+		variables = []
+		for variable in set(it.chain(self._waiting,
+				counters['lock_conflicts'], counters['blocks'],
+				counters['wait_die_kills'])):
+			counts = dict((name, by_variable.get(variable, 0))
+					for name, by_variable in counters.iteritems())
+			counts.update(variable=variable,
+					waiting=len(self._waiting.get(variable, ())))
+			variables.append(counts)
+		variables.sort(key=lambda counts: (-counts['lock_conflicts'],
+			-counts['wait_die_kills'], -counts['blocks'], counts['variable']))
+
+		return dict(tick=self._tick, variables=variables,
+				waits_for=[dict(txid=transaction.txid,
+					variable=self._waits_on[transaction],
+					blocked_by=sorted(self._blockers[transaction]
+						- frozenset((transaction.txid,))))
+					for transaction in self._blocked_queue
+					if transaction in self._waits_on])
+
+	def get_latency_stats(self):
+		'''
+		Get latency histograms in microseconds of ended transactions as a
+		dict with Histogram values
+			'commit' : time from begin to commit
+			'abort' : time from begin to abort
+			'blocked' : time that each transaction that blocked spent blocked
+		and 'variables', a dict of variable to a Histogram of the time that
+		each transaction that blocked on the variable spent blocked on it.
+		'''
+		latency = dict(self._latency)
+		latency['variables'] = dict(self._variable_blocked)
+		return latency
+
+	def get_read_distribution(self):
+		''' Get dict of site index to the number of reads that it served. '''
+		return self._read_policy.distribution
 
 	# Field width used by __str__() method.
 	_FIELD_WIDTH = 5
@@ -619,7 +1402,8 @@ class TransactionManager(object):
 		if is_site is not True:
 			sites = self._sites
 		else:
-			sites = (site for site in self._sites if site.index is partition)
+			sites = (self._site_map[partition],) \
+					if partition in self._site_map else ()
 
 		legend = [
 				' x : denotes a variable',
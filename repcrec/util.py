@@ -6,7 +6,9 @@ database operation.
 (c) 2013 Brandon Reiss
 '''
 
+import collections
 import itertools as it
+import time
 
 class WaitDie(object):
 	''' State management for wait-die algorithm. '''
@@ -26,10 +28,13 @@ class WaitDie(object):
 		self._open_tx = open_tx
 		self._oldest_blocker = 1 << 31
 		self._blocked_by = None
+		self._blockers = set()
 
 	def append_blockers(self, waits_for):
 		''' Append blockers to this transaction. '''
 
+		self._blockers.update(waits_for)
+
 		oldest_waits_for, txid = min(it.imap(
 			lambda txid: (self._open_tx[txid].start_time, txid), waits_for))
 		if oldest_waits_for < self._oldest_blocker:
@@ -48,6 +53,11 @@ class WaitDie(object):
 		''' Return id of blocking transaction or None. '''
 		return self._blocked_by
 
+	@property
+	def blockers(self):
+		''' Return frozenset of ids of all blocking transactions. '''
+		return frozenset(self._blockers)
+
 	@property
 	def blocked_by_age(self):
 		''' Return age of blocking transaction or None. '''
@@ -55,7 +65,15 @@ class WaitDie(object):
 
 
 class TxRecord(object):
-	''' Record tracking transaction in the database system. '''
+	'''
+	Record tracking transaction in the database system.
+
+	The record keeps (tick, wall_time) timestamps of when the transaction
+	began, first blocked, was unblocked each time, and ended, and it keeps each
+	wait on a (blocking txid, variable) and the seconds that it spent blocked by
+	each. The blocking txid is None while no site holding the variable is
+	available.
+	'''
 
 	def __init__(self, txid, start_time, sites, is_ro):
 		'''
@@ -79,8 +97,22 @@ class TxRecord(object):
 		self._blocked = None
 		self._ended = False
 		self._sites = sites
+		self._site_indices = frozenset(site.index for site in sites)
+		self._snapshots = set()
+		self._locks = set()
 		self._is_ro = is_ro
 
+		# Timestamps of (tick, wall_time), the (blocker, variable) waited on
+		# with the wall time when that wait started, finished waits, and
+		# seconds blocked by each (blocker, variable).
+		self._began_at = (start_time, time.time())
+		self._first_blocked_at = None
+		self._unblocked_at = []
+		self._ended_at = None
+		self._waiting = None
+		self._waits = []
+		self._blocked_seconds = collections.defaultdict(float)
+
 	@property
 	def txid(self):
 		''' Get transaction id. '''
@@ -111,6 +143,48 @@ class TxRecord(object):
 		''' Check if the transaction is ended. '''
 		return self._ended
 
+	def has_site(self, index):
+		''' Check if a site is available to the transaction. '''
+		return index in self._site_indices
+
+	def has_snapshot(self, index):
+		''' Check if the transaction holds a multiversion clone of a site. '''
+		return index in self._snapshots
+
+	def mark_snapshot(self, index):
+		''' Mark that the transaction holds a multiversion clone of a site. '''
+		self._snapshots.add(index)
+
+	def clear_snapshot(self, index):
+		''' Mark that the transaction released its clone of a site. '''
+		self._snapshots.discard(index)
+
+	@property
+	def num_snapshots(self):
+		''' Number of multiversion clones that the transaction holds. '''
+		return len(self._snapshots)
+
+	@property
+	def locked_variables(self):
+		''' Get set of variables that the transaction has locked at any site. '''
+		return set(variable for _, variable, _ in self._locks)
+
+	def mark_locked(self, index, variable, mode):
+		'''
+		Mark that the transaction holds a lock on a variable at a site. Returns
+		True when the lock was not marked already.
+		'''
+
+		lock = (index, variable, mode)
+		if lock in self._locks:
+			return False
+		self._locks.add(lock)
+		return True
+
+	def clear_locks(self, index):
+		''' Mark that the transaction lost all of its locks at a site. '''
+		self._locks = set(lock for lock in self._locks if lock[0] != index)
+
 	def site_accessed_at(self, index):
 		''' Return time of first site access or None if never accessed. '''
 		if index in self._sites_accessed:
@@ -147,9 +221,89 @@ class TxRecord(object):
 		''' Check if transaction is blocked. '''
 		return self._blocked
 
-	def unblock(self):
+	def unblock(self, tick):
 		''' Unblock transaction. '''
 		self._blocked = None
+		self.stop_waiting()
+		self._unblocked_at.append((tick, time.time()))
+
+	def mark_waiting(self, blocker, variable, tick):
+		'''
+		Mark that the transaction waits on a blocking transaction for a
+		variable. Time blocked from now on counts against (blocker, variable)
+		until the transaction waits on another, is unblocked, or ends.
+		'''
+
+		if self._waiting is not None:
+			if self._waiting[0] == (blocker, variable):
+				return
+			self.stop_waiting()
+
+		now = time.time()
+		if self._first_blocked_at is None:
+			self._first_blocked_at = (tick, now)
+		self._waiting = ((blocker, variable), now)
+
+	def stop_waiting(self):
+		'''
+		Finish the current wait, if any, and count the time blocked. A wait
+		over which the wall clock stepped back counts as no time.
+		'''
+		if self._waiting is not None:
+			(blocker, variable), since = self._waiting
+			now = time.time()
+			self._waits.append((blocker, variable, since, now))
+			self._blocked_seconds[(blocker, variable)] += max(0., now - since)
+			self._waiting = None
+
+	def mark_ended(self, tick):
+		''' Mark that the transaction committed or aborted. '''
+		self.stop_waiting()
+		self._ended_at = (tick, time.time())
+
+	@property
+	def began_at(self):
+		''' Tuple (tick, wall_time) of when the transaction began. '''
+		return self._began_at
+
+	@property
+	def first_blocked_at(self):
+		''' Tuple (tick, wall_time) of the first block or None. '''
+		return self._first_blocked_at
+
+	@property
+	def unblocked_at(self):
+		''' List of (tick, wall_time) tuples of each unblock. '''
+		return self._unblocked_at
+
+	@property
+	def ended_at(self):
+		''' Tuple (tick, wall_time) of when the transaction ended or None. '''
+		return self._ended_at
+
+	@property
+	def waiting(self):
+		'''
+		Tuple ((blocking txid, variable), wall_time) of the current wait and
+		when it started or None.
+		'''
+		return self._waiting
+
+	@property
+	def waits(self):
+		'''
+		List of finished waits as (blocking txid, variable, start, end)
+		tuples of wall times.
+		'''
+		return self._waits
+
+	@property
+	def blocked_seconds(self):
+		'''
+		Dict of (blocking txid, variable) to seconds blocked, not counting a
+		wait that is still running.
+		'''
+		return self._blocked_seconds
 
 	def mark_site_accessed(self, index, tick):
 		''' Mark that transaction accessed a site. '''
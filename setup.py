@@ -12,5 +12,6 @@ setup(name='RepCRec',
 		packages=find_packages(),
 		scripts=[
 			'bin/repcrec',
+			'bin/repcrec-bench',
 			]
 		)
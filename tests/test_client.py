@@ -0,0 +1,202 @@
+'''
+Tests for Client and its futures.
+
+(c) 2013 Brandon Reiss
+'''
+
+from repcrec import TransactionManager, Topology
+from repcrec.client import Client, Future
+from repcrec.event_log import EventLog
+from repcrec.server import CommandServer
+import unittest
+import threading
+import socket
+import time
+import os
+
+class FutureTest(unittest.TestCase):
+
+	def test_result(self):
+		''' A future resolves once and then runs its callbacks. '''
+
+		future, done = Future(), []
+		future.add_done_callback(done.append)
+		self.assertFalse(future.done())
+		self.assertRaises(IOError, future.result, 0.01)
+
+		future.set_result(5)
+		future.set_result(6)
+		self.assertTrue(future.done())
+		self.assertEqual(5, future.result())
+		self.assertEqual([future], done)
+
+		# Callbacks added later run at once.
+		future.add_done_callback(done.append)
+		self.assertEqual([future, future], done)
+
+	def test_exception(self):
+		''' A failed future raises its error. '''
+
+		future = Future()
+		future.set_exception(ValueError('rejected'))
+		future.set_result(5)
+		self.assertRaises(ValueError, future.result)
+
+class ClientTest(unittest.TestCase):
+
+	def setUp(self):
+		''' Serve a database that logs nothing from a thread. '''
+
+		now = time.time()
+		self._test_dir = os.path.join('/tmp', 'testclient_{}'.format(now))
+		os.makedirs(self._test_dir)
+		self._transaction_manager = TransactionManager(
+				Topology().data_file_map(), self._test_dir,
+				event_log=EventLog(level=EventLog.OFF))
+		self._address = os.path.join(self._test_dir, 'server.sock')
+		self._server = CommandServer(self._transaction_manager, self._address)
+		self._thread = threading.Thread(target=self._server.serve_forever)
+		self._thread.daemon = True
+		self._thread.start()
+		self._client = Client(self._address, connections=2)
+
+	def tearDown(self):
+		''' Stop the server and cleanup test directory. '''
+
+		self._client.close()
+		self._server.stop()
+		self._thread.join()
+		self._server.close()
+		self._transaction_manager.close()
+
+		for dirpath, dirnames, filenames in os.walk(
+				self._test_dir, topdown=False):
+			for filename in filenames:
+				os.remove(os.path.join(dirpath, filename))
+			for dirname in dirnames:
+				os.rmdir(os.path.join(dirpath, dirname))
+		os.rmdir(self._test_dir)
+
+	def test_round_trip(self):
+		''' Commands resolve to their log lines, reads, and outcomes. '''
+
+		client = self._client
+		begin = client.begin(1)
+		write = client.write(1, 2, 20)
+		read = client.read(1, 2)
+		outcome = client.end(1)
+
+		self.assertEqual(TransactionManager.COMMITTED, outcome.result(5))
+		self.assertEqual(20, read.result(5))
+		self.assertTrue(begin.result(5)[0].endswith('started'))
+		self.assertTrue('x2 <- 20' in write.result(5)[0])
+
+		client.begin(2, read_only=True)
+		self.assertEqual(20, client.read(2, 2).result(5))
+		self.assertEqual(TransactionManager.COMMITTED,
+				client.end(2).result(5))
+
+	def test_pipelining(self):
+		''' Many commands sent without waiting all resolve in order. '''
+
+		client = self._client
+		outcomes, reads = [], []
+		for txid in range(1, 21):
+			client.begin(txid)
+			client.write(txid, txid, 100 + txid)
+			reads.append(client.read(txid, txid))
+			outcomes.append(client.end(txid))
+
+		self.assertEqual(range(101, 121), [read.result(5) for read in reads])
+		self.assertEqual([TransactionManager.COMMITTED] * 20,
+				[outcome.result(5) for outcome in outcomes])
+
+	def test_blocked_read(self):
+		''' A read that blocks resolves in the tick that it finally runs. '''
+
+		client = self._client
+		client.begin(1).result(5)
+		client.begin(2).result(5)
+		client.write(2, 4, 44).result(5)
+
+		# The older transaction waits on the younger one.
+		read = client.read(1, 4)
+		self.assertRaises(IOError, read.result, 0.2)
+
+		self.assertEqual(TransactionManager.COMMITTED,
+				client.end(2).result(5))
+		client.send('dump(x4)')
+		self.assertEqual(44, read.result(5))
+		self.assertEqual(TransactionManager.COMMITTED,
+				client.end(1).result(5))
+
+	def test_pipelining_contention(self):
+		''' Commands pipelined behind a blocked write run once it does. '''
+
+		client = self._client
+		client.begin(3).result(5)
+		client.begin(4).result(5)
+		client.write(4, 4, 44).result(5)
+
+		# The older transaction blocks on its write, and its read and end
+		# wait behind it on the same connection.
+		write = client.write(3, 4, 2)
+		read = client.read(3, 1)
+		outcome = client.end(3)
+		self.assertRaises(IOError, outcome.result, 0.2)
+
+		self.assertEqual(TransactionManager.COMMITTED,
+				client.end(4).result(5))
+		self.assertEqual(TransactionManager.COMMITTED, outcome.result(5))
+		self.assertTrue(write.done())
+		self.assertEqual(10, read.result(5))
+
+	def test_killed_read(self):
+		''' Reads and outcomes of a killed transaction fail and abort. '''
+
+		client = self._client
+		client.begin(1).result(5)
+		client.begin(2).result(5)
+		client.write(1, 4, 14).result(5)
+
+		# The younger transaction dies rather than wait on the older one.
+		read = client.read(2, 4)
+		self.assertRaises(RuntimeError, read.result, 5)
+		self.assertEqual(TransactionManager.ABORTED,
+				client.outcome(2).result(5))
+
+	def test_rejected(self):
+		''' Rejected commands fail their futures and outcomes. '''
+
+		client = self._client
+		self.assertRaises(ValueError, client.send('foo(T1)')[0].result, 5)
+		self.assertRaises(ValueError, client.read(3, 2).result, 5)
+		self.assertRaises(ValueError, client.end(3).result, 5)
+
+class ConnectionCloseTest(unittest.TestCase):
+
+	def test_close_fails_futures(self):
+		''' Futures still waiting fail when the server closes. '''
+
+		listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		listener.bind(('localhost', 0))
+		listener.listen(1)
+		try:
+			client = Client('localhost:{}'.format(listener.getsockname()[1]))
+			sock, _ = listener.accept()
+
+			client.begin(1)
+			write = client.write(1, 2, 20)
+			read = client.read(1, 2)
+			outcome = client.end(1)
+			sock.close()
+
+			for future in (write, read, outcome):
+				self.assertRaises(IOError, future.result, 5)
+			self.assertRaises(IOError, client.begin, 2)
+			self.assertRaises(IOError, client.outcome(2).result, 5)
+		finally:
+			listener.close()
+
+if __name__ == '__main__':
+	unittest.main()
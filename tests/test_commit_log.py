@@ -0,0 +1,114 @@
+'''
+Tests for CommitLog.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec.commit_log import CommitLog
+import unittest
+import time
+import os
+import random
+
+class CommitLogTest(unittest.TestCase):
+
+	def setUp(self):
+		''' Create spill file path. '''
+		self._spill_file_path = os.path.join('/tmp',
+				'testcommitlog_{}'.format(time.time()))
+
+	def tearDown(self):
+		''' Remove spill file. '''
+		if os.path.exists(self._spill_file_path):
+			os.remove(self._spill_file_path)
+
+	def test_spill(self):
+		'''
+		Entries beyond the capacity spill to disk, and iteration returns the
+		full history in order.
+		'''
+
+		commit_log = CommitLog(self._spill_file_path, capacity=16)
+		entries = [(txid, random.randint(0, 1000), random.randint(0, 1))
+				for txid in range(1, 101)]
+
+		for count, entry in enumerate(entries, 1):
+			commit_log.append(*entry)
+			self.assertEqual(count, len(commit_log))
+			self.assertTrue(len(commit_log) - commit_log.num_spilled < 16)
+
+		self.assertTrue(commit_log.num_spilled > 0)
+		self.assertEqual(entries, list(commit_log))
+
+		# Appending while iterating does not change the iteration.
+		iterator = iter(commit_log)
+		self.assertEqual(entries[0], next(iterator))
+		for txid in range(101, 121):
+			commit_log.append(txid, 0, 0)
+		self.assertEqual(entries[1:], list(iterator))
+
+		# Entries keep spilling after the log is closed and reopened.
+		commit_log.close()
+		self.assertEqual(entries, list(commit_log)[:100])
+		commit_log.append(121, 0, 0)
+		for txid in range(122, 141):
+			commit_log.append(txid, 0, 0)
+		self.assertEqual(range(1, 141),
+				[txid for txid, _, _ in commit_log])
+		commit_log.close()
+
+	def test_outcome(self):
+		''' Outcomes are the first logged for each transaction. '''
+
+		commit_log = CommitLog(self._spill_file_path, capacity=4)
+		self.assertEqual(None, commit_log.outcome(1))
+
+		for txid in range(1, 21):
+			commit_log.append(txid, txid, txid % 2)
+		commit_log.append(3, 30, 0)
+
+		for txid in range(1, 21):
+			self.assertEqual(txid % 2, commit_log.outcome(txid))
+		self.assertEqual(None, commit_log.outcome(21))
+
+		# Only outcomes of entries in memory are indexed in memory.
+		self.assertTrue(len(commit_log._outcomes) < 4)
+
+		# Outcomes are found whatever the order of txids.
+		txids = range(100, 200)
+		random.shuffle(txids)
+		for txid in txids:
+			commit_log.append(txid, 0, txid % 3)
+		for txid in txids:
+			self.assertEqual(txid % 3, commit_log.outcome(txid))
+		commit_log.close()
+
+	def test_outcome_reads_one_spill(self):
+		''' Looking up an outcome reads only a spill that holds the txid. '''
+
+		commit_log = CommitLog(self._spill_file_path, capacity=8)
+		reads = []
+		spilled_outcome = commit_log._spilled_outcome
+		def counted(txid, first, num_entries):
+			reads.append(txid)
+			return spilled_outcome(txid, first, num_entries)
+		commit_log._spilled_outcome = counted
+
+		# The ranges of txids of all spills overlap.
+		txids = range(100, 200)
+		random.shuffle(txids)
+		for txid in txids:
+			commit_log.append(txid, 0, txid % 3)
+		self.assertTrue(commit_log.num_spilled > 80)
+
+		for txid in txids:
+			del reads[:]
+			self.assertEqual(txid % 3, commit_log.outcome(txid))
+			self.assertEqual([] if txid in commit_log._outcomes else [txid],
+					reads)
+
+		# Transactions without outcomes never read the disk.
+		del reads[:]
+		for txid in (99, 200):
+			self.assertEqual(None, commit_log.outcome(txid))
+		self.assertEqual([], reads)
+		commit_log.close()
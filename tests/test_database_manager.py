@@ -5,6 +5,10 @@ Tests for DatabaseManager.
 '''
 
 from repcrec import DatabaseManager
+from repcrec.durability import DurabilityPolicy
+from repcrec.log_manager import LogManager
+from repcrec import log_manager
+from repcrec.bulk_load import bulk_load
 import unittest
 import time
 import os
@@ -149,6 +153,192 @@ class DatabaseManagerTest(unittest.TestCase):
 
 		self.validate_values(dbm, values)
 
+	def test_log_recover(self):
+		''' Test that recovery replays the write-ahead log. '''
+
+		values = self._values
+		dbm = DatabaseManager(values, self._test_dir, 'test_log', use_log=True)
+		with open(dbm.data_file_path, 'r') as data_file:
+			snapshot = data_file.read()
+
+		# Writes go to the log rather than the data file.
+		for variable in values:
+			values[variable] = random.randint(101, 200)
+			dbm.write(variable, values[variable])
+		with open(dbm.data_file_path, 'r') as data_file:
+			self.assertEqual(snapshot, data_file.read())
+
+		# Tear the last record and check that it is discarded.
+		del dbm
+		with open(os.path.join(self._test_dir, 'test_log.log'), 'a') as log:
+			log.write('00000000 1 0')
+		dbm = DatabaseManager(
+				self._values, self._test_dir, 'test_log', use_log=True)
+		self.validate_values(dbm, values)
+
+		# New records are appended after the last complete record.
+		values[1] = 0
+		dbm.write(1, 0)
+		del dbm
+		dbm = DatabaseManager(
+				self._values, self._test_dir, 'test_log', use_log=True)
+		self.validate_values(dbm, values)
+
+	def test_group_commit(self):
+		''' Test that writes in a group share a single flush. '''
+
+		dbm, values = self._dbm, self._values
+		with open(dbm.data_file_path, 'r') as data_file:
+			snapshot = data_file.read()
+
+		dbm.begin_group()
+		for variable in values:
+			values[variable] = random.randint(101, 200)
+			dbm.write(variable, values[variable])
+		self.validate_values(dbm, values)
+		with open(dbm.data_file_path, 'r') as data_file:
+			self.assertEqual(snapshot, data_file.read())
+
+		dbm.end_group()
+		self.validate_values(self.make_dbm(), values)
+
+	def test_batched_sync(self):
+		''' Test that batches sync once due while idle or when forced. '''
+
+		make_batched_dbm = lambda prefix, **kwargs: DatabaseManager(
+				self._values, self._test_dir, prefix,
+				durability=DurabilityPolicy.BATCHED, **kwargs)
+
+		# A batch that stops growing syncs once it is due.
+		dbm = make_batched_dbm('test_batched_ms', sync_ms=200)
+		durability = dbm.durability
+		syncs = durability.num_syncs
+		dbm.write(1, 101)
+		dbm.sync()
+		self.assertEqual(syncs, durability.num_syncs)
+		self.assertTrue(durability.unsynced)
+		time.sleep(0.25)
+		dbm.sync()
+		dbm.sync()
+		self.assertEqual(syncs + 1, durability.num_syncs)
+		self.assertFalse(durability.unsynced)
+
+		# Durable syncs do not wait for the batch.
+		dbm = make_batched_dbm('test_batched_commits', sync_commits=100)
+		durability = dbm.durability
+		syncs = durability.num_syncs
+		dbm.write(1, 101)
+		dbm.sync(durable=True)
+		dbm.sync(durable=True)
+		self.assertEqual(syncs + 1, durability.num_syncs)
+
+		# The journal of slots written in place syncs before the slots.
+		synced = []
+		fsync_file = log_manager.fsync_file
+		log_manager.fsync_file = synced.append
+		try:
+			dbm = make_batched_dbm('test_batched_binary', sync_commits=100,
+					data_format=DatabaseManager.BINARY_FORMAT)
+			dbm.write(1, 101)
+		finally:
+			log_manager.fsync_file = fsync_file
+		self.assertEqual(1, len(synced))
+
+	def test_binary_recover(self):
+		''' Test recovery of binary data files and their journal. '''
+
+		values = self._values
+		make_binary_dbm = lambda **kwargs: DatabaseManager(
+				self._values, self._test_dir, 'test_binary',
+				data_format=DatabaseManager.BINARY_FORMAT, **kwargs)
+
+		dbm = make_binary_dbm()
+		data_file_size = os.path.getsize(dbm.data_file_path)
+		for variable in values:
+			values[variable] = random.randint(101, 200)
+			dbm.write(variable, values[variable])
+		self.assertEqual(data_file_size, os.path.getsize(dbm.data_file_path))
+		self.validate_values(dbm, values)
+		self.assertEqual(values, dbm.dump())
+
+		# A journal left behind by a failure is replayed.
+		del dbm
+		journal = LogManager(os.path.join(self._test_dir, 'test_binary.jnl'))
+		journal.append(((1, 0),))
+		journal.flush()
+		journal.close()
+		values[1] = 0
+		dbm = make_binary_dbm()
+		self.validate_values(dbm, values)
+
+		# Logged writes do not touch the binary data file.
+		del dbm
+		dbm = make_binary_dbm(use_log=True)
+		with open(dbm.data_file_path, 'rb') as data_file:
+			snapshot = data_file.read()
+		values[2] = 0
+		dbm.write(2, 0)
+		with open(dbm.data_file_path, 'rb') as data_file:
+			self.assertEqual(snapshot, data_file.read())
+		del dbm
+		self.validate_values(make_binary_dbm(use_log=True), values)
+
+	def test_bulk_load(self):
+		''' Test that bulk loaded data files define the database. '''
+
+		# Site 1 holds even variables and site 2 holds all of them.
+		variables = sorted(self._values)
+		values = [self._values[variable] for variable in variables]
+		replicas = lambda variable: (1, 2) if 0 == (variable & 1) else (2,)
+
+		for data_format in (DatabaseManager.TEXT_FORMAT,
+				DatabaseManager.BINARY_FORMAT):
+			site_variables = bulk_load(self._test_dir, (1, 2, 3),
+					variables, values, replicas, data_format)
+			self.assertEqual([variable for variable in variables
+				if 0 == (variable & 1)], list(site_variables[1]))
+			self.assertEqual(variables, list(site_variables[2]))
+			self.assertEqual([], list(site_variables[3]))
+
+			for index, site_values in (
+					(1, dict((variable, value)
+						for variable, value in self._values.iteritems()
+						if 0 == (variable & 1))),
+					(2, self._values),
+					(3, dict())):
+				dbm = DatabaseManager(None, self._test_dir,
+						'site_{}'.format(index), data_format=data_format)
+				self.assertEqual(sorted(site_values), sorted(dbm.variables))
+				self.assertEqual(site_values, dbm.dump())
+
+		# Variables must be in increasing order.
+		self.assertRaises(ValueError, bulk_load, self._test_dir, (1, 2),
+				variables[::-1], values, replicas)
+
+	def test_checkpoint(self):
+		''' Test that checkpoints truncate the log and preserve values. '''
+
+		values = self._values
+		make_log_dbm = lambda: DatabaseManager(
+				self._values, self._test_dir, 'test_ckp', use_log=True,
+				checkpoint_commits=len(values))
+		log_file_path = os.path.join(self._test_dir, 'test_ckp.log')
+
+		dbm = make_log_dbm()
+		for variable in values:
+			values[variable] = random.randint(101, 200)
+			dbm.write(variable, values[variable])
+		dbm.checkpoint()
+		self.assertEqual(0, os.path.getsize(log_file_path))
+
+		# Writes after the checkpoint are replayed over it.
+		values[1] = 0
+		dbm.write(1, 0)
+		del dbm
+		dbm = make_log_dbm()
+		self.validate_values(dbm, values)
+		self.assertEqual(1, dbm.recovery_stats['records'])
+
 	def test_has_variable(self):
 		''' Test that has_variable() works as epxected. '''
 
@@ -166,6 +356,57 @@ class DatabaseManagerTest(unittest.TestCase):
 		for variable in values:
 			self.assertTrue(clone.has_variable(variable))
 
+		# Later writes are not visible to the clone.
+		old_values = dict(values)
+		for _ in range(3):
+			for variable in values:
+				values[variable] = random.randint(101, 200)
+			dbm.batch_write(values.iteritems())
+		newer_clone = dbm.multiversion_clone()
+		self.validate_values(clone, old_values)
+		self.validate_values(newer_clone, values)
+		self.validate_values(dbm, values)
+
+		# Superseded values are discarded once no clone can read them.
+		self.assertTrue(dbm.snapshot_bytes > 0)
+		clone.release()
+		self.assertEqual(dict(), dbm._history)
+		self.assertEqual(0, dbm.snapshot_bytes)
+		newer_clone.release()
+
+	def test_multiversion_spill(self):
+		''' Test spilling a DatabaseManager.MultiversionClone to disk. '''
+
+		dbm, values = self._dbm, self._values
+
+		clone = dbm.multiversion_clone()
+		old_values = dict(values)
+		for variable in values:
+			values[variable] = random.randint(101, 200)
+		dbm.batch_write(values.iteritems())
+		self.assertTrue(dbm.snapshot_bytes > 0)
+
+		# The spilled clone reads the same values without a pinned version.
+		clone.spill()
+		self.assertTrue(clone.spilled)
+		self.assertEqual(0, dbm.snapshot_bytes)
+		self.assertEqual(dict(), dbm._history)
+		self.validate_values(clone, old_values)
+		self.validate_values(dbm, values)
+
+		# Another instance of the database reopens the spilled clone.
+		reopened = self.make_dbm()
+		reopened.continue_version(dbm.version)
+		self.assertEqual(dbm.version, reopened.version)
+		reopened_clone = reopened.open_spilled_clone(
+				clone.version, clone.spill_file_path)
+		self.validate_values(reopened_clone, old_values)
+		self.validate_values(reopened, values)
+
+		clone.release()
+		self.assertEqual([], [filename for filename in os.listdir(dbm.data_path)
+			if filename.endswith('.spl')])
+
 
 if __name__ == '__main__':
 	unittest.main()
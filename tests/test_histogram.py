@@ -0,0 +1,60 @@
+'''
+Tests for Histogram.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec.histogram import Histogram
+import unittest
+import random
+import math
+
+class HistogramTest(unittest.TestCase):
+
+	def test_percentiles(self):
+		'''
+		Percentiles are within the precision of the exact percentiles, and
+		small values are exact.
+		'''
+
+		histogram = Histogram(significant_digits=2)
+		self.assertEqual(None, histogram.value_at_percentile(50))
+
+		values = sorted(random.randint(0, 10 ** 7) for _ in range(10000))
+		for value in values:
+			histogram.record(value)
+
+		self.assertEqual(len(values), len(histogram))
+		self.assertEqual(values[0], histogram.min)
+		self.assertEqual(values[-1], histogram.max)
+		for percentile in (1, 50, 90, 99, 99.9):
+			exact = values[int(math.ceil(percentile / 100. * len(values))) - 1]
+			value = histogram.value_at_percentile(percentile)
+			self.assertTrue(exact <= value <= exact * 1.01)
+		self.assertEqual(values[-1], histogram.value_at_percentile(100))
+
+		exact = Histogram(significant_digits=2)
+		for value in range(100):
+			exact.record(value)
+		self.assertEqual(49, exact.value_at_percentile(50))
+		self.assertEqual(98, exact.value_at_percentile(99))
+
+	def test_add(self):
+		''' Adding histograms adds their counts. '''
+
+		first, second = Histogram(), Histogram()
+		first.record(10, count=3)
+		second.record(1000)
+		second.record(5)
+		first.add(second)
+
+		self.assertEqual(5, len(first))
+		self.assertEqual(5, first.min)
+		self.assertEqual(1000, first.max)
+		self.assertEqual(10, first.value_at_percentile(50))
+		self.assertEqual(1000, first.value_at_percentile(100))
+		self.assertRaises(ValueError, first.add, Histogram(3))
+		self.assertRaises(ValueError, first.record, -1)
+
+
+if __name__ == '__main__':
+	unittest.main()
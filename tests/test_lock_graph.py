@@ -0,0 +1,61 @@
+'''
+Tests for lock graph formatting.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec.lock_graph import format_text, format_dot, format_json
+import unittest
+import json
+
+class LockGraphTest(unittest.TestCase):
+
+	def setUp(self):
+		''' Create a lock graph. '''
+
+		def counts(variable, lock_conflicts, wait_die_kills, waiting):
+			''' Contention counts of a variable. '''
+			return dict(variable=variable, lock_grants=10,
+					lock_conflicts=lock_conflicts, blocks=waiting,
+					wait_die_kills=wait_die_kills, waiting=waiting)
+
+		self._graph = dict(tick=4,
+				waits_for=[dict(txid=2, variable=2, blocked_by=[1]),
+					dict(txid=3, variable=1, blocked_by=[]),
+					dict(txid=4, variable=4, blocked_by=[1, 3])],
+				variables=[counts(4, 8, 1, 1), counts(2, 4, 0, 1),
+					counts(1, 0, 0, 1)])
+
+	def test_text(self):
+		''' Text lists edges and then contention. '''
+
+		self.assertEqual('\n'.join([
+			'waits-for at t4:',
+			'  T2 waits on x2 for T1',
+			'  T3 waits on x1 for an available site',
+			'  T4 waits on x4 for T1, T3',
+			'contention:',
+			'  x4: 8 conflicts, 10 grants, 1 blocks, 1 kills, 1 waiting',
+			'  x2: 4 conflicts, 10 grants, 1 blocks, 0 kills, 1 waiting',
+			'  x1: 0 conflicts, 10 grants, 1 blocks, 0 kills, 1 waiting',
+			]), format_text(self._graph))
+
+	def test_dot(self):
+		''' DOT has an edge per blocker and shades variables by conflicts. '''
+
+		dot = format_dot(self._graph).split('\n')
+		self.assertEqual('digraph locks {', dot[0])
+		self.assertEqual('}', dot[-1])
+		for edge in ('"T2" -> "T1" [label="x2"];', '"T4" -> "T1" [label="x4"];',
+				'"T4" -> "T3" [label="x4"];', '"T3" -> "x1" [style=dashed];'):
+			self.assertTrue('  ' + edge in dot)
+		shades = [line.rsplit('fillcolor=', 1)[1] for line in dot
+				if 'fillcolor=' in line]
+		self.assertEqual(['9];', '5];', '1];'], shades)
+
+	def test_json(self):
+		''' JSON holds the graph. '''
+		self.assertEqual(self._graph, json.loads(format_json(self._graph)))
+
+
+if __name__ == '__main__':
+	unittest.main()
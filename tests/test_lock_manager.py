@@ -5,6 +5,7 @@ Tests for LockManager.
 '''
 import unittest
 from repcrec import LockManager
+from repcrec.metrics import Metrics
 import random
 
 class LockManagerTest(unittest.TestCase):
@@ -101,6 +102,71 @@ class LockManagerTest(unittest.TestCase):
 					None,
 					lock_manager.get_lock_state(variable, txid))
 
+	def test_unlock_all(self):
+		'''
+		Releases every lock held by a transaction and no others.
+		'''
+
+		lock_manager, variables = self._lock_manager, self._variables
+
+		# Two readers share half of the variables and one writer has the rest.
+		readers, writer = (1, 2), 3
+		shared, written = variables[:5], variables[5:]
+		for variable in shared:
+			for reader in readers:
+				self.assertTrue(
+					lock_manager.try_lock(variable, reader, LockManager.R_LOCK))
+		for variable in written:
+			self.assertTrue(
+				lock_manager.try_lock(variable, writer, LockManager.RW_LOCK))
+		self.assertEqual(frozenset(shared), lock_manager.get_held(readers[0]))
+		self.assertEqual(frozenset(written), lock_manager.get_held(writer))
+		self.assertEqual(len(variables), lock_manager.num_locked)
+
+		# The other reader keeps its locks.
+		lock_manager.unlock_all(readers[0])
+		self.assertEqual(frozenset(), lock_manager.get_held(readers[0]))
+		for variable in shared:
+			self.assertEqual(None,
+					lock_manager.get_lock_state(variable, readers[0]))
+			self.assertEqual(LockManager.R_LOCK,
+					lock_manager.get_lock_state(variable, readers[1]))
+
+		# Variables with no holders are unlocked.
+		lock_manager.unlock_all(readers[1])
+		lock_manager.unlock_all(writer)
+		for variable in variables:
+			self.assertEqual(None, lock_manager.get_locks(variable))
+		self.assertEqual(0, lock_manager.num_locked)
+
+		# Unlocking a transaction without locks does nothing.
+		lock_manager.unlock_all(writer)
+
+	def test_metrics(self):
+		'''
+		Counts lock grants and conflicts by variable in a shared registry.
+		'''
+
+		metrics = Metrics()
+		lock_manager = LockManager(metrics)
+
+		self.assertTrue(lock_manager.try_lock(1, 1, LockManager.R_LOCK))
+		self.assertTrue(lock_manager.try_lock(1, 2, LockManager.R_LOCK))
+		self.assertFalse(lock_manager.try_lock(1, 1, LockManager.RW_LOCK))
+		self.assertTrue(lock_manager.try_lock(2, 1, LockManager.RW_LOCK))
+		self.assertFalse(lock_manager.try_lock(2, 2, LockManager.R_LOCK))
+
+		# Counts survive replacing the lock manager.
+		lock_manager = LockManager(metrics)
+		self.assertTrue(lock_manager.try_lock(2, 2, LockManager.R_LOCK))
+
+		snapshot = metrics.snapshot()
+		self.assertEqual({1: 2, 2: 2}, snapshot['lock_grants'])
+		self.assertEqual({1: 1, 2: 1}, snapshot['lock_conflicts'])
+		self.assertEqual({'lock_grants': {1: 4, 2: 4},
+			'lock_conflicts': {1: 2, 2: 2}},
+			Metrics.merge((snapshot, snapshot)))
+
 
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,69 @@
+'''
+Tests for read replica selection policies.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec.read_policy import ReadPolicy, RoundRobinPolicy, \
+		LeastLockedPolicy, LeastRecentlyFailedPolicy, make_read_policy
+import collections
+import unittest
+
+# Stand-in for a replica Site with the attributes that policies use.
+FakeSite = collections.namedtuple('FakeSite', 'index num_locked up_since')
+
+class ReadPolicyTest(unittest.TestCase):
+
+	def setUp(self):
+		''' Create replicas in placement order. '''
+		self._replicas = [FakeSite(1, 3, 5), FakeSite(2, 0, None),
+				FakeSite(3, 1, 0), FakeSite(4, 0, 5)]
+
+	def indexes(self, replicas):
+		''' Get the site indexes of replicas. '''
+		return [site.index for site in replicas]
+
+	def test_first_available(self):
+		''' Replicas are tried in placement order. '''
+		self.assertEqual([1, 2, 3, 4],
+				self.indexes(ReadPolicy().order(1, self._replicas)))
+
+	def test_round_robin(self):
+		''' Each variable rotates the first replica tried on its own. '''
+
+		policy = RoundRobinPolicy()
+		self.assertEqual([[1, 2, 3, 4], [2, 3, 4, 1], [3, 4, 1, 2]],
+				[self.indexes(policy.order(1, self._replicas))
+					for _ in range(3)])
+		self.assertEqual([1, 2, 3, 4],
+				self.indexes(policy.order(2, self._replicas)))
+		self.assertEqual([4, 1, 2, 3],
+				self.indexes(policy.order(1, self._replicas)))
+
+		# The rotation wraps when the number of replicas changes.
+		self.assertEqual([1, 3], self.indexes(policy.order(1,
+			[self._replicas[0], self._replicas[2]])))
+		self.assertEqual([], policy.order(3, []))
+
+	def test_least_locked(self):
+		''' Replicas with the fewest locks come first, ties in site order. '''
+		self.assertEqual([2, 4, 3, 1],
+				self.indexes(LeastLockedPolicy().order(1, self._replicas)))
+
+	def test_least_recently_failed(self):
+		''' Replicas recovered the longest ago come first, down sites last. '''
+		self.assertEqual([3, 1, 4, 2], self.indexes(
+			LeastRecentlyFailedPolicy().order(1, self._replicas)))
+
+	def test_distribution(self):
+		''' Reads served are counted by site index. '''
+
+		policy = make_read_policy('round-robin')
+		self.assertEqual(dict(), policy.distribution)
+		for variable in range(4):
+			policy.record_read(policy.order(variable, self._replicas)[0])
+		policy.record_read(self._replicas[3])
+		self.assertEqual({1: 4, 4: 1}, policy.distribution)
+		self.assertRaises(ValueError, make_read_policy, 'fastest')
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,195 @@
+'''
+Tests for CommandServer over loopback sockets.
+
+(c) 2013 Brandon Reiss
+'''
+
+from repcrec import TransactionManager, Topology
+from repcrec.event_log import EventLog
+from repcrec.server import CommandServer
+import unittest
+import threading
+import select
+import socket
+import time
+import os
+import re
+
+# Tick of a log line sent to a client.
+_TICK_PATTERN = re.compile(r'\S+ \| t([0-9]+),')
+
+class ServerTest(unittest.TestCase):
+
+	def connect(self):
+		''' Connect a client socket to the server. '''
+
+		address = self._server.address
+		family = socket.AF_UNIX if isinstance(address, str) \
+				else socket.AF_INET
+		sock = socket.socket(family, socket.SOCK_STREAM)
+		sock.settimeout(5.)
+		sock.connect(address)
+		self._socks.append(sock)
+		return sock, sock.makefile('r')
+
+	def read_until(self, replies, status):
+		''' Read reply lines through the first one equal to status. '''
+
+		lines = []
+		while True:
+			line = replies.readline()
+			self.assertNotEqual('', line, 'Connection closed before '
+				'{!r}; read {}'.format(status, lines))
+			lines.append(line.rstrip('\n'))
+			if lines[-1] == status:
+				return lines
+
+	def address(self):
+		''' Address for the server to listen on. '''
+		return os.path.join(self._test_dir, 'server.sock')
+
+	def setUp(self):
+		''' Create test directory and a database that logs nothing. '''
+
+		now = time.time()
+		self._test_dir = os.path.join('/tmp', 'testserver_{}'.format(now))
+		os.makedirs(self._test_dir)
+		self._transaction_manager = TransactionManager(
+				Topology().data_file_map(), self._test_dir,
+				event_log=EventLog(level=EventLog.OFF))
+		self._socks = []
+
+		# Serve from a thread.
+		self._server = CommandServer(self._transaction_manager, self.address())
+		self._thread = threading.Thread(target=self._server.serve_forever)
+		self._thread.daemon = True
+		self._thread.start()
+
+	def tearDown(self):
+		''' Stop the server and cleanup test directory. '''
+
+		for sock in self._socks:
+			sock.close()
+		self._server.stop()
+		self._thread.join()
+		self._server.close()
+		self._transaction_manager.close()
+
+		for dirpath, dirnames, filenames in os.walk(
+				self._test_dir, topdown=False):
+			for filename in filenames:
+				os.remove(os.path.join(dirpath, filename))
+			for dirname in dirnames:
+				os.rmdir(os.path.join(dirpath, dirname))
+		os.rmdir(self._test_dir)
+
+	def test_status_replies(self):
+		''' Every command gets its log lines and then ok or an error. '''
+
+		sock, replies = self.connect()
+		sock.sendall('begin(T1); W(T1, x2, 5)\nfoo(T1)\nR(T1\nend(T1)\n')
+
+		# A line that does not parse is rejected as soon as it arrives.
+		lines = self.read_until(replies, '5 ok')
+		self.assertTrue(lines[0].startswith('4 error'))
+		self.assertTrue(lines[1].startswith('1 | '))
+		self.assertEqual('1 ok', lines[2])
+		self.assertTrue(lines[3].startswith('2 | ') and 'x2 <- 5' in lines[3])
+		self.assertEqual('2 ok', lines[4])
+		self.assertTrue(lines[5].startswith('3 error'))
+		self.assertTrue(lines[6].startswith('5 | ') and 'committed' in lines[6])
+
+	def test_one_line_per_tick(self):
+		''' The lines of a client run in separate ticks in order. '''
+
+		sock, replies = self.connect()
+		sock.sendall('begin(T1)\nbegin(T2)\nbegin(T3)\n')
+
+		ticks = [int(_TICK_PATTERN.match(line).group(1))
+				for line in self.read_until(replies, '3 ok')
+				if _TICK_PATTERN.match(line) is not None]
+		self.assertEqual(3, len(ticks))
+		self.assertEqual(sorted(set(ticks)), ticks)
+
+	def test_route_blocked_write(self):
+		''' A blocked write that runs later is sent to its client. '''
+
+		older, older_replies = self.connect()
+		younger, younger_replies = self.connect()
+
+		older.sendall('begin(T1)\n')
+		self.read_until(older_replies, '1 ok')
+		younger.sendall('begin(T2)\nW(T2, x2, 22)\n')
+		self.read_until(younger_replies, '2 ok')
+
+		# The older transaction waits for the younger to end.
+		older.sendall('W(T1, x2, 11)\n')
+		lines = self.read_until(older_replies, '2 ok')
+		self.assertFalse(any('x2 <- 11' in line for line in lines))
+
+		younger.sendall('end(T2)\n')
+		self.read_until(younger_replies, '3 ok')
+
+		# The write runs when the next tick retries it, and the client of the
+		# younger transaction sees none of it.
+		younger.sendall('dump(x2)\n')
+		lines = self.read_until(younger_replies, '4 ok')
+		self.assertFalse(any(line.startswith('*') for line in lines))
+
+		line = older_replies.readline().rstrip('\n')
+		self.assertTrue(line.startswith('* | '), line)
+		self.assertTrue('T1' in line and 'x2 <- 11' in line, line)
+
+	def test_hold_blocked_transaction(self):
+		''' Lines for a blocked transaction wait until it runs again. '''
+
+		older, older_replies = self.connect()
+		younger, younger_replies = self.connect()
+
+		older.sendall('begin(T1)\n')
+		self.read_until(older_replies, '1 ok')
+		younger.sendall('begin(T2)\nW(T2, x2, 1)\n')
+		self.read_until(younger_replies, '2 ok')
+
+		# The read is held behind the blocked write.
+		older.sendall('W(T1, x2, 2)\nR(T1, x1)\n')
+		self.read_until(older_replies, '2 ok')
+		self.assertEqual([], select.select([older], [], [], 0.2)[0])
+
+		# Both run once the younger transaction ends.
+		younger.sendall('end(T2)\n')
+		self.read_until(younger_replies, '3 ok')
+		lines = self.read_until(older_replies, '3 ok')
+		self.assertTrue(lines[0].startswith('* | ') and 'x2 <- 2' in lines[0],
+				lines)
+		self.assertTrue(any(line.startswith('3 | ') and 'x1' in line
+			for line in lines), lines)
+
+		older.sendall('end(T1)\n')
+		lines = self.read_until(older_replies, '4 ok')
+		self.assertTrue('committed' in lines[0], lines)
+
+	def test_close_on_disconnect(self):
+		''' Lines sent before the client stops sending run before closing. '''
+
+		sock, replies = self.connect()
+		sock.sendall('begin(T1)\nW(T1, x2, 5)\n')
+		sock.shutdown(socket.SHUT_WR)
+
+		lines = replies.read().splitlines()
+		self.assertEqual('2 ok', lines[-1])
+
+		# The transaction of the client stays open.
+		other, other_replies = self.connect()
+		other.sendall('begin(T1)\n')
+		self.assertTrue(other_replies.readline().startswith('1 error'))
+
+class TcpServerTest(ServerTest):
+	''' Run the server tests over TCP. '''
+
+	def address(self):
+		''' Address for the server to listen on. '''
+		return 'localhost:0'
+
+if __name__ == '__main__':
+	unittest.main()
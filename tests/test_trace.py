@@ -0,0 +1,48 @@
+'''
+Tests for Tracer.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec.trace import Tracer
+import unittest
+import StringIO
+import json
+import time
+
+class TracerTest(unittest.TestCase):
+
+	def test_trace(self):
+		'''
+		The trace is a JSON array of events, and each track is named once.
+		'''
+
+		stream = StringIO.StringIO()
+		tracer = Tracer(stream)
+		now = time.time()
+		tracer.span(Tracer.TRANSACTIONS, 1, 'read x2', now, now + 0.001)
+		tracer.span(Tracer.TRANSACTIONS, 1, 'commit', now + 0.002,
+				now + 0.003, dict(blocked=False))
+		tracer.span(Tracer.SITES, 3, 'flush', now + 0.002, now + 0.001)
+		tracer.flow(1, 2, 'blocks', now)
+		tracer.close()
+
+		events = json.loads(stream.getvalue())
+		spans = [event for event in events if event['ph'] == 'X']
+		self.assertEqual(['read x2', 'commit', 'flush'],
+				[span['name'] for span in spans])
+		self.assertTrue(abs(spans[1]['ts'] - spans[0]['ts'] - 2000) <= 1)
+		self.assertEqual({'blocked': False}, spans[1]['args'])
+		self.assertEqual(0, spans[2]['dur'])
+
+		track_names = sorted(event['args']['name'] for event in events
+				if event['ph'] == 'M' and event['name'] == 'thread_name')
+		self.assertEqual(['T1', 'T2', 'site 3'], track_names)
+
+		flow_start, flow_end = [event for event in events
+				if event['ph'] in ('s', 'f')]
+		self.assertEqual((1, 2), (flow_start['tid'], flow_end['tid']))
+		self.assertEqual(flow_start['id'], flow_end['id'])
+
+
+if __name__ == '__main__':
+	unittest.main()
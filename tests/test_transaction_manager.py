@@ -0,0 +1,171 @@
+'''
+Tests for TransactionManager.
+
+(c) 2013 Brandon Reiss
+'''
+
+from repcrec import TransactionManager, Topology
+from repcrec.commands import parse_commands
+from repcrec.event_log import EventLog
+from repcrec import util
+from test_util import Clock
+import unittest
+import time
+import os
+
+class TransactionManagerTest(unittest.TestCase):
+
+	def make_tm(self, **kwargs):
+		''' Make a TransactionManager that logs nothing. '''
+
+		transaction_manager = TransactionManager(
+				Topology().data_file_map(), self._test_dir,
+				event_log=EventLog(level=EventLog.OFF), **kwargs)
+		self._tms.append(transaction_manager)
+		return transaction_manager
+
+	def send(self, transaction_manager, *lines):
+		''' Send each line of commands as one tick. '''
+		for line in lines:
+			transaction_manager.send_commands(parse_commands(line))
+
+	def setUp(self):
+		''' Create test directory. '''
+
+		now = time.time()
+		self._test_dir = os.path.join('/tmp', 'testtm_{}'.format(now))
+		os.makedirs(self._test_dir)
+		self._tms = []
+
+	def tearDown(self):
+		''' Close transaction managers and cleanup test directory. '''
+
+		for transaction_manager in self._tms:
+			transaction_manager.close()
+
+		for dirpath, dirnames, filenames in os.walk(
+				self._test_dir, topdown=False):
+			for filename in filenames:
+				os.remove(os.path.join(dirpath, filename))
+			for dirname in dirnames:
+				os.rmdir(os.path.join(dirpath, dirname))
+		os.rmdir(self._test_dir)
+
+	def test_end_releases_snapshots_at_downed_sites(self):
+		''' A read-only transaction ending while a site is down unpins it. '''
+
+		transaction_manager = self.make_tm()
+		self.send(transaction_manager,
+				'beginRO(T1)', 'fail(3)', 'end(T1)', 'recover(3)',
+				'begin(T2)', 'W(T2, x2, 202)', 'end(T2)')
+
+		outcome = transaction_manager.get_commit_abort_log().outcome
+		self.assertEqual(TransactionManager.COMMITTED, outcome(1))
+		self.assertEqual(TransactionManager.COMMITTED, outcome(2))
+		self.assertEqual(0, transaction_manager.get_snapshot_stats()
+				['site_bytes'][3])
+
+	def test_snapshot_budget_ignores_ended_transactions(self):
+		''' Snapshots of ended transactions do not count against the budget. '''
+
+		transaction_manager = self.make_tm(snapshot_budget=50)
+		self.send(transaction_manager,
+				'beginRO(T1)', 'fail(3)', 'end(T1)', 'recover(3)',
+				'begin(T2)',
+				'W(T2, x2, 202); W(T2, x4, 204); W(T2, x6, 206)',
+				'W(T2, x8, 208); W(T2, x10, 210); W(T2, x12, 212)',
+				'end(T2)',
+				'beginRO(T3)', 'R(T3, x2)', 'end(T3)')
+
+		outcome = transaction_manager.get_commit_abort_log().outcome
+		self.assertEqual(TransactionManager.COMMITTED, outcome(3))
+		self.assertEqual(0, transaction_manager.get_snapshot_stats()['aborts'])
+
+	def test_lock_graph(self):
+		''' The lock graph follows a wait-die conflict as it resolves. '''
+
+		transaction_manager = self.make_tm()
+		self.send(transaction_manager,
+				'begin(T1)', 'begin(T2)', 'R(T1, x2); R(T2, x2)',
+				'W(T1, x2, 5)', 'begin(T3)', 'W(T3, x2, 7)')
+
+		# The promoting writer waits on the other reader but not on itself,
+		# and the younger writer dies.
+		graph = transaction_manager.get_lock_graph()
+		self.assertEqual(6, graph['tick'])
+		self.assertEqual([dict(txid=1, variable=2, blocked_by=[2])],
+				graph['waits_for'])
+		self.assertEqual(TransactionManager.ABORTED,
+				transaction_manager.get_commit_abort_log().outcome(3))
+
+		# Lock counters are summed over the sites holding x2.
+		counts = graph['variables'][0]
+		self.assertEqual(1, len(graph['variables']))
+		self.assertEqual(2, counts['variable'])
+		self.assertEqual(dict(blocks=1, wait_die_kills=1, waiting=1),
+				dict((name, counts[name])
+					for name in ('blocks', 'wait_die_kills', 'waiting')))
+		for name in ('lock_grants', 'lock_conflicts'):
+			by_site = [site.metrics_snapshot()[name].get(2, 0)
+					for site in transaction_manager._sites]
+			self.assertEqual(sum(by_site), counts[name])
+			self.assertTrue(counts[name] > max(by_site))
+
+		# The waiter leaves the graph once it runs.
+		self.send(transaction_manager, 'end(T2)', 'end(T1)')
+		graph = transaction_manager.get_lock_graph()
+		self.assertEqual([], graph['waits_for'])
+		self.assertEqual(0, graph['variables'][0]['waiting'])
+		self.assertEqual(TransactionManager.COMMITTED,
+				transaction_manager.get_commit_abort_log().outcome(1))
+
+	def test_latency_stats(self):
+		''' Ended transactions roll up into latency histograms. '''
+
+		transaction_manager = self.make_tm()
+		clock, util.time = util.time, Clock(100.)
+		try:
+			# Each tick takes a second, and T1 waits on T2 for two of them.
+			for line in ('begin(T1)', 'begin(T2)', 'W(T2, x2, 22)',
+					'W(T1, x2, 11)', 'end(T2)', 'end(T1)'):
+				self.send(transaction_manager, line)
+				util.time.now += 1.
+		finally:
+			util.time = clock
+
+		latency = transaction_manager.get_latency_stats()
+		commit, blocked = latency['commit'], latency['blocked']
+		self.assertEqual(2, len(commit))
+		self.assertEqual((3000000, 5000000), (commit.min, commit.max))
+		self.assertEqual(0, len(latency['abort']))
+		self.assertEqual(1, len(blocked))
+		self.assertEqual(2000000, blocked.max)
+		self.assertEqual([2], latency['variables'].keys())
+		self.assertEqual(1, len(latency['variables'][2]))
+		self.assertEqual(2000000, latency['variables'][2].max)
+
+	def test_latency_clock_step_back(self):
+		''' Latencies over which the wall clock steps back count as zero. '''
+
+		transaction_manager = self.make_tm()
+		clock, util.time = util.time, Clock(100.)
+		try:
+			for line, now in (('begin(T1)', 100.), ('begin(T2)', 101.),
+					('W(T2, x2, 22)', 102.), ('W(T1, x2, 11)', 103.),
+					('end(T2)', 90.), ('end(T1)', 91.)):
+				util.time.now = now
+				self.send(transaction_manager, line)
+		finally:
+			util.time = clock
+
+		outcome = transaction_manager.get_commit_abort_log().outcome
+		self.assertEqual(TransactionManager.COMMITTED, outcome(1))
+		self.assertEqual(TransactionManager.COMMITTED, outcome(2))
+		latency = transaction_manager.get_latency_stats()
+		self.assertEqual((2, 0), (len(latency['commit']),
+			latency['commit'].max))
+		self.assertEqual((1, 0), (len(latency['blocked']),
+			latency['blocked'].max))
+
+if __name__ == '__main__':
+	unittest.main()
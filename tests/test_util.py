@@ -0,0 +1,86 @@
+'''
+Tests for TxRecord timing.
+
+(c) 2013 Brandon Reiss
+'''
+from repcrec import util
+from repcrec.util import TxRecord
+import unittest
+
+class Clock(object):
+	''' Stand-in for the time module with a wall clock set by tests. '''
+
+	def __init__(self, now):
+		self.now = now
+
+	def time(self):
+		return self.now
+
+class TxRecordTest(unittest.TestCase):
+
+	def setUp(self):
+		''' Replace the wall clock of records. '''
+		self._time, util.time = util.time, Clock(100.)
+
+	def tearDown(self):
+		''' Restore the wall clock of records. '''
+		util.time = self._time
+
+	def test_timestamps(self):
+		''' Begin, first block, unblocks, and end are stamped. '''
+
+		clock = util.time
+		transaction = TxRecord(1, 3, [], None)
+		self.assertEqual((3, 100.), transaction.began_at)
+		self.assertEqual(None, transaction.first_blocked_at)
+
+		clock.now = 101.
+		transaction.mark_waiting(2, 4, 5)
+		clock.now = 102.
+		transaction.unblock(6)
+		clock.now = 104.
+		transaction.mark_waiting(2, 4, 7)
+		clock.now = 105.
+		transaction.unblock(8)
+		self.assertEqual((5, 101.), transaction.first_blocked_at)
+		self.assertEqual([(6, 102.), (8, 105.)], transaction.unblocked_at)
+		self.assertEqual(None, transaction.ended_at)
+
+		clock.now = 107.
+		transaction.mark_ended(9)
+		self.assertEqual((9, 107.), transaction.ended_at)
+
+	def test_blocked_seconds(self):
+		''' Time blocked counts against the blocker waited on at the time. '''
+
+		clock = util.time
+		transaction = TxRecord(1, 3, [], None)
+
+		# Retries that wait on the same blocker keep waiting.
+		clock.now = 101.
+		transaction.mark_waiting(2, 4, 5)
+		clock.now = 102.
+		transaction.mark_waiting(2, 4, 6)
+		self.assertEqual(((2, 4), 101.), transaction.waiting)
+
+		# A retry that waits on a new blocker moves the blame to it.
+		clock.now = 103.
+		transaction.mark_waiting(3, 4, 7)
+		self.assertEqual(((3, 4), 103.), transaction.waiting)
+		clock.now = 106.
+		transaction.unblock(8)
+		self.assertEqual(None, transaction.waiting)
+
+		# A wait without available sites has no blocker, and ending stops it.
+		clock.now = 107.
+		transaction.mark_waiting(None, 6, 9)
+		clock.now = 111.
+		transaction.mark_ended(10)
+
+		self.assertEqual([(2, 4, 101., 103.), (3, 4, 103., 106.),
+			(None, 6, 107., 111.)], transaction.waits)
+		self.assertEqual({(2, 4): 2., (3, 4): 3., (None, 6): 4.},
+				dict(transaction.blocked_seconds))
+
+if __name__ == '__main__':
+	unittest.main()